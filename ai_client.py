@@ -1,19 +1,274 @@
-import google.generativeai as genai
 import asyncio
 import json
 import os
+import re
+import time
 from dotenv import load_dotenv
 from mcp.client.stdio import stdio_client, StdioServerParameters
 from mcp import ClientSession
+from plan_cache import PlanCache, plan_key
 
-# Configure your Gemini API key
-load_dotenv()
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+MODEL_NAME = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+# Bump whenever the prompt text changes so cached plans from the old prompt are not reused
+PROMPT_VERSION = "1"
 
-async def main():
+_plan_cache = PlanCache(
+    path=os.environ.get("MSPAINT_PLAN_CACHE", os.path.join(os.path.expanduser("~"), ".mspaint_mcp", "plan_cache.json")),
+    ttl=float(os.environ.get("MSPAINT_PLAN_CACHE_TTL", str(7 * 24 * 3600))),
+)
+
+def make_model(model_name: str = MODEL_NAME):
+    """Configure Gemini (API key from the environment / .env) and return the model.
+    Imported lazily so the client can be driven by a stub model without it."""
+    import google.generativeai as genai
+    load_dotenv()
+    genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+    return genai.GenerativeModel(model_name)
+
+def build_prompt(user_command: str) -> str:
+    return f"""
+                Extract a list of actions from the following command. Each action should be a JSON object with 'tool_name' and 'args'.
+                \n\nIf the command is to open paint, the tool name is 'open_paint' and there are no arguments.
+                \n\nIf the command is to draw a rectangle, the tool name is 'draw_rectangle' and arguments should be 'x1', 'y1', 'x2', 'y2'.
+                \nAssume a canvas size of 1920x1080. If x1, y1, x2, y2 are not provided, use x1=650, y1=398, x2=1109, y2=690 as defaults.
+                \n\nIf the command is to add text, the tool name is 'add_text_in_paint' and the argument is 'text'.
+                \n\nOutput a JSON object with an 'actions' key, whose value is a list of action objects in the order they should be executed.
+                \nUser command: {user_command}\n"""
+
+def parse_plan(gemini_output: str) -> list:
+    """Strip a ```json fence and return the 'actions' list.
+    Raises json.JSONDecodeError for invalid JSON and ValueError for a bad shape."""
+    gemini_output = gemini_output.strip()
+    if gemini_output.startswith('```json') and gemini_output.endswith('```'):
+        gemini_output = gemini_output[len('```json'):-len('```')].strip()
+    actions = json.loads(gemini_output).get("actions", [])
+    if not isinstance(actions, list):
+        raise ValueError("'actions' is not a list.")
+    return actions
+
+# ---------------------------------------------------------------------------
+# Local command parser
+# ---------------------------------------------------------------------------
+# Common command shapes are turned into actions directly; anything else
+# (including a single clause that doesn't match) goes to the LLM.
+_DEFAULT_RECT = (650, 398, 1109, 690)  # same defaults the prompt gives the LLM
+_NUM = r"(-?\d+)"
+_SEP = r"\s*[,\s]\s*"
+_OPEN_RE = re.compile(r"^(?:please\s+)?(?:open|launch|start|run)\s+(?:up\s+)?(?:ms\s*|microsoft\s+)?paint$", re.IGNORECASE)
+_RECT_RE = re.compile(
+    r"^(?:please\s+)?(?:draw|make|create|add)\s+(?:a\s+|an?\s+|one\s+)?(?:rect|rectangle|box)"
+    r"(?:\s+(?:at|from)?\s*\(?" + _NUM + _SEP + _NUM + r"\)?(?:\s*(?:to|-)\s*|" + _SEP + r")\(?"
+    + _NUM + _SEP + _NUM + r"\)?)?$", re.IGNORECASE)
+_TEXT_RE = re.compile(
+    r"^(?:please\s+)?(?:write|type|(?:add|insert|put)\s+(?:the\s+)?text|text)\s*:?\s+"
+    r"(?:\"(?P<dq>[^\"]*)\"|'(?P<sq>[^']*)'|(?P<bare>.+?))(?:\s+(?:in|into|inside)\s+(?:it|the\s+(?:rectangle|box)))?$", re.IGNORECASE)
+# commas followed by a number belong to coordinates, not to a new clause
+_CLAUSE_SPLIT = re.compile(r"\s*(?:,\s*(?:and\s+)?then\b|;|,(?!\s*\(?-?\d)|\band\s+then\b|\bthen\b|\band\b)\s*", re.IGNORECASE)
+_QUOTED = re.compile(r"\"[^\"]*\"|'[^']*'")
+
+LOCAL_STATS = {"local": 0, "fallback": 0}
+
+def _split_clauses(command: str) -> list:
+    """Split on and/then/commas/semicolons, never inside quoted text."""
+    quoted = []
+    def _stash(m):
+        quoted.append(m.group(0))
+        return f"\0{len(quoted) - 1}\0"
+    masked = _QUOTED.sub(_stash, command)
+    clauses = [c for c in _CLAUSE_SPLIT.split(masked) if c]
+    return [re.sub(r"\0(\d+)\0", lambda m: quoted[int(m.group(1))], c) for c in clauses]
+
+def _parse_clause(clause: str):
+    # patterns ignore case; matching the original clause keeps the text's case
+    if _OPEN_RE.match(clause):
+        return {"tool_name": "open_paint", "args": {}}
+    m = _RECT_RE.match(clause)
+    if m:
+        coords = [int(v) for v in m.groups()] if m.group(1) is not None else list(_DEFAULT_RECT)
+        return {"tool_name": "draw_rectangle", "args": dict(zip(("x1", "y1", "x2", "y2"), coords))}
+    m = _TEXT_RE.match(clause)
+    if m:
+        text = next(g for g in (m.group("dq"), m.group("sq"), m.group("bare")) if g is not None)
+        return {"tool_name": "add_text_in_paint", "args": {"text": text}}
+    return None
+
+def parse_local(command: str):
+    """Actions for ``command`` if every clause matches a known shape, else None."""
+    text = command.strip().rstrip(".!")
+    if not text:
+        return None
+    actions = []
+    for clause in _split_clauses(text):
+        action = _parse_clause(clause)
+        if action is None:
+            return None
+        actions.append(action)
+    return actions or None
+
+_ACTIONS_START = re.compile(r'"actions"\s*:\s*\[')
+
+class ActionStreamParser:
+    """Incremental parser for the ``actions`` array of a streamed plan.
+
+    ``feed`` takes the next chunk of model output (fences and all) and returns
+    every action object completed by it, so each action can run while the
+    rest of the plan is still being generated. Strings and escapes are
+    tracked, so braces inside argument text don't confuse the depth count.
+    """
+    def __init__(self):
+        self._pending = ""  # text seen before the array opened
+        self._in_array = False
+        self.done = False
+        self._obj = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> list:
+        if self.done:
+            return []
+        if not self._in_array:
+            self._pending += text
+            match = _ACTIONS_START.search(self._pending)
+            if not match:
+                return []
+            self._in_array = True
+            text, self._pending = self._pending[match.end():], ""
+        completed = []
+        for ch in text:
+            if self._depth == 0:
+                if ch == "{":
+                    self._obj = [ch]
+                    self._depth = 1
+                elif ch == "]":
+                    self.done = True
+                    break
+                continue
+            self._obj.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.append(json.loads("".join(self._obj)))
+        return completed
+
+async def stream_actions(model, user_command: str, cache: PlanCache = _plan_cache,
+                         model_name: str = MODEL_NAME, info: dict = None):
+    """Yield the actions for ``user_command`` as soon as each one is available.
+
+    Commands the local parser understands and cached plans are replayed at
+    once; otherwise the model output is streamed
+    and fed through ``ActionStreamParser``. The complete output is validated
+    with ``parse_plan`` before the plan is cached (raising on invalid JSON,
+    possibly after earlier actions were yielded). ``info['source']`` is set to
+    'local', 'cache' or 'llm'."""
+    info = info if info is not None else {}
+    actions = parse_local(user_command)
+    if actions is not None:
+        LOCAL_STATS["local"] += 1
+        info["source"] = "local"
+        for action in actions:
+            yield action
+        return
+    LOCAL_STATS["fallback"] += 1
+    key = plan_key(user_command, PROMPT_VERSION, model_name)
+    actions = cache.get(key) if cache is not None else None
+    if actions is not None:
+        info["source"] = "cache"
+        for action in actions:
+            yield action
+        return
+    info["source"] = "llm"
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def _produce():
+        # generate_content blocks, so iterate the stream off the event loop
+        try:
+            for chunk in model.generate_content(build_prompt(user_command), stream=True):
+                loop.call_soon_threadsafe(queue.put_nowait, ("chunk", chunk.text))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", e))
+
+    producer = loop.run_in_executor(None, _produce)
+    parser = ActionStreamParser()
+    raw = []
+    yielded = 0
+    while True:
+        kind, payload = await queue.get()
+        if kind == "error":
+            raise payload
+        if kind == "done":
+            break
+        raw.append(payload)
+        for action in parser.feed(payload):
+            yielded += 1
+            yield action
+    await producer
+    output = "".join(raw)
+    print("Gemini's Raw Output:", output.strip())
+    actions = parse_plan(output)
+    # anything the incremental parser could not pick up runs now
+    for action in actions[yielded:]:
+        yield action
+    if cache is not None:
+        cache.put(key, actions, user_command)
+
+async def run_command(session, model, user_command: str, cache: PlanCache = _plan_cache) -> dict:
+    """Plan and execute one command; returns source, action count and latencies
+    (time to first action and end to end, in ms)."""
+    t0 = time.perf_counter()
+    info = {}
+    ttfa = None
+    count = 0
+    async for action in stream_actions(model, user_command, cache, info=info):
+        if ttfa is None:
+            ttfa = (time.perf_counter() - t0) * 1000.0
+        await execute_action(session, count, action)
+        count += 1
+    return {"source": info.get("source"), "actions": count,
+            "ttfa_ms": round(ttfa, 1) if ttfa is not None else None,
+            "total_ms": round((time.perf_counter() - t0) * 1000.0, 1)}
+
+async def execute_action(session, idx: int, action: dict):
+    tool_name = action.get("tool_name")
+    args = action.get("args", {})
+    print(f"\nExecuting action {idx+1}: {tool_name} with args {args}")
+    if tool_name == "open_paint":
+        print("Calling open_paint...")
+        result = await session.call_tool("open_paint", {})
+        print(f"Paint server response: {result.content[0].text if result.content else result}")
+    elif tool_name == "draw_rectangle":
+        x1 = args.get("x1", 650)
+        y1 = args.get("y1", 398)
+        x2 = args.get("x2", 1109)
+        y2 = args.get("y2", 690)
+        print(f"Calling draw_rectangle with x1={x1}, y1={y1}, x2={x2}, y2={y2}")
+        result = await session.call_tool("draw_rectangle", {"x1": x1, "y1": y1, "x2": x2, "y2": y2})
+        print(f"Paint server response: {result.content[0].text if result.content else result}")
+    elif tool_name == "add_text_in_paint":
+        text_content = args.get("text", "Default Text")
+        print(f"Calling add_text_in_paint with text='{text_content}'")
+        result = await session.call_tool("add_text_in_paint", {"text": text_content})
+        print(f"Paint server response: {result.content[0].text if result.content else result}")
+    else:
+        print(f"Error: Unknown tool_name '{tool_name}' received from Gemini.")
+
+async def main(model=None, cache: PlanCache = _plan_cache):
     # Set up connection to the MCP server using stdio transport
     server_params = StdioServerParameters(command="uv", args=["run", "app.py"])
-    model = genai.GenerativeModel('gemini-2.5-flash')
+    model = model or make_model()
 
     async with stdio_client(server_params) as (read, write):
         async with ClientSession(read, write) as session:
@@ -25,55 +280,21 @@ async def main():
                 if user_command.lower() == 'exit':
                     break
 
-                prompt = f"""
-                Extract a list of actions from the following command. Each action should be a JSON object with 'tool_name' and 'args'.
-                \n\nIf the command is to open paint, the tool name is 'open_paint' and there are no arguments.
-                \n\nIf the command is to draw a rectangle, the tool name is 'draw_rectangle' and arguments should be 'x1', 'y1', 'x2', 'y2'.
-                \nAssume a canvas size of 1920x1080. If x1, y1, x2, y2 are not provided, use x1=650, y1=398, x2=1109, y2=690 as defaults.
-                \n\nIf the command is to add text, the tool name is 'add_text_in_paint' and the argument is 'text'.
-                \n\nOutput a JSON object with an 'actions' key, whose value is a list of action objects in the order they should be executed.
-                \nUser command: {user_command}\n"""
-
                 try:
-                    response = model.generate_content(prompt)
-                    gemini_output = response.text.strip()
-                    if gemini_output.startswith('```json') and gemini_output.endswith('```'):
-                        gemini_output = gemini_output[len('```json'):-len('```')].strip()
-                    print("Gemini's Raw Output (after stripping markdown):", gemini_output)
                     try:
-                        actions_obj = json.loads(gemini_output)
-                        actions = actions_obj.get("actions", [])
-                        if not isinstance(actions, list):
-                            print("Error: 'actions' is not a list.")
-                            continue
-                        for idx, action in enumerate(actions):
-                            tool_name = action.get("tool_name")
-                            args = action.get("args", {})
-                            print(f"\nExecuting action {idx+1}: {tool_name} with args {args}")
-                            if tool_name == "open_paint":
-                                print("Calling open_paint...")
-                                result = await session.call_tool("open_paint", {})
-                                print(f"Paint server response: {result.content[0].text if result.content else result}")
-                            elif tool_name == "draw_rectangle":
-                                x1 = args.get("x1", 650)
-                                y1 = args.get("y1", 398)
-                                x2 = args.get("x2", 1109)
-                                y2 = args.get("y2", 690)
-                                print(f"Calling draw_rectangle with x1={x1}, y1={y1}, x2={x2}, y2={y2}")
-                                result = await session.call_tool("draw_rectangle", {"x1": x1, "y1": y1, "x2": x2, "y2": y2})
-                                print(f"Paint server response: {result.content[0].text if result.content else result}")
-                            elif tool_name == "add_text_in_paint":
-                                text_content = args.get("text", "Default Text")
-                                print(f"Calling add_text_in_paint with text='{text_content}'")
-                                result = await session.call_tool("add_text_in_paint", {"text": text_content})
-                                print(f"Paint server response: {result.content[0].text if result.content else result}")
-                            else:
-                                print(f"Error: Unknown tool_name '{tool_name}' received from Gemini.")
+                        result = await run_command(session, model, user_command, cache)
                     except json.JSONDecodeError:
                         print("Error: Gemini did not return a valid JSON object. Please try again with a clearer command.")
-                        print("Gemini's output was:", gemini_output)
+                        continue
+                    except ValueError as e:
+                        print(f"Error: {e}")
+                        continue
+                    print(f"Command done source={result['source']} actions={result['actions']} "
+                          f"ttfa_ms={result['ttfa_ms']} total_ms={result['total_ms']} "
+                          f"local_served={LOCAL_STATS['local']}/{LOCAL_STATS['local'] + LOCAL_STATS['fallback']} "
+                          f"cache={cache.stats() if cache is not None else None}")
                 except Exception as e:
                     print(f"An error occurred with Gemini API: {e}")
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,33 +1,73 @@
 
 import sys
-print("Python executable:", sys.executable)
-import hashlib, os
-try:
-    _APP_FILE = __file__
-    with open(_APP_FILE,'rb') as _f:
-        _data = _f.read()
-        _APP_MD5 = hashlib.md5(_data).hexdigest()
-        _APP_VERSION = _APP_MD5[:8]
-except Exception:
-    _APP_MD5 = 'unknown'
-    _APP_VERSION = 'unknown'
+import os
+import time
+import functools
+import importlib
 
 from mcp.server.fastmcp import FastMCP, Image
 from mcp.types import TextContent
-from PIL import Image as PILImage
-import time
-import sys
-from pywinauto.application import Application
-import win32gui
-import win32con
-from win32api import GetSystemMetrics
+import telemetry
+from strategy_stats import StrategyRanker
+from scene import Scene
+from undo_history import UndoHistory
+
+# Only a stat() at import; the source hash is computed on first use (see _app_md5)
+_APP_FILE = __file__
+try:
+    _st = os.stat(_APP_FILE)
+    _APP_STAT = (_st.st_size, _st.st_mtime_ns)
+except OSError:
+    _APP_STAT = None
+
+@functools.lru_cache(maxsize=None)
+def _app_md5() -> str:
+    """MD5 of this file, computed once on demand. If the file was edited after
+    import the hash no longer describes the loaded code, so it is suffixed."""
+    import hashlib
+    try:
+        with open(_APP_FILE, 'rb') as f:
+            md5 = hashlib.md5(f.read()).hexdigest()
+        return md5 if not _app_modified() else md5 + "-modified-since-import"
+    except Exception:
+        return 'unknown'
+
+def _app_version() -> str:
+    md5 = _app_md5()
+    return md5[:8] if md5 != 'unknown' else md5
+
+def _app_modified() -> bool:
+    try:
+        st = os.stat(_APP_FILE)
+        return _APP_STAT is not None and (st.st_size, st.st_mtime_ns) != _APP_STAT
+    except OSError:
+        return False
+
+class _LazyModule:
+    """Module proxy that imports ``name`` on first attribute access, keeping
+    Windows-only and heavy dependencies off the import path (headless workers,
+    fast cold start)."""
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self.__dict__['_name'])
+        return getattr(module, attr)
+
+win32gui = _LazyModule("win32gui")
+win32con = _LazyModule("win32con")
 
 # instantiate an MCP server client
 mcp = FastMCP("MSPaint")
 
 # Global variable to hold the Paint application instance
 paint_app = None
-_last_box_rel = None  # Stores ((start_rel),(end_rel)) of last rectangle/text box for reuse
+_scene = Scene()  # Every shape drawn this session; its last rect/text box is reused by add_text
+# Undo/redo of drawing operations; raster entries hold compressed pixel deltas
+_history = UndoHistory(max_bytes=int(float(os.environ.get("MSPAINT_UNDO_MB", "64")) * 1024 * 1024))
 
 # ---------------------------------------------------------------------------
 # Helper utilities
@@ -48,6 +88,38 @@ def _compute_centered_box(r, box_w=300, box_h=140):
     start_rel = (_clamp(cx - box_w//2, 5, max(6, w-20)), _clamp(cy - box_h//2, 5, max(6, h-20)))
     end_rel = (_clamp(start_rel[0] + box_w, 10, w-10), _clamp(start_rel[1] + box_h, 10, h-10))
     return start_rel, end_rel
+
+# ---------------------------------------------------------------------------
+# Text layout
+# ---------------------------------------------------------------------------
+# Text boxes are sized from measured text (text_layout.py) instead of always
+# using the fixed 300x140 box. Paint types in Calibri 11pt by default, about
+# 15px at 96 DPI; MSPAINT_TEXT_FONT / MSPAINT_TEXT_SIZE override both.
+_TEXT_SIZE = int(os.environ.get("MSPAINT_TEXT_SIZE", "15"))
+_TEXT_PAD = 4  # Paint's caret sits this far inside the text box border
+_text_layout_engine = None
+
+def _text_layout():
+    global _text_layout_engine
+    if _text_layout_engine is None:
+        from text_layout import TextLayout
+        _text_layout_engine = TextLayout(os.environ.get("MSPAINT_TEXT_FONT") or None)
+    return _text_layout_engine
+
+def _auto_text_box(r, text: str, size: int = None):
+    """Centered (start_rel, end_rel) box just large enough for ``text`` at
+    ``size`` px, wrapping at up to 60% of the canvas width."""
+    try:
+        w = r.width()
+    except Exception:
+        w = r.right - r.left
+    max_w = max(60, min(600, int(w * 0.6)) - 2 * _TEXT_PAD)
+    lay = _text_layout().layout(text, size or _TEXT_SIZE, max_w)
+    # a little slack so Paint's own wrapping (with kerning) never breaks earlier
+    box_w = max(60, lay.width + 2 * _TEXT_PAD + 12)
+    box_h = max(lay.line_height + 2 * _TEXT_PAD, lay.height + 2 * _TEXT_PAD + lay.line_height // 2)
+    return _compute_centered_box(r, box_w, box_h)
+
 def _debug_controls(window):
     try:
         import io, sys as _sys
@@ -62,23 +134,305 @@ def _debug_controls(window):
     except Exception as e:  # pragma: no cover
         return f"(Could not capture control identifiers: {e})"
 
+
+# ---------------------------------------------------------------------------
+# Structured UI tree snapshots
+# ---------------------------------------------------------------------------
+def _node_rect(info):
+    try:
+        r = info.rectangle
+        return [r.left, r.top, r.right, r.bottom]
+    except Exception:
+        return None
+
+class _TreeSnapshotter:
+    """Structured, depth/node-limited snapshots of the Paint control tree.
+
+    Nodes are plain dicts (key, control type, auto_id, name, rect) gathered by
+    walking ``element_info`` objects breadth-first, which is far cheaper than
+    ``print_control_identifiers``. Keys are built from type/auto_id (or name)
+    path segments so they stay stable between snapshots; the previous snapshot
+    per window and option set is kept for diffing and short-lived reuse.
+    """
+    def __init__(self):
+        self._last = {}  # (hwnd, options) -> (taken_at, {key: node})
+
+    def take(self, window, max_depth=3, max_nodes=200, root=None, control_types=None):
+        """Return ({key: node}, truncated) for ``window`` (or the subtree whose
+        auto_id/name equals ``root``). ``control_types`` filters which nodes
+        are reported, not which are traversed."""
+        info = _as_wrapper(window).element_info
+        if root:
+            found = self._find(info, root, max_depth + 8)
+            if found is None:
+                raise RuntimeError(f"Subtree root '{root}' not found")
+            info = found
+        wanted = {t.lower() for t in control_types} if control_types else None
+        nodes = {}
+        seen = set()
+        truncated = False
+        queue = [(info, "", 0)]
+        visited = 0
+        while queue:
+            el, parent_key, depth = queue.pop(0)
+            ctype = getattr(el, 'control_type', None) or getattr(el, 'class_name', '') or ''
+            auto_id = getattr(el, 'automation_id', '') or ''
+            name = getattr(el, 'name', '') or ''
+            segment = f"{ctype}:{auto_id or name[:40]}"
+            key = f"{parent_key}/{segment}" if parent_key else segment
+            dup = 1
+            while key in seen:
+                dup += 1
+                key = f"{parent_key}/{segment}#{dup}" if parent_key else f"{segment}#{dup}"
+            seen.add(key)
+            visited += 1
+            if wanted is None or ctype.lower() in wanted:
+                nodes[key] = {"key": key, "type": ctype, "auto_id": auto_id, "name": name,
+                              "rect": _node_rect(el), "depth": depth}
+            if visited >= max_nodes:
+                truncated = bool(queue) or depth < max_depth
+                break
+            if depth < max_depth:
+                try:
+                    children = el.children()
+                except Exception:
+                    children = []
+                queue.extend((child, key, depth + 1) for child in children)
+        return nodes, truncated
+
+    def _find(self, info, target, max_depth):
+        queue = [(info, 0)]
+        while queue:
+            el, depth = queue.pop(0)
+            if target in ((getattr(el, 'automation_id', '') or ''), (getattr(el, 'name', '') or '')):
+                return el
+            if depth < max_depth:
+                try:
+                    queue.extend((child, depth + 1) for child in el.children())
+                except Exception:
+                    pass
+        return None
+
+    def snapshot(self, window, max_depth=3, max_nodes=200, root=None, control_types=None,
+                 diff=True, max_age=0.0) -> dict:
+        """Snapshot plus, when ``diff`` is set and an earlier snapshot with the
+        same options exists, only the added/removed/changed nodes. A cached
+        snapshot younger than ``max_age`` seconds is reused without a walk."""
+        options = (max_depth, max_nodes, root, tuple(sorted(control_types or ())))
+        try:
+            hwnd = _as_wrapper(window).handle
+        except Exception:
+            hwnd = None
+        cache_key = (hwnd, options)
+        prev = self._last.get(cache_key)
+        now = time.monotonic()
+        if prev is not None and max_age and now - prev[0] < max_age:
+            return {"cached": True, "node_count": len(prev[1]), "truncated": prev[2],
+                    "added": [], "removed": [], "changed": []} if diff else \
+                   {"cached": True, "node_count": len(prev[1]), "truncated": prev[2], "nodes": list(prev[1].values())}
+        t0 = time.perf_counter()
+        nodes, truncated = self.take(window, max_depth, max_nodes, root, control_types)
+        self._last[cache_key] = (now, nodes, truncated)
+        result = {"cached": False, "node_count": len(nodes), "truncated": truncated, "walk_ms": _ms_since(t0)}
+        if diff and prev is not None:
+            old = prev[1]
+            result["added"] = [nodes[k] for k in nodes if k not in old]
+            result["removed"] = [k for k in old if k not in nodes]
+            result["changed"] = [nodes[k] for k in nodes if k in old and nodes[k] != old[k]]
+        else:
+            result["nodes"] = list(nodes.values())
+        return result
+
+_snapshotter = _TreeSnapshotter()
+
+def _snapshot_text(window, max_depth=2, max_nodes=60) -> str:
+    """Compact JSON snapshot for status/error messages (no diffing)."""
+    import json
+    try:
+        snap = _snapshotter.snapshot(window, max_depth=max_depth, max_nodes=max_nodes, diff=False)
+        return json.dumps(snap, separators=(",", ":"))
+    except Exception as e:  # pragma: no cover
+        return f"(Could not capture UI snapshot: {e})"
+
+# ---------------------------------------------------------------------------
+# Adaptive waits
+# ---------------------------------------------------------------------------
+class AdaptiveWaiter:
+    """Poll a readiness condition with exponential backoff instead of sleeping a
+    fixed amount. Each named wait keeps an EWMA of how long the condition took
+    to become true, and the first re-check is scheduled just before that typical
+    latency, so waits shrink toward what the machine actually needs.
+
+    ``clock`` and ``sleep`` are injectable so the policy can be exercised
+    against a fake clock and a fake UI.
+    """
+    def __init__(self, clock=time.monotonic, sleep=time.sleep, first_interval=0.02,
+                 max_interval=0.25, backoff=1.6, alpha=0.3):
+        self.clock = clock
+        self.sleep = sleep
+        self.first_interval = first_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.alpha = alpha
+        self._latency = {}  # name -> EWMA seconds until ready
+        self._stats = {}    # name -> {"calls", "timeouts", "polls"}
+
+    def learned(self, name):
+        """Typical readiness latency (seconds) for ``name`` or None if unseen."""
+        return self._latency.get(name)
+
+    def until(self, name, condition, timeout=2.0):
+        """Return the first truthy result of ``condition()`` or None once ``timeout``
+        elapses. Exceptions raised by the condition count as "not ready"."""
+        stats = self._stats.setdefault(name, {"calls": 0, "timeouts": 0, "polls": 0})
+        stats["calls"] += 1
+        start = self.clock()
+        deadline = start + timeout
+        learned = self._latency.get(name)
+        interval = self.first_interval
+        first_sleep = max(self.first_interval, learned * 0.9) if learned else self.first_interval
+        while True:
+            stats["polls"] += 1
+            try:
+                result = condition()
+            except Exception:
+                result = None
+            now = self.clock()
+            if result:
+                self._record(name, now - start)
+                return result
+            if now >= deadline:
+                stats["timeouts"] += 1
+                return None
+            if first_sleep is not None:
+                delay, first_sleep = first_sleep, None
+            else:
+                delay = interval
+                interval = min(interval * self.backoff, self.max_interval)
+            self.sleep(min(delay, deadline - now))
+
+    def _record(self, name, elapsed):
+        prev = self._latency.get(name)
+        self._latency[name] = elapsed if prev is None else (1 - self.alpha) * prev + self.alpha * elapsed
+
+    def stats(self) -> dict:
+        out = {}
+        for name, st in self._stats.items():
+            learned = self._latency.get(name)
+            out[name] = dict(st, learned_ms=round(learned * 1000.0, 1) if learned is not None else None)
+        return out
+
+_waiter = AdaptiveWaiter()
+
+def _window_ready(win):
+    """Readiness condition for a freshly started Paint window."""
+    return win.exists(timeout=0) and win.is_visible() and win.is_enabled()
+
+def _is_foreground(paint_window) -> bool:
+    try:
+        return win32gui.GetForegroundWindow() == _as_wrapper(paint_window).handle
+    except Exception:
+        return False
+
+def _tool_active(btn):
+    """True/False when the button exposes toggle or selection state, None if unknown."""
+    for probe in ("get_toggle_state", "is_selected"):
+        fn = getattr(btn, probe, None)
+        if fn is None:
+            continue
+        try:
+            return bool(fn())
+        except Exception:
+            continue
+    return None
+
+def _find_overlay(paint_window):
+    """Return the Text tool's overlay Edit control if it currently exists."""
+    overlay = paint_window.child_window(control_type="Edit")
+    return overlay if overlay.exists(timeout=0) else None
+
+class _WindowPool:
+    """The resolved Paint window (HWND + PID) and one Application/window pair per
+    pywinauto backend attached to it. While the HWND passes a cheap liveness
+    check (IsWindow + owning PID unchanged) callers reuse these objects and the
+    title-regex connect/start ladder is skipped entirely."""
+    def __init__(self):
+        self.hwnd = None
+        self.pid = None
+        self._pairs = {}  # backend name -> (Application, WindowSpecification by handle)
+        self.fast_hits = 0
+        self.reconnects = 0
+
+    def reset(self):
+        self.hwnd = None
+        self.pid = None
+        self._pairs = {}
+
+    def alive(self) -> bool:
+        if not self.hwnd:
+            return False
+        try:
+            import win32process
+            return bool(win32gui.IsWindow(self.hwnd)) and \
+                win32process.GetWindowThreadProcessId(self.hwnd)[1] == self.pid
+        except Exception:
+            return False
+
+    def adopt(self, app, win):
+        """Record the window found by a full connect as the pooled target."""
+        wrapper = _as_wrapper(win)
+        hwnd = wrapper.handle
+        if hwnd != self.hwnd:
+            self._pairs = {}
+        self.hwnd = hwnd
+        self.pid = wrapper.process_id()
+        self._pairs[_app_backend_name(app)] = (app, app.window(handle=hwnd))
+        self.reconnects += 1
+
+    def get(self, backend: str):
+        """(app, window) for ``backend``, attaching to the pooled HWND on first use."""
+        pair = self._pairs.get(backend)
+        if pair is None:
+            from pywinauto.application import Application
+            app = Application(backend=backend).connect(handle=self.hwnd)
+            pair = self._pairs[backend] = (app, app.window(handle=self.hwnd))
+        return pair
+
+    def stats(self) -> dict:
+        return {"hwnd": self.hwnd, "pid": self.pid, "backends": ",".join(sorted(self._pairs)),
+                "fast_hits": self.fast_hits, "reconnects": self.reconnects}
+
+_window_pool = _WindowPool()
+
 def get_paint_window(start_if_missing: bool = False):
     """Return (app, window) tuple for Paint.
-    Primary attempt: backend='uia'. If connection/start fails OR later calls can't
-    locate expected controls (caller can re-call with fallback flag), we attempt
-    backend='win32'.
+    Fast path: the pooled HWND from an earlier connect, validated by a cheap
+    liveness check. Otherwise a full connect is made (see _connect_paint_window)
+    and its window becomes the pooled target.
     """
     global paint_app
-    from pywinauto.application import Application
-    # If we already have an application instance, verify window exists
-    if paint_app:
+    if paint_app and _window_pool.alive():
         try:
-            win = paint_app.window(title_re=".*Paint.*")
-            if win.exists():
-                return paint_app, win
+            paint_app, win = _window_pool.get(_app_backend_name(paint_app))
+            _window_pool.fast_hits += 1
+            return paint_app, win
         except Exception:
             pass
+    _window_pool.reset()
+    app, win = _connect_paint_window(start_if_missing)
+    try:
+        _window_pool.adopt(app, win)
+    except Exception:
+        pass
+    return app, win
 
+def _connect_paint_window(start_if_missing: bool = False):
+    """Full connect: backend='uia' first. If connection/start fails OR later calls
+    can't locate expected controls (caller can re-call with fallback flag), we
+    attempt backend='win32'.
+    """
+    global paint_app
+    from pywinauto.application import Application
     last_exc = None
     # Try UIA connect
     try:
@@ -92,9 +446,9 @@ def get_paint_window(start_if_missing: bool = False):
     if start_if_missing:
         try:
             paint_app = Application(backend='uia').start('mspaint.exe')
-            time.sleep(0.9)
             win = paint_app.window(title_re=".*Paint.*")
-            win.wait('exists visible enabled ready', timeout=6)
+            if not _waiter.until("window_ready", lambda: _window_ready(win), timeout=6):
+                raise RuntimeError("Paint window did not become ready within 6s")
             return paint_app, win
         except Exception as e:
             last_exc = e
@@ -110,30 +464,35 @@ def get_paint_window(start_if_missing: bool = False):
     if start_if_missing:
         try:
             paint_app = Application(backend='win32').start('mspaint.exe')
-            time.sleep(0.9)
             win = paint_app.window(title_re=".*Paint.*")
-            win.wait('exists visible enabled ready', timeout=6)
+            if not _waiter.until("window_ready", lambda: _window_ready(win), timeout=6):
+                raise RuntimeError("Paint window did not become ready within 6s")
             return paint_app, win
         except Exception as e:
             last_exc = e
     raise RuntimeError(f"Paint window not found (last_error={last_exc})")
 
+def _app_backend_name(app) -> str:
+    """Name of a pywinauto Application's backend ('uia' / 'win32')."""
+    backend = getattr(app, 'backend', None)
+    return getattr(backend, 'name', None) or str(backend)
+
 def _reconnect_uia_if_win32():
     """If current backend is win32, attempt a UIA reconnect for richer element access.
     Returns (app, window) on success else (paint_app, existing_window_or_none)."""
     global paint_app
     try:
-        if paint_app and getattr(paint_app, 'backend', None) == 'win32':
+        if paint_app and _app_backend_name(paint_app) == 'win32' and _window_pool.alive():
             try:
-                # Attempt to connect via UIA to same title
-                uia_app = Application(backend='uia').connect(title_re=".*Paint.*")
-                win = uia_app.window(title_re=".*Paint.*")
-                if win.exists():
-                    paint_app = uia_app
-                    return paint_app, win
+                # Attach the pooled UIA wrapper to the same HWND (created once, then reused)
+                uia_app, win = _window_pool.get('uia')
+                paint_app = uia_app
+                return paint_app, win
             except Exception:
                 pass
         if paint_app:
+            if _window_pool.alive():
+                return _window_pool.get(_app_backend_name(paint_app))
             try:
                 win = paint_app.window(title_re=".*Paint.*")
                 return paint_app, win
@@ -143,7 +502,152 @@ def _reconnect_uia_if_win32():
     except Exception:
         return paint_app, None
 
+# ---------------------------------------------------------------------------
+# Control locator cache
+# ---------------------------------------------------------------------------
+def _as_wrapper(ctrl):
+    """Resolve a WindowSpecification to its concrete wrapper so later calls
+    don't repeat the tree search. Wrappers are returned unchanged."""
+    resolve = getattr(ctrl, 'wrapper_object', None)
+    return resolve() if callable(resolve) else ctrl
+
+def _resolve_control(parent, locators):
+    """Return the wrapper for the first locator that exists under ``parent``, else None."""
+    for locator in locators:
+        try:
+            spec = parent.child_window(**locator)
+            if spec.exists():
+                return _as_wrapper(spec)
+        except Exception:
+            continue
+    return None
+
+def _is_alive(wrapper) -> bool:
+    """Cheap liveness probe: stale UIA elements raise on property access."""
+    try:
+        return bool(wrapper.is_visible())
+    except Exception:
+        return False
+
+class _LocatorCache:
+    """Resolved control wrappers (canvas, tool buttons, Shapes group, scrollViewer)
+    keyed by (window handle, backend). Everything is dropped when the handle or
+    backend changes or the window is resized; single entries are dropped when
+    their liveness probe fails."""
+    def __init__(self):
+        self._key = None
+        self._window_rect = None
+        self._items = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        if self._items:
+            self.invalidations += 1
+        self._items = {}
+
+    def _check_window(self, paint_window):
+        win = _as_wrapper(paint_window)
+        backend = getattr(getattr(win, 'backend', None), 'name', None)
+        key = (getattr(win, 'handle', None), backend)
+        try:
+            r = win.rectangle()
+            window_rect = (r.left, r.top, r.right, r.bottom)
+        except Exception:
+            window_rect = None
+        if key != self._key or window_rect != self._window_rect:
+            self.invalidate()
+            self._key = key
+            self._window_rect = window_rect
+
+    def get(self, paint_window, name, resolve):
+        """Return the cached wrapper for ``name`` or call ``resolve()`` to find it.
+        ``resolve`` may return None (not cached) or raise (propagated)."""
+        try:
+            self._check_window(paint_window)
+        except Exception:
+            self.invalidate()
+        ctrl = self._items.get(name)
+        if ctrl is not None:
+            if _is_alive(ctrl):
+                self.hits += 1
+                return ctrl
+            self._items.pop(name, None)
+            self.invalidations += 1
+        self.misses += 1
+        ctrl = resolve()
+        if ctrl is not None:
+            ctrl = _as_wrapper(ctrl)
+            self._items[name] = ctrl
+        return ctrl
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                "entries": len(self._items)}
+
+_locator_cache = _LocatorCache()
+
+class _PaintState:
+    """Last known state of one Paint window: the active tool button and what
+    is still open on the canvas (None, "shape" for an editable shape or "text"
+    for a text box). Tool clicks, their settle waits and the ESC that clears
+    selections are skipped when Paint is already where the next call needs it.
+    A tracked tool is confirmed through the button's toggle/selection state
+    where Paint exposes one and trusted otherwise; any failure forgets the
+    state so the next call clicks again."""
+    def __init__(self):
+        self._hwnd = None
+        self.tool = None
+        self.selection = None
+        self.tool_clicks = 0
+        self.tool_skips = 0
+        self.esc_sent = 0
+        self.esc_skips = 0
+
+    def sync(self, paint_window):
+        """Forget everything when ``paint_window`` is not the tracked window."""
+        try:
+            hwnd = _as_wrapper(paint_window).handle
+        except Exception:
+            hwnd = None
+        if hwnd is None or hwnd != self._hwnd:
+            self.forget()
+            self._hwnd = hwnd
+
+    def forget(self):
+        self.tool = None
+        self.selection = None
+
+    def stats(self) -> dict:
+        return {"tool": self.tool, "selection": self.selection, "tool_clicks": self.tool_clicks,
+                "tool_skips": self.tool_skips, "esc_sent": self.esc_sent, "esc_skips": self.esc_skips}
+
+_paint_state = _PaintState()
+
+def _clear_selection(paint_window):
+    """ESC away an open text box. Shapes are committed by the next drag or tool
+    click anyway, so ESC is only sent when a text box is (or may be) open."""
+    _paint_state.sync(paint_window)
+    if _paint_state.selection != "text" and _find_overlay(paint_window) is None:
+        _paint_state.esc_skips += 1
+        return
+    paint_window.type_keys('{ESC}', set_foreground=True)
+    _paint_state.esc_sent += 1
+    _paint_state.selection = None
+    _waiter.until("overlay_cleared", lambda: _find_overlay(paint_window) is None, timeout=0.3)
+
+def _scroll_viewer(paint_window):
+    return _locator_cache.get(paint_window, "scrollViewer", lambda: _resolve_control(
+        paint_window, [dict(auto_id="scrollViewer", control_type="Pane")]))
+
 def find_canvas(paint_window, timeout: float = 2.0):
+    """Cached front end for ``_find_canvas_uncached``; the tree walk only runs
+    when the cache is cold or has been invalidated."""
+    with telemetry.stage("find_canvas"):
+        return _locator_cache.get(paint_window, "canvas", lambda: _find_canvas_uncached(paint_window, timeout))
+
+def _find_canvas_uncached(paint_window, timeout: float = 2.0):
     """Attempt multiple strategies to locate a drawable canvas element.
     Returns a control wrapper or raises RuntimeError.
     Strategies:
@@ -153,18 +657,13 @@ def find_canvas(paint_window, timeout: float = 2.0):
       4. Deep search for largest Group inside scrollViewer
       5. Fallback: largest descendant Group overall
     """
-    import time as _t
-    deadline = _t.time() + timeout
-    last_err = None
-    # 1 (retry until timeout)
-    while _t.time() < deadline:
-        try:
-            canvas = paint_window.child_window(auto_id="image", control_type="Group")
-            if canvas.exists():
-                return canvas
-        except Exception as e:
-            last_err = e
-        _t.sleep(0.15)
+    # 1 (poll until timeout)
+    def _image_group():
+        canvas = paint_window.child_window(auto_id="image", control_type="Group")
+        return canvas if canvas.exists(timeout=0) else None
+    canvas = _waiter.until("canvas_image", _image_group, timeout=timeout)
+    if canvas is not None:
+        return canvas
     # 2
     try:
         canvas = paint_window.child_window(class_name='MSPaintView')
@@ -172,10 +671,11 @@ def find_canvas(paint_window, timeout: float = 2.0):
             return canvas
     except Exception:
         pass
-    # 3 title contains 'canvas'
+    # 3 title contains 'canvas' (the Group walk is reused by strategy 5)
+    all_groups = None
     try:
-        candidates = paint_window.descendants(control_type="Group")
-        for c in candidates:
+        all_groups = paint_window.descendants(control_type="Group")
+        for c in all_groups:
             try:
                 title = getattr(c.element_info, 'name', '') or ''
                 if title and 'canvas' in title.lower():
@@ -187,8 +687,8 @@ def find_canvas(paint_window, timeout: float = 2.0):
         pass
     # 4 heuristic: pick biggest group inside scrollViewer
     try:
-        sv = paint_window.child_window(auto_id="scrollViewer", control_type="Pane")
-        if sv.exists():
+        sv = _scroll_viewer(paint_window)
+        if sv is not None:
             groups = sv.descendants(control_type="Group")
             biggest = None
             biggest_area = 0
@@ -207,7 +707,7 @@ def find_canvas(paint_window, timeout: float = 2.0):
         pass
     # 5 overall biggest group as last resort
     try:
-        groups = paint_window.descendants(control_type="Group")
+        groups = all_groups if all_groups is not None else paint_window.descendants(control_type="Group")
         biggest = None
         biggest_area = 0
         for g in groups:
@@ -233,8 +733,8 @@ def _approx_canvas_rect(paint_window):
     Returns (left, top, right, bottom) tuple or None if impossible.
     """
     try:
-        sv = paint_window.child_window(auto_id="scrollViewer", control_type="Pane")
-        if sv.exists():
+        sv = _scroll_viewer(paint_window)
+        if sv is not None:
             r = sv.rectangle()
             # Provide gentle insets to avoid toolbar overlays
             return (r.left + 50, r.top + 30, r.right - 60, r.bottom - 120)
@@ -247,301 +747,787 @@ def _approx_canvas_rect(paint_window):
     except Exception:
         return None
 
-@mcp.tool()
-async def diagnostics() -> dict:
-    """Return diagnostic info about runtime environment and Paint process state."""
-    import hashlib, os, inspect
-    details = []
-    # Python executable
-    details.append(f"python_executable={sys.executable}")
-    # File path & hash
+class _Rect:
+    """Minimal rectangle with the same shape as a pywinauto RECT so geometry
+    helpers (``_compute_centered_box`` etc.) work for non-GUI canvases too."""
+    def __init__(self, left, top, right, bottom):
+        self.left, self.top, self.right, self.bottom = left, top, right, bottom
+    def width(self):
+        return self.right - self.left
+    def height(self):
+        return self.bottom - self.top
+    def __repr__(self):
+        return f"(L{self.left}, T{self.top}, R{self.right}, B{self.bottom})"
+
+def _resolve_box(r, x1=None, y1=None, x2=None, y2=None, min_size=10):
+    """Return (start_rel, end_rel, use_custom) for a rectangle request against
+    canvas rect ``r``. Coordinates are treated as canvas-relative; when they are
+    omitted or fall outside the canvas the centered default box is used."""
     try:
-        current_file = inspect.getsourcefile(sys.modules[__name__]) or __file__
-        if os.path.exists(current_file):
-            with open(current_file,'rb') as f:
-                data = f.read()
-            md5 = hashlib.md5(data).hexdigest()
-            details.append(f"app_file={current_file}")
-            details.append(f"app_md5={md5}")
-            details.append(f"app_version={_APP_VERSION}")
+        w = r.width(); h = r.height()
+    except Exception:
+        w = (r.right - r.left); h = (r.bottom - r.top)
+    if all(v is not None for v in [x1,y1,x2,y2]):
+        rx1, ry1, rx2, ry2 = x1, y1, x2, y2
+        # Ensure ordering
+        if rx2 < rx1: rx1, rx2 = rx2, rx1
+        if ry2 < ry1: ry1, ry2 = ry2, ry1
+        if 0 <= rx1 < w and 0 <= ry1 < h and 0 < rx2 <= w and 0 < ry2 <= h and (rx2-rx1) >= min_size and (ry2-ry1) >= min_size:
+            return (rx1, ry1), (rx2, ry2), True
+    start_rel, end_rel = _compute_centered_box(r)
+    return start_rel, end_rel, False
+
+def _shape_box(shape_id: int):
+    """(x1, y1, x2, y2) of a scene shape; ValueError for unknown ids."""
+    shape = _scene.get(int(shape_id))
+    if shape is None:
+        raise ValueError(f"Unknown shape_id {shape_id}")
+    return shape.box
+
+def _op_box(op: dict):
+    """Return the optional (x1, y1, x2, y2) target box of a batch operation,
+    given as coordinates or as the ``shape_id`` of an earlier shape."""
+    if op.get("shape_id") is not None:
+        return _shape_box(op["shape_id"])
+    coords = [op.get(k) for k in ("x1", "y1", "x2", "y2")]
+    return tuple(coords) if all(v is not None for v in coords) else None
+
+def _simplify_rdp(points, tolerance: float):
+    """Ramer-Douglas-Peucker: drop points closer than ``tolerance`` pixels to
+    the simplified polyline. Iterative (no recursion limit on long strokes),
+    with the per-span distance pass vectorized in NumPy; ``tolerance <= 0``
+    only removes consecutive duplicates."""
+    pts = [(int(p[0]), int(p[1])) for p in points]
+    pts = [p for i, p in enumerate(pts) if i == 0 or p != pts[i - 1]]
+    if tolerance <= 0 or len(pts) < 3:
+        return pts
+    import numpy as np
+    xy = np.asarray(pts, dtype=np.float64)
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    tol2 = tolerance * tolerance
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        a, b = xy[first], xy[last]
+        d = b - a
+        seg2 = d @ d
+        span = xy[first + 1:last] - a
+        if seg2:
+            # squared distance to the chord, clamped to its end points
+            t = np.clip(span @ d / seg2, 0.0, 1.0)
+            err = span - t[:, None] * d
         else:
-            details.append(f"app_file_missing={current_file}")
-    except Exception as e:
-        details.append(f"file_hash_error={e}")
-    # Paint process info
-    global paint_app
+            err = span
+        d2 = np.einsum("ij,ij->i", err, err)
+        i = int(np.argmax(d2))
+        if d2[i] > tol2:
+            worst = first + 1 + i
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [p for p, k in zip(pts, keep) if k]
+
+def _stroke_status(shape, points_in: int, pts, seconds: float, tolerance: float, offset=(0, 0)) -> str:
+    rate = points_in / seconds if seconds > 0 else float("inf")
+    start = (pts[0][0] + offset[0], pts[0][1] + offset[1])
+    end = (pts[-1][0] + offset[0], pts[-1][1] + offset[1])
+    return (f"Stroke drawn success=True shape_id={shape.id if shape else None} points={points_in} "
+            f"points_sent={len(pts)} tolerance={tolerance} abs_start={start} abs_end={end} "
+            f"ms={round(seconds * 1000.0, 2)} points_per_sec={rate:.0f} v={_app_version()}")
+
+def _points_bbox(points):
+    xs = [int(p[0]) for p in points]
+    ys = [int(p[1]) for p in points]
+    return (min(xs), min(ys), max(xs), max(ys))
+
+def _status_ok(status: str) -> bool:
+    """Backends report success as ``success=True`` inside their status line."""
+    return "success=True" in (status or "")
+
+def _ms_since(t0: float) -> float:
+    return round((time.perf_counter() - t0) * 1000.0, 2)
+
+# ---------------------------------------------------------------------------
+# Pixel verification
+# ---------------------------------------------------------------------------
+# Drawing calls grab their target box before and after the operation and
+# compare the two; an injection method only counts as successful once pixels
+# actually changed. MSPAINT_VERIFY=0 turns the grabs off.
+_VERIFY = os.environ.get("MSPAINT_VERIFY", "1") != "0"
+_VERIFY_MIN_PIXELS = int(os.environ.get("MSPAINT_VERIFY_MIN_PIXELS", "4"))
+_VERIFY_SETTLE = float(os.environ.get("MSPAINT_VERIFY_SETTLE", "0.6"))  # seconds to wait for a repaint
+
+def _verify_region(rel_box, width, height, pad=3):
+    """Canvas-relative (x1, y1, x2, y2) around ``rel_box`` ((x, y), (x, y)), clamped."""
+    (sx, sy), (ex, ey) = rel_box
+    return (max(0, min(sx, ex) - pad), max(0, min(sy, ey) - pad),
+            min(width, max(sx, ex) + pad + 1), min(height, max(sy, ey) + pad + 1))
+
+def _pixel_change(before, after, region) -> dict:
+    """Vectorized diff of two grabs of ``region``, flagged ``verified`` once
+    enough pixels changed. The change bbox is made canvas-relative."""
+    from canvas_capture import pixel_diff
+    with telemetry.stage("verify.diff"):
+        change = pixel_diff(before, after)
+    if change["bbox"] is not None:
+        x1, y1, x2, y2 = change["bbox"]
+        change["bbox"] = (x1 + region[0], y1 + region[1], x2 + region[0], y2 + region[1])
+    change["verified"] = change["changed_pixels"] >= _VERIFY_MIN_PIXELS
+    return change
+
+def _verified(change):
+    """``change`` if it is verified, else None (a condition for ``_waiter.until``)."""
+    return change if change["verified"] else None
+
+def _verify_parts(change) -> list:
+    if change is None:
+        return ["verified=None"]
+    return [f"verified={change['verified']}", f"changed_ratio={change['changed_ratio']:.4f}",
+            f"change_bbox={change['bbox']}"]
+
+# ---------------------------------------------------------------------------
+# Operation journal
+# ---------------------------------------------------------------------------
+# Successful drawing operations are appended to a binary journal (see
+# journal.py) so a session can be replayed after a crash. MSPAINT_JOURNAL
+# sets the path; "0" or "off" disables it.
+_journal = None
+_JOURNAL_OFF = ("", "0", "off", "false")
+
+def _begin_journal_session(replay: bool = True) -> str:
+    """Pick up the journal at server startup; returns a note for the log.
+
+    By default the previous session is resumed: the journal is compacted
+    (bounding its size without dropping anything still live) and, with
+    ``replay``, redrawn into a raster canvas. Live Paint is left alone since
+    it usually still shows the drawing; ``journal(action="replay")`` redraws
+    it. MSPAINT_JOURNAL_START=new starts an empty journal instead, keeping
+    the old one as ``<name>.prev<ext>``."""
+    j = _get_journal()
+    if j is None:
+        return "journal=off"
     try:
-        if paint_app:
-            details.append(f"paint_backend={getattr(paint_app,'backend', 'unknown')}")
+        if os.environ.get("MSPAINT_JOURNAL_START", "resume").lower() == "new":
+            return f"journal=new previous={j.rotate()}"
+        from journal import to_batch_ops
+        if j.records():
+            j.compact()
+        ops = to_batch_ops(j.records())
+        backend = get_backend()
+        if replay and ops and isinstance(backend, RasterBackend):
+            batch = backend.replay(ops)
+            return f"journal=resumed ops={len(ops)} replayed={batch['ok']}"
+        return f"journal=resumed ops={len(ops)} replayed=False"
+    except (OSError, ValueError) as e:
+        return f"journal=unavailable note={e}"
+
+def _get_journal():
+    """The process journal, opened lazily; None when disabled."""
+    global _journal
+    path = os.environ.get("MSPAINT_JOURNAL", os.path.join(os.path.expanduser("~"), ".mspaint_mcp", "journal.bin"))
+    if path.strip().lower() in _JOURNAL_OFF:
+        return None
+    if _journal is None:
+        from journal import Journal
+        _journal = Journal(path, fsync=os.environ.get("MSPAINT_JOURNAL_FSYNC", "0") == "1")
+    return _journal
+
+# ---------------------------------------------------------------------------
+# Drawing backends
+# ---------------------------------------------------------------------------
+class DrawingBackend:
+    """Interface the MCP tools call into. Every operation returns the one-line
+    status string that is sent back to the client, so backends are free to
+    report backend-specific details (mode, geometry, notes)."""
+    name = "base"
+    recording = True  # False for scratch canvases that must not touch the scene/journal
+    thread_safe = False  # True if calls may bypass the single UI worker thread
+
+    def open(self) -> str:
+        raise NotImplementedError
+
+    def _commit(self, kind: str, box=None, text=None, points=None, parts=()):
+        """Record a drawn shape in the scene, the journal and the undo history
+        (``parts``: per-region ``(box, before, after)`` pixels, if the backend
+        can restore them); returns the Shape."""
+        if not self.recording:
+            return None
+        shape = _scene.add(kind, box if box is not None else _points_bbox(points), text=text)
+        journal = _get_journal()
+        if journal is not None:
             try:
-                proc = paint_app.process
-                details.append(f"paint_process={proc}")
-            except Exception:
+                with telemetry.stage("journal.append", kind=kind):
+                    journal.append(kind, box=shape.box if kind != "stroke" else None, text=text, points=points)
+            except OSError:
                 pass
+        with telemetry.stage("undo.record", kind=kind):
+            _history.record(kind, shape, parts)
+        return shape
+
+    def undo(self, steps: int = 1, redo: bool = False) -> str:
+        """Revert (with ``redo``: re-apply) the newest ``steps`` history
+        entries, one status line each. Scene and journal follow along."""
+        action = "Redo" if redo else "Undo"
+        lines = []
+        for _ in range(max(1, steps)):
+            t0 = time.perf_counter()
+            entry = _history.redo() if redo else _history.undo()
+            if entry is None:
+                lines.append(f"{action} success=False note=nothing_to_{action.lower()}")
+                break
             try:
-                win = paint_app.window(title_re=".*Paint.*")
-                details.append(f"window_exists={win.exists()}")
+                with telemetry.stage("undo.apply", redo=redo):
+                    mode = self._revert(entry, redo)
             except Exception as e:
-                details.append(f"window_query_error={e}")
-        else:
-            details.append("paint_app=None")
-    except Exception as e:
-        details.append(f"paint_state_error={e}")
-    return {"content":[TextContent(type="text", text="Diagnostics:\n" + "\n".join(details))]}
+                _history.put_back(entry, redo)
+                lines.append(f"{action} success=False label={entry.label} error={e}")
+                break
+            if entry.shape is not None:
+                if redo:
+                    _scene.restore(entry.shape)
+                else:
+                    _scene.remove(entry.shape.id)
+            journal = _get_journal()
+            if journal is not None and self.recording:
+                try:
+                    journal.append("redo" if redo else "undo")
+                except OSError:
+                    pass
+            st = _history.stats()
+            lines.append(f"{action} success=True label={entry.label} "
+                         f"shape_id={entry.shape.id if entry.shape else None} box={entry.box} "
+                         f"parts={len(entry.parts)} mode={mode} ms={_ms_since(t0)} "
+                         f"undo_steps={st['undo_steps']} redo_steps={st['redo_steps']}")
+        return "\n".join(lines)
 
-@mcp.tool()
-async def restart_instructions() -> dict:
-    """Provide explicit steps to fully restart the Paint MCP server ensuring latest code is active."""
-    steps = [
-        "1. Stop any existing server process: close the terminal running app.py or kill python process named mspaint server.",
-        "2. (Optional) Run diagnostics tool before stopping to note current app_md5.",
-        "3. In project root run: `python app.py dev` (or your launcher) to start fresh. If using uv: `uv run python app.py dev`.",
-        "4. After start, call diagnostics again and confirm app_md5 matches the file you just edited.",
-        "5. Call open_paint tool, then add_text_in_paint / draw_rectangle.",
-        "6. If text still not types and message shows canvas_control_missing_fallback_used, ensure the Paint window is not minimized and is fully visible on primary monitor.",
-        "7. If issues persist, try switching Windows theme (light/dark) once or resizing the Paint window; then retry add_text_in_paint.",
-        "8. Provide the diagnostics output plus tool responses for further analysis.",
-        f"Current loaded code hash (at server import): {_APP_MD5}",
-        f"App version tag: {_APP_VERSION}",
-    ]
-    return {"content": [TextContent(type="text", text="Restart Instructions:\n" + "\n".join(steps))]}
+    def _revert(self, entry, redo: bool) -> str:
+        """Apply ``entry``'s before (or, for redo, after) state; returns the mode used."""
+        raise NotImplementedError(f"Undo is not available for the {self.name} backend")
 
-@mcp.tool()
-async def open_paint() -> dict:
-    """Open Microsoft Paint maximized on primary monitor"""
-    global paint_app
-    try:
-        _, paint_window = get_paint_window(start_if_missing=True)
-        try:
-            paint_window.set_focus()
-        except Exception:
-            pass
-        debug_info = _debug_controls(paint_window)
-        return {"content": [TextContent(type="text", text=f"Paint ready (v={_APP_VERSION}). Control identifiers (snapshot):\n" + debug_info)]}
-    except Exception as e:
-        return {
-            "content": [
-                TextContent(
-                    type="text",
-                    text=f"Error opening/connecting to Paint: {e}"
-                )
-            ]
-        }
+    def history(self, limit: int = 20) -> dict:
+        undo, redo = _history.entries(limit)
+        return {"undo": undo, "redo": redo, "stats": _history.stats()}
 
-@mcp.tool()
-async def draw_rectangle(x1: int | None = None, y1: int | None = None, x2: int | None = None, y2: int | None = None) -> dict:
-    """Draw a rectangle. If coordinates are omitted or invalid, a centered 300x140
-    rectangle (same region used by default text insertion) is drawn. Passing
-    all four coordinates within canvas bounds uses the custom region and
-    updates the shared box for subsequent text placement."""
-    global paint_app
-    try:
-        # Get or start window then try UIA reconnect for richer controls
-        _, paint_window = get_paint_window(start_if_missing=False)
-        _reconnect_uia_if_win32()
-        try:
-            paint_window.set_focus()
-        except Exception:
-            pass
-        time.sleep(0.15)
-
-        # Select Rectangle tool: search by title, else fallback to generic Shapes group traversal
-        rect_selected = False
-        # Multi-pass wait for rectangle tool
-        for attempt in range(6):
-            # Attempt direct auto_id / title pattern(s)
-            for locator in [
-                dict(auto_id="ShapesRectangleTool", control_type="Button"),
-                dict(title_re="^Rectangle$", control_type="Button"),
-            ]:
-                try:
-                    btn = paint_window.child_window(**locator)
-                    if btn.exists():
-                        btn.click_input()
-                        rect_selected = True
-                        time.sleep(0.25)
-                        break
-                except Exception:
-                    continue
-            if rect_selected:
-                break
-            # Try Shapes group traversal
-            try:
-                shapes_group = paint_window.child_window(title="Shapes", control_type="Group")
-                if shapes_group.exists():
-                    for auto in ["ShapesRectangleTool", "ShapesRoundedRectangleTool"]:
-                        try:
-                            cand = shapes_group.child_window(auto_id=auto, control_type="Button")
-                            if cand.exists():
-                                cand.click_input()
-                                rect_selected = True
-                                time.sleep(0.25)
-                                break
-                        except Exception:
-                            continue
-            except Exception:
-                pass
-            if rect_selected:
-                break
-            # Reconnect UIA once mid-way
-            if attempt == 2:
-                _reconnect_uia_if_win32()
-            time.sleep(0.2)
-        if not rect_selected:
-            return {"content": [TextContent(type="text", text="Could not locate Rectangle tool.")]}
+    def session_closed(self, key: str):
+        """Hook for the MCP session ``key`` going away."""
 
-        # Locate canvas using unified helper
-        try:
-            canvas = find_canvas(paint_window)
-        except Exception as ce:
-            snapshot = _debug_controls(paint_window)
-            return {"content": [TextContent(type="text", text=f"Canvas not found: {ce}\nSnapshot:\n{snapshot}")]}          
+    def reset(self):
+        """Blank the canvas for a new document (and before a journal replay)."""
+        raise NotImplementedError(f"Reset is not available for the {self.name} backend")
 
-        # Instead of using provided coords, replicate the centered text-area logic for consistency
-        # Get canvas rectangle and compute a centered box similar to add_text_in_paint drag
-        r = canvas.rectangle()
-        global _last_box_rel
-        # Attempt to use provided coordinates if they form a reasonable box within canvas bounds.
-        try:
-            w = r.width(); h = r.height()
-        except Exception:
-            w = (r.right - r.left); h = (r.bottom - r.top)
-        # Normalize inputs (they might be absolute or intended relative). We treat them as relative.
-        use_custom = False
-        if all(v is not None for v in [x1,y1,x2,y2]):
-            rx1, ry1, rx2, ry2 = x1, y1, x2, y2
-            # Ensure ordering
-            if rx2 < rx1: rx1, rx2 = rx2, rx1
-            if ry2 < ry1: ry1, ry2 = ry2, ry1
-            min_size = 10
-            if 0 <= rx1 < w and 0 <= ry1 < h and 0 < rx2 <= w and 0 < ry2 <= h and (rx2-rx1) >= min_size and (ry2-ry1) >= min_size:
-                start_rel = (rx1, ry1)
-                end_rel = (rx2, ry2)
-                use_custom = True
+    def journal_action(self, action: str = "stats", target: str = "active", output=None) -> str:
+        """Run a ``journal`` tool action against this backend's journal, scene
+        and canvas; returns the status line. Runs on the UI worker thread."""
+        from journal import live_records, to_batch_ops
+        j = _get_journal()
+        if j is None:
+            return "Journal disabled (MSPAINT_JOURNAL=off)."
+        action = action.lower()
+        if action == "stats":
+            records = j.records()
+            st = j.stats()
+            return (f"Journal path={st['path']} bytes={st['bytes']} records={len(records)} "
+                    f"live={len(live_records(records))} appended={st['appended']} "
+                    f"append_avg_us={st['append_avg_us']} compactions={st['compactions']}")
+        if action == "compact":
+            t0 = time.perf_counter()
+            before, after = j.compact()
+            return f"Journal compacted success=True records_before={before} records_after={after} ms={_ms_since(t0)}"
+        if action == "clear":
+            j.append("clear")
+            _scene.clear()
+            _history.clear()
+            try:
+                self.reset()
+            except Exception as e:
+                return f"Journal cleared success=True canvas_reset=False (new document marker written) note={e}"
+            return "Journal cleared success=True canvas_reset=True (new document marker written)"
+        if action != "replay":
+            return f"Unknown action '{action}' (expected stats, compact, clear or replay)"
+        ops = to_batch_ops(j.records())
+        t0 = time.perf_counter()
+        if target == "raster":
+            if isinstance(self, RasterBackend):
+                size = (self.width, self.height)
             else:
-                start_rel, end_rel = _compute_centered_box(r)
+                size = _parse_size(os.environ.get("MSPAINT_CANVAS_SIZE", "1920x1080"))
+            scratch = RasterBackend(*size)
+            scratch.recording = False
+            batch = scratch.run_batch(ops)
+            if output:
+                scratch.export(output)
+        elif target == "active":
+            batch = self.replay(ops)
         else:
-            start_rel, end_rel = _compute_centered_box(r)
-        _last_box_rel = (start_rel, end_rel)
+            return f"Unknown replay target '{target}' (expected active or raster)"
+        ok = sum(1 for r in batch["results"] if r["ok"])
+        text = (f"Journal replayed success={batch['ok']} target={target} ops={len(ops)} ok={ok} "
+                f"total_ms={_ms_since(t0)} output={output if target == 'raster' else None}")
+        if batch.get("error"):
+            text += f" error={batch['error']}"
+        return text
 
-        # Focus canvas and draw using relative coordinates
-        canvas.click_input(coords=start_rel)
-        time.sleep(0.1)
-        canvas.drag_mouse_input(src=start_rel, dst=end_rel, button="left", pressed="left")
-        time.sleep(0.25)
-        actual_start_abs = (r.left + start_rel[0], r.top + start_rel[1])
-        actual_end_abs = (r.left + end_rel[0], r.top + end_rel[1])
-        return {"content": [TextContent(type="text", text=(
-            f"Rectangle drawn success=True rel_start={start_rel} rel_end={end_rel} "
-            f"abs_start={actual_start_abs} abs_end={actual_end_abs} custom={use_custom} v={_APP_VERSION}"))]}
-    except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        info = ""
-        try:
-            _, win = get_paint_window(start_if_missing=False)
-            info = _debug_controls(win)
-        except Exception:
-            pass
-        return {"content": [TextContent(type="text", text=f"Error drawing rectangle: {e}\nTraceback:\n{tb}\nWindow tree snapshot:\n{info}")]}        
+    def replay(self, ops: list) -> dict:
+        """Rebuild the document from journal ``ops`` (one batched run) without
+        journaling them again; scene and history start empty."""
+        _scene.clear()
+        _history.clear()
+        j = _get_journal()
+        if j is None:
+            return self.run_batch(ops)
+        with j.suspended():
+            return self.run_batch(ops)
 
+    def draw_rectangle(self, x1=None, y1=None, x2=None, y2=None) -> str:
+        raise NotImplementedError
 
-@mcp.tool()
-async def add_text_in_paint(text: str) -> dict:
-    """Rectangle-style behavior: select Text tool and create a centered text box
-    with identical geometry to the default rectangle (300x140) used by
-    draw_rectangle. This ensures text appears inside the same region Paint
-    would use for the rectangle tool helper.
-
-    Updated unified strategy:
-      1. Focus Paint window.
-      2. Select Text tool (auto_id=TextTool or title 'Text').
-      3. Locate canvas via find_canvas.
-         - If found: drag a box defined by _compute_centered_box(canvas.rect).
-         - If not: fallback to approximate canvas rect heuristic, attempt a drag.
-      4. Detect overlay Edit control; if present, type directly.
-      5. Progressive fallbacks (double-click center, second drag, seed typing,
-         send_keys, WM_CHAR injection, clipboard paste) until inserted.
-    Returns concise status line including success, mode, version and geometry.
-    """
-    global paint_app
-    try:
-        _, paint_window = get_paint_window(start_if_missing=False)
-        _reconnect_uia_if_win32()
-        try:
-            paint_window.set_focus()
-            time.sleep(0.12)
-        except Exception:
-            pass
+    def add_text(self, text: str, box=None) -> str:
+        raise NotImplementedError
 
-        # Clear any lingering selection / overlays
-        try:
-            paint_window.type_keys('{ESC}', set_foreground=True)
-            time.sleep(0.08)
-        except Exception:
-            pass
+    def draw_stroke(self, points, tolerance: float = 1.0, pace_ms: float = 0.0) -> str:
+        """Draw a freehand polyline through canvas-relative ``points``, simplified
+        with RDP to ``tolerance`` pixels; ``pace_ms`` spaces the mouse events."""
+        raise NotImplementedError
 
-        # 1. Select Text tool (multi-attempt)
-        text_selected = False
-        for attempt in range(6):
-            for locator in [
-                dict(auto_id="TextTool", control_type="Button"),
-                dict(title_re="^Text$", control_type="Button")
-            ]:
-                try:
-                    btn = paint_window.child_window(**locator)
-                    if btn.exists():
-                        btn.click_input()
-                        text_selected = True
-                        break
-                except Exception:
-                    continue
-            if text_selected:
-                break
-            if attempt == 2:
-                _reconnect_uia_if_win32()
-            time.sleep(0.2)
-        if not text_selected:
-            return {"content": [TextContent(type="text", text="Text tool not found.")]}        
+    def describe(self) -> list:
+        """Extra ``key=value`` lines for the diagnostics tool."""
+        return []
 
-        # 2. Locate canvas
-        canvas = None
-        canvas_err = None
+    def ui_snapshot(self, max_depth=3, max_nodes=200, root=None, control_types=None,
+                    diff=True, max_age=0.0, full_dump=False) -> str:
+        return f"UI snapshots are not available for the {self.name} backend."
+
+    def canvas_bounds(self):
+        """Canvas-relative (0, 0, width, height) of the drawable area."""
+        raise NotImplementedError
+
+    def query_scene(self, method: str, *args):
+        """Run a read-only ``Scene`` query (get, hit_test, overlapping, find_free,
+        shapes, stats) against the scene this backend draws into."""
+        if method not in ("get", "hit_test", "overlapping", "find_free", "shapes", "stats", "last_box"):
+            raise ValueError(f"Unknown scene query '{method}'")
+        return getattr(_scene, method)(*args)
+
+    def grab_canvas(self, region=None):
+        """Return ``(PIL image, box)`` of the canvas, or of the canvas-relative
+        ``region`` (x1, y1, x2, y2) clamped to it; ``box`` is the clamped region."""
+        raise NotImplementedError(f"Canvas capture is not available for the {self.name} backend")
+
+    def export(self, path: str) -> dict:
+        """Save the whole canvas to the image file ``path``."""
+        img, _ = self.grab_canvas()
+        img.save(path)
+        return {"path": path, "size": img.size}
+
+    # -- batching ---------------------------------------------------------
+    def _batch_begin(self):
+        """Resolve per-call state (window, canvas, geometry) once for a whole
+        batch. The returned context is handed to every ``_batch_op`` call."""
+        return None
+
+    def _batch_op(self, ctx, op: dict) -> str:
+        kind = op.get("op")
+        if kind == "rectangle":
+            return self.draw_rectangle(op.get("x1"), op.get("y1"), op.get("x2"), op.get("y2"))
+        if kind == "text":
+            return self.add_text(op["text"], box=_op_box(op))
+        if kind == "stroke":
+            return self.draw_stroke(op["points"], op.get("tolerance", 1.0), op.get("pace_ms", 0.0))
+        raise ValueError(f"Unknown op '{kind}' (expected rectangle, text or stroke)")
+
+    def run_batch(self, operations: list, stop_on_error: bool = False) -> dict:
+        """Run ``operations`` in order, returning per-operation status and timing.
+        Setup cost (``_batch_begin``) is paid once and reported separately."""
+        t0 = time.perf_counter()
         try:
-            canvas = find_canvas(paint_window, timeout=1.0)
-        except Exception as ce:
-            canvas_err = str(ce)
+            ctx = self._batch_begin()
+        except Exception as e:
+            return {"ok": False, "error": f"batch setup failed: {e}", "setup_ms": _ms_since(t0),
+                    "total_ms": _ms_since(t0), "results": []}
+        setup_ms = _ms_since(t0)
+        results = []
+        for i, op in enumerate(operations):
+            t_op = time.perf_counter()
+            try:
+                status = self._batch_op(ctx, op)
+                ok = _status_ok(status)
+            except Exception as e:
+                status = f"error={e}"
+                ok = False
+            telemetry.observe("batch_op", time.perf_counter() - t_op, error=not ok,
+                              op=op.get("op") if isinstance(op, dict) else None)
+            results.append({"index": i, "op": op.get("op") if isinstance(op, dict) else None,
+                            "ok": ok, "ms": _ms_since(t_op), "status": status})
+            if not ok and stop_on_error:
+                break
+        return {"ok": len(results) == len(operations) and all(r["ok"] for r in results),
+                "setup_ms": setup_ms, "total_ms": _ms_since(t0), "results": results}
 
-        import pywinauto.mouse as _mouse
+# add_text fallback chain, in its default (cold-start) order, and the mode
+# each strategy reports in the tool status line.
+TEXT_STRATEGIES = ("overlay_type", "double_click", "second_drag", "seed_type", "send_keys", "wm_char", "clipboard")
+_TEXT_MODES = {
+    "overlay_type": "overlay_type",
+    "double_click": "overlay_after_double_click",
+    "second_drag": "overlay_after_second_drag",
+    "seed_type": "window_seed_type",
+    "send_keys": "keyboard_send_keys",
+    "wm_char": "wm_char_injected",
+    "clipboard": "clipboard_paste",
+}
+_strategy_ranker = StrategyRanker(
+    path=os.environ.get("MSPAINT_STRATEGY_STATS", os.path.join(os.path.expanduser("~"), ".mspaint_mcp", "strategy_stats.json")),
+    explore=float(os.environ.get("MSPAINT_STRATEGY_EXPLORE", "0.05")),
+)
+
+class _TextAttempt:
+    """State shared by the add_text fallback strategies during one insertion."""
+    def __init__(self, paint_window, canvas, text, abs_points):
+        self.paint_window = paint_window
+        self.canvas = canvas
+        self.text = text
+        self.injection = None  # text_injection result of the strategy that typed the text
+        self.overlay = None
+        self.overlay_found = False
+        self.notes = []
+        self.center_abs = None
+        if 'start' in abs_points and 'end' in abs_points:
+            sx, sy = abs_points['start']; ex, ey = abs_points['end']
+            self.center_abs = ((sx+ex)//2, (sy+ey)//2)
+        elif 'double_click' in abs_points:
+            self.center_abs = abs_points['double_click']
+
+_injector = None  # text_injection.InjectionEngine and its Win32Sink, created on first use
+_input_sink = None
+
+def _inject_text(text: str, strategies=None) -> dict:
+    """Type ``text`` into the focused control with the bulk injection engine
+    (unicode key events, clipboard paste or chunked typing, chosen by length
+    and content unless ``strategies`` is given)."""
+    global _injector, _input_sink
+    if _injector is None:
+        from text_injection import InjectionEngine, Win32Sink
+        _injector = InjectionEngine(paste_threshold=int(os.environ.get("MSPAINT_PASTE_THRESHOLD", "400")))
+        _input_sink = Win32Sink()
+    with telemetry.stage("add_text.inject") as span:
+        result = _injector.inject(_input_sink, text, strategies)
+        span.labels["strategy"] = result["strategy"]
+    return result
+
+_env_keys = {}  # window handle -> environment key
+
+def _paint_build(pid) -> str:
+    """File version of the Paint executable behind ``pid`` (e.g. '11.2410.28.0')."""
+    try:
+        import win32api, win32process
+        handle = win32api.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        try:
+            path = win32process.GetModuleFileNameEx(handle, 0)
+        finally:
+            win32api.CloseHandle(handle)
+        info = win32api.GetFileVersionInfo(path, "\\")
+        ms, ls = info['FileVersionMS'], info['FileVersionLS']
+        return f"{ms >> 16}.{ms & 0xFFFF}.{ls >> 16}.{ls & 0xFFFF}"
+    except Exception:
+        return "unknown"
+
+def _text_env_key(paint_window) -> str:
+    """'backend|paint build|dpi' key under which strategy stats are kept."""
+    try:
+        win = _as_wrapper(paint_window)
+        handle = win.handle
+    except Exception:
+        return f"{_app_backend_name(paint_app)}|unknown|unknown"
+    key = _env_keys.get(handle)
+    if key is None:
+        try:
+            import ctypes
+            dpi = ctypes.windll.user32.GetDpiForWindow(handle)
+        except Exception:
+            dpi = "unknown"
+        try:
+            build = _paint_build(win.process_id())
+        except Exception:
+            build = "unknown"
+        key = _env_keys[handle] = f"{_app_backend_name(paint_app)}|{build}|{dpi}"
+    return key
+
+class UIABackend(DrawingBackend):
+    """Drives a live mspaint window through pywinauto (UIA first, win32 fallback)."""
+    name = "uia"
+
+    def open(self) -> str:
+        try:
+            _, paint_window = get_paint_window(start_if_missing=True)
+            try:
+                paint_window.set_focus()
+            except Exception:
+                pass
+            return f"Paint ready (v={_app_version()}). UI snapshot:\n" + _snapshot_text(paint_window)
+        except Exception as e:
+            return f"Error opening/connecting to Paint: {e}"
+
+    def ui_snapshot(self, max_depth=3, max_nodes=200, root=None, control_types=None,
+                    diff=True, max_age=0.0, full_dump=False) -> str:
+        import json
+        try:
+            _, paint_window = get_paint_window(start_if_missing=False)
+            if full_dump:
+                return _debug_controls(paint_window)
+            snap = _snapshotter.snapshot(paint_window, max_depth=max_depth, max_nodes=max_nodes, root=root,
+                                         control_types=control_types, diff=diff, max_age=max_age)
+            return json.dumps(snap, separators=(",", ":"))
+        except Exception as e:
+            return f"Error taking UI snapshot: {e}"
+
+    def canvas_bounds(self):
+        _, paint_window = get_paint_window(start_if_missing=False)
+        r = find_canvas(paint_window).rectangle()
+        return (0, 0, r.width(), r.height())
+
+    def grab_canvas(self, region=None):
+        from canvas_capture import clamp_region
+        with telemetry.stage("connect"):
+            _, paint_window = get_paint_window(start_if_missing=False)
+            _reconnect_uia_if_win32()
+        canvas = find_canvas(paint_window)
+        r = canvas.rectangle()
+        box = clamp_region(r.width(), r.height(), region)
+        return self._grab_rel(r, box), box
+
+    @staticmethod
+    def _grab_rel(r, box):
+        """Screen-grab the canvas-relative ``box`` of canvas rect ``r``."""
+        from PIL import ImageGrab
+        with telemetry.stage("capture.grab"):
+            img = ImageGrab.grab(bbox=(r.left + box[0], r.top + box[1], r.left + box[2], r.top + box[3]),
+                                 all_screens=True)
+        return img.convert("RGB")
+
+    def _focus_window(self):
+        """Resolve the Paint window (upgrading win32 connections to UIA) and focus it."""
+        with telemetry.stage("connect"):
+            _, paint_window = get_paint_window(start_if_missing=False)
+            _reconnect_uia_if_win32()
+        with telemetry.stage("focus"):
+            try:
+                paint_window.set_focus()
+            except Exception:
+                pass
+            _waiter.until("window_focus", lambda: _is_foreground(paint_window), timeout=0.5)
+        return paint_window
+
+    def _find_rectangle_tool(self, paint_window):
+        """Locate the Rectangle button directly, else through the Shapes group."""
+        btn = _resolve_control(paint_window, [
+            dict(auto_id="ShapesRectangleTool", control_type="Button"),
+            dict(title_re="^Rectangle$", control_type="Button"),
+        ])
+        if btn is not None:
+            return btn
+        shapes_group = _locator_cache.get(paint_window, "Shapes", lambda: _resolve_control(
+            paint_window, [dict(title="Shapes", control_type="Group")]))
+        if shapes_group is None:
+            return None
+        return _resolve_control(shapes_group, [
+            dict(auto_id="ShapesRectangleTool", control_type="Button"),
+            dict(auto_id="ShapesRoundedRectangleTool", control_type="Button"),
+        ])
+
+    def _click_tool(self, paint_window, name, resolve, settle=0.5) -> bool:
+        """Click the (cached) tool button ``name`` and wait until it reports itself
+        active. Locating is retried once after a UIA reconnect."""
+        with telemetry.stage("select_tool", tool=name) as span:
+            span.error = not self._click_tool_once(paint_window, name, resolve, settle)
+        return not span.error
+
+    def _click_tool_once(self, paint_window, name, resolve, settle) -> bool:
+        def _locate():
+            try:
+                return _locator_cache.get(paint_window, name, resolve)
+            except Exception:
+                _locator_cache.invalidate()
+                return None
+        btn = _waiter.until(f"locate:{name}", _locate, timeout=1.0)
+        if btn is None:
+            _reconnect_uia_if_win32()
+            btn = _waiter.until(f"locate:{name}", _locate, timeout=1.0)
+        if btn is None:
+            _paint_state.forget()
+            return False
+        _paint_state.sync(paint_window)
+        active = _tool_active(btn)
+        # Re-clicking the Text tool is what commits an open text box, so that one is never skipped
+        if (active or (active is None and _paint_state.tool == name)) and not (
+                name == "TextTool" and _paint_state.selection == "text"):
+            _paint_state.tool = name
+            _paint_state.tool_skips += 1
+            return True
+        try:
+            btn.click_input()
+        except Exception:
+            _locator_cache.invalidate()
+            _paint_state.forget()
+            return False
+        _paint_state.tool_clicks += 1
+        _paint_state.tool, _paint_state.selection = name, None
+        # Buttons without toggle/selection state can't be observed; treat them as ready
+        _waiter.until(f"toggle:{name}", lambda: _tool_active(btn) is not False, timeout=settle)
+        return True
+
+    def _select_rectangle_tool(self, paint_window) -> bool:
+        """Select Rectangle tool: search by title, else fallback to generic Shapes group traversal."""
+        return self._click_tool(paint_window, "ShapesRectangleTool",
+                                lambda: self._find_rectangle_tool(paint_window))
+
+    def _select_text_tool(self, paint_window) -> bool:
+        """Select Text tool (multi-attempt)."""
+        return self._click_tool(paint_window, "TextTool", lambda: _resolve_control(paint_window, [
+            dict(auto_id="TextTool", control_type="Button"),
+            dict(title_re="^Text$", control_type="Button"),
+        ]))
+
+    def _drag_rectangle(self, canvas, r, x1=None, y1=None, x2=None, y2=None) -> str:
+        """Drag a rectangle on an already-resolved canvas (Rectangle tool active)."""
+        # Use provided coordinates when they form a reasonable box within canvas bounds,
+        # otherwise the centered box shared with add_text_in_paint
+        start_rel, end_rel, use_custom = _resolve_box(r, x1, y1, x2, y2)
+        region = _verify_region((start_rel, end_rel), r.width(), r.height())
+        before = self._grab_rel(r, region) if _VERIFY else None
+
+        # Focus canvas and draw using relative coordinates
+        with telemetry.stage("drag", shape="rectangle"):
+            canvas.click_input(coords=start_rel)
+            time.sleep(0.1)
+            canvas.drag_mouse_input(src=start_rel, dst=end_rel, button="left", pressed="left")
+            time.sleep(0.25)
+        _paint_state.selection = "shape"
+        change = _pixel_change(before, self._grab_rel(r, region), region) if before is not None else None
+        shape = self._commit("rect", (start_rel, end_rel))
+        actual_start_abs = (r.left + start_rel[0], r.top + start_rel[1])
+        actual_end_abs = (r.left + end_rel[0], r.top + end_rel[1])
+        return " ".join([
+            f"Rectangle drawn success=True shape_id={shape.id if shape else None} rel_start={start_rel} rel_end={end_rel} "
+            f"abs_start={actual_start_abs} abs_end={actual_end_abs} custom={use_custom} v={_app_version()}"]
+            + _verify_parts(change))
+
+    def draw_rectangle(self, x1=None, y1=None, x2=None, y2=None) -> str:
+        try:
+            # Get or start window then try UIA reconnect for richer controls
+            paint_window = self._focus_window()
+
+            if not self._select_rectangle_tool(paint_window):
+                return "Could not locate Rectangle tool."
+
+            # Locate canvas using unified helper
+            try:
+                canvas = find_canvas(paint_window)
+            except Exception as ce:
+                snapshot = _snapshot_text(paint_window, max_depth=4, max_nodes=120)
+                return f"Canvas not found: {ce}\nSnapshot:\n{snapshot}"
+
+            return self._drag_rectangle(canvas, canvas.rectangle(), x1, y1, x2, y2)
+        except Exception as e:
+            _paint_state.forget()
+            import traceback
+            tb = traceback.format_exc()
+            info = ""
+            try:
+                _, win = get_paint_window(start_if_missing=False)
+                info = _snapshot_text(win)
+            except Exception:
+                pass
+            return f"Error drawing rectangle: {e}\nTraceback:\n{tb}\nWindow tree snapshot:\n{info}"
+
+    def add_text(self, text: str, box=None) -> str:
+        """Rectangle-style behavior: select Text tool and create a text box over
+        the last rectangle (or ``box``); with neither, a centered box sized to
+        the measured text (see _auto_text_box).
+
+        Updated unified strategy:
+          1. Focus Paint window.
+          2. Select Text tool (auto_id=TextTool or title 'Text').
+          3. Locate canvas via find_canvas.
+             - If found: drag the target box.
+             - If not: fallback to approximate canvas rect heuristic, attempt a drag.
+          4. Detect overlay Edit control; if present, type directly.
+          5. Progressive fallbacks (double-click center, second drag, seed typing,
+             send_keys, WM_CHAR injection, clipboard paste) until inserted.
+        """
+        try:
+            paint_window = self._focus_window()
+
+            # Clear any lingering text box
+            try:
+                _clear_selection(paint_window)
+            except Exception:
+                _paint_state.forget()
+
+            # 1. Select Text tool (multi-attempt)
+            if not self._select_text_tool(paint_window):
+                return "Text tool not found."
+
+            # 2. Locate canvas
+            canvas = None
+            canvas_err = None
+            try:
+                canvas = find_canvas(paint_window, timeout=1.0)
+            except Exception as ce:
+                canvas_err = str(ce)
+
+            return self._insert_text(paint_window, canvas, text, canvas_err=canvas_err, box=box)
+        except Exception as e:
+            _paint_state.forget()
+            import traceback
+            tb = traceback.format_exc()
+            return f"Error (drag-centered) adding text: {e}\nTraceback:\n{tb}"
+
+    def _insert_text(self, paint_window, canvas, text: str, canvas_err=None, box=None) -> str:
+        """Create a text box on ``canvas`` (Text tool already active) and type
+        ``text`` into it, walking the fallback chain until one method succeeds.
+        ``box`` (x1, y1, x2, y2) overrides the target region; otherwise the last
+        rectangle box (or the centered default) is used."""
+        from text_injection import PartialInjection
         drag_used = False
         rel_box = None
         abs_points = {}
 
-        def _clamp(v, lo, hi):
-            return max(lo, min(hi, v))
-
         # 3. Create text region: prefer last rectangle if available to ensure exact match
         reuse_last = False
         if canvas is not None:
             try:
                 r = canvas.rectangle()
-                global _last_box_rel
-                if _last_box_rel and isinstance(_last_box_rel, tuple) and len(_last_box_rel) == 2:
-                    start_rel, end_rel = _last_box_rel
+                last_box = _scene.last_box()
+                if box is not None:
+                    start_rel, end_rel, _ = _resolve_box(r, *box)
+                elif last_box is not None:
+                    start_rel, end_rel = last_box
                     reuse_last = True
                 else:
-                    start_rel, end_rel = _compute_centered_box(r)
+                    start_rel, end_rel = _auto_text_box(r, text)
                 rel_box = (start_rel, end_rel)
-                canvas.drag_mouse_input(src=start_rel, dst=end_rel, button="left", pressed="left")
+                with telemetry.stage("drag", shape="text_box"):
+                    canvas.drag_mouse_input(src=start_rel, dst=end_rel, button="left", pressed="left")
                 drag_used = True
                 abs_points['start'] = (r.left + start_rel[0], r.top + start_rel[1])
                 abs_points['end'] = (r.left + end_rel[0], r.top + end_rel[1])
-                # Update last box if newly computed
-                if not reuse_last:
-                    _last_box_rel = (start_rel, end_rel)
             except Exception as ce:
                 canvas_err = canvas_err or f"drag_fail={ce}"
+
+        # Baseline of the text box (already showing its frame) for pixel verification
+        verify_rect = verify_region = before = None
+        if _VERIFY and rel_box is not None:
+            try:
+                verify_rect = canvas.rectangle()
+                verify_region = _verify_region(rel_box, verify_rect.width(), verify_rect.height())
+                before = self._grab_rel(verify_rect, verify_region)
+            except Exception as ve:
+                canvas_err = "; ".join(filter(None, [canvas_err, f"verify_grab_fail:{ve}"]))
         if not drag_used:
+            import pywinauto.mouse as _mouse
             # fallback: approximate rect center click then small drag via absolute coords
             approx = _approx_canvas_rect(paint_window)
             if approx:
@@ -571,197 +1557,1277 @@ async def add_text_in_paint(text: str) -> dict:
                         pass
                 abs_points['double_click'] = (500,500)
 
-        # 4. Poll for overlay edit
-        safe_text = text.replace('{', '{{').replace('}', '}}')
-        overlay = None
-        overlay_found = False
-        poll_delays = [0.12,0.18,0.25,0.33,0.45,0.6]
-        for d in poll_delays:
-            try:
-                overlay = paint_window.child_window(control_type="Edit")
-                if overlay.exists():
-                    overlay_found = True
-                    break
-            except Exception:
-                pass
-            time.sleep(d)
-
+        # 4. Walk the fallback chain, cheapest likely-successful strategy first
+        attempt = _TextAttempt(paint_window, canvas, text, abs_points)
+        env = _text_env_key(paint_window)
         mode = None
         inserted = False
-        if overlay_found:
+        change = None
+        partial = False
+        for name in _strategy_ranker.order(env, TEXT_STRATEGIES):
+            t_fb = time.perf_counter()
             try:
-                try:
-                    overlay.set_focus()
-                except Exception:
-                    pass
-                overlay.type_keys(safe_text, with_spaces=True, set_foreground=True)
-                inserted = True
-                mode = "overlay_type"
+                inserted = bool(getattr(self, f"_text_{name}")(attempt))
+            except PartialInjection as e:
+                # part of the text is already in the box: another strategy would repeat it
+                attempt.notes.append(f"{name}_partial:{e}")
+                inserted, partial = False, True
             except Exception as e:
-                mode = f"overlay_fail:{e}"
+                attempt.notes.append(f"{name}_fail:{e}")
+                inserted = False
+            # No exception is not proof of text; only a real pixel change is.
+            # Paint may repaint late, so poll before moving on to the next
+            # strategy, which would otherwise type the text a second time.
+            if inserted and before is not None:
+                try:
+                    change = _waiter.until(
+                        "text_repaint",
+                        lambda: _verified(_pixel_change(before, self._grab_rel(verify_rect, verify_region),
+                                                        verify_region)),
+                        timeout=_VERIFY_SETTLE)
+                    if change is None:
+                        attempt.notes.append(f"{name}_unverified")
+                        inserted = False
+                except Exception as ve:
+                    attempt.notes.append(f"{name}_verify_fail:{ve}")
+            elapsed = time.perf_counter() - t_fb
+            _strategy_ranker.record(env, name, inserted, elapsed)
+            telemetry.observe("add_text.fallback", elapsed, error=not inserted, mode=name)
+            if inserted:
+                mode = _TEXT_MODES[name]
+                break
+            if partial:
+                break
+        _strategy_ranker.save()
+        if inserted:
+            _paint_state.selection = "text"
+        else:
+            # a text box may or may not be left open: make the next call check
+            _paint_state.forget()
+        shape = self._commit("text", rel_box, text=text) if inserted and rel_box else None
+        overlay_found = attempt.overlay_found
+        if attempt.notes and not inserted:
+            canvas_err = "; ".join(filter(None, [canvas_err] + attempt.notes))
 
-        # If overlay not found yet, attempt double-click in center then re-poll
-        center_abs = None
-        if not inserted:
-            try:
-                if 'start' in abs_points and 'end' in abs_points:
-                    sx, sy = abs_points['start']; ex, ey = abs_points['end']
-                    center_abs = ((sx+ex)//2, (sy+ey)//2)
-                elif 'double_click' in abs_points:
-                    center_abs = abs_points['double_click']
-                if center_abs:
-                    from pywinauto import mouse
-                    mouse.click(button='left', coords=center_abs)
-                    time.sleep(0.07)
-                    mouse.click(button='left', coords=center_abs)
-                    time.sleep(0.18)
-                    # re-poll quick
-                    for d2 in [0.1,0.15,0.22]:
-                        try:
-                            overlay = paint_window.child_window(control_type="Edit")
-                            if overlay.exists():
-                                overlay_found = True
-                                try:
-                                    overlay.set_focus()
-                                except Exception:
-                                    pass
-                                overlay.type_keys(safe_text, with_spaces=True, set_foreground=True)
-                                inserted = True
-                                if mode is None:
-                                    mode = "overlay_after_double_click"
-                                break
-                        except Exception:
-                            pass
-                        time.sleep(d2)
-            except Exception:
-                pass
+        status_parts = [
+            f"TextDrag '{text}' success={inserted}",
+            f"mode={mode}",
+            f"drag_used={drag_used}",
+            f"overlay_found={overlay_found}",
+            f"v={_app_version()}"
+        ] + _verify_parts(change)
+        if shape is not None:
+            status_parts.append(f"shape_id={shape.id}")
+        if inserted and attempt.injection:
+            status_parts.append(f"inject={attempt.injection['strategy']} "
+                                f"chars_per_sec={attempt.injection['chars_per_sec']}")
+        if rel_box:
+            (bx1, by1), (bx2, by2) = rel_box
+            lay = _text_layout().layout(text, _TEXT_SIZE, abs(bx2 - bx1) - 2 * _TEXT_PAD)
+            status_parts.append(f"lines={len(lay.lines)} fits={lay.fits and lay.height <= abs(by2 - by1) - 2 * _TEXT_PAD}")
+            status_parts.append(f"rel_box={rel_box}")
+            status_parts.append(f"reuse_last={reuse_last}")
+        if abs_points:
+            status_parts.append(f"abs_points={abs_points}")
+        if canvas_err:
+            status_parts.append(f"note={canvas_err}")
+        return " ".join(status_parts)
 
-        # If still not inserted, try a smaller second drag to force box
-        if not inserted:
+    # -- add_text fallback strategies ---------------------------------------
+    # Each takes the shared _TextAttempt and returns True once the text was
+    # typed. Their order is chosen per environment by _strategy_ranker.
+    def _type_into_overlay(self, attempt, overlay) -> bool:
+        attempt.overlay = overlay
+        attempt.overlay_found = True
+        try:
+            overlay.set_focus()
+        except Exception:
+            pass
+        attempt.injection = _inject_text(attempt.text)
+        return True
+
+    def _text_overlay_type(self, attempt) -> bool:
+        """Type into the overlay Edit created by the text-box drag."""
+        with telemetry.stage("add_text.overlay_poll") as span:
+            overlay = _waiter.until("overlay_edit", lambda: _find_overlay(attempt.paint_window), timeout=1.9)
+            span.error = overlay is None
+        return overlay is not None and self._type_into_overlay(attempt, overlay)
+
+    def _text_double_click(self, attempt) -> bool:
+        """Double-click the box center, then re-poll for the overlay."""
+        if not attempt.center_abs:
+            return False
+        from pywinauto import mouse
+        mouse.click(button='left', coords=attempt.center_abs)
+        time.sleep(0.07)
+        mouse.click(button='left', coords=attempt.center_abs)
+        overlay = _waiter.until("overlay_after_double_click", lambda: _find_overlay(attempt.paint_window), timeout=0.65)
+        return overlay is not None and self._type_into_overlay(attempt, overlay)
+
+    def _text_second_drag(self, attempt) -> bool:
+        """Drag a smaller box around the center to force a text box."""
+        if not attempt.center_abs:
+            return False
+        from pywinauto import mouse
+        cx, cy = attempt.center_abs
+        mouse.press(coords=(cx-60, cy-30))
+        time.sleep(0.05)
+        mouse.move(coords=(cx+60, cy+30))
+        time.sleep(0.05)
+        mouse.release(coords=(cx+60, cy+30))
+        overlay = _waiter.until("overlay_after_second_drag", lambda: _find_overlay(attempt.paint_window), timeout=0.9)
+        return overlay is not None and self._type_into_overlay(attempt, overlay)
+
+    def _text_seed_type(self, attempt) -> bool:
+        """Seed the window (space + backspace) then type into it."""
+        paint_window = attempt.paint_window
+        paint_window.type_keys(" ", set_foreground=True)
+        time.sleep(0.05)
+        paint_window.type_keys("{BACKSPACE}")
+        time.sleep(0.05)
+        attempt.injection = _inject_text(attempt.text)
+        return True
+
+    def _text_send_keys(self, attempt) -> bool:
+        """Global keyboard input to whatever has focus, without SendInput batching."""
+        attempt.injection = _inject_text(attempt.text, ("typed",))
+        return True
+
+    def _text_wm_char(self, attempt) -> bool:
+        """Post WM_CHAR messages to the overlay (or canvas) handle."""
+        target_handle = None
+        try:
+            if attempt.overlay_found and attempt.overlay is not None:
+                target_handle = attempt.overlay.element_info.handle
+        except Exception:
+            pass
+        if target_handle is None and attempt.canvas is not None:
             try:
-                from pywinauto import mouse
-                if center_abs:
-                    sx = center_abs[0]-60; sy = center_abs[1]-30
-                    ex = center_abs[0]+60; ey = center_abs[1]+30
-                    mouse.press(coords=(sx,sy))
-                    time.sleep(0.05)
-                    mouse.move(coords=(ex,ey))
-                    time.sleep(0.05)
-                    mouse.release(coords=(ex,ey))
-                    time.sleep(0.25)
-                    for d3 in [0.12,0.2,0.3]:
-                        try:
-                            overlay = paint_window.child_window(control_type="Edit")
-                            if overlay.exists():
-                                overlay_found = True
-                                try: overlay.set_focus()
-                                except Exception: pass
-                                overlay.type_keys(safe_text, with_spaces=True, set_foreground=True)
-                                inserted = True
-                                if mode is None:
-                                    mode = "overlay_after_second_drag"
-                                break
-                        except Exception:
-                            pass
-                        time.sleep(d3)
+                target_handle = attempt.canvas.element_info.handle
             except Exception:
                 pass
-
-        # Seeding fallback (space + backspace) then type (only if still not inserted)
-        if not inserted:
+        if not target_handle:
+            return False
+        try:
+            win32gui.SetForegroundWindow(target_handle)
+        except Exception:
+            pass
+        for i, ch in enumerate(attempt.text):
             try:
-                paint_window.type_keys(" ", set_foreground=True)
-                time.sleep(0.05)
-                paint_window.type_keys("{BACKSPACE}")
-                time.sleep(0.05)
-                paint_window.type_keys(safe_text, with_spaces=True, set_foreground=True)
-                inserted = True
-                if mode is None:
-                    mode = "window_seed_type"
+                win32gui.PostMessage(target_handle, win32con.WM_CHAR, ord(ch), 0)
             except Exception:
-                if mode is None:
-                    mode = "seed_type_fail"
+                break
+            if i % 256 == 255:
+                time.sleep(0.005)  # let the target drain its message queue (10k post limit)
+        return True  # we attempted injection; visual check still required
 
-        # Try alternate send_keys (pywinauto.keyboard) if still not inserted
-        if not inserted:
-            try:
-                from pywinauto.keyboard import send_keys
-                send_keys(safe_text)
-                inserted = True
-                if mode is None:
-                    mode = "keyboard_send_keys"
-            except Exception:
-                pass
+    def _text_clipboard(self, attempt) -> bool:
+        """Paste the text in one go; the previous clipboard text is restored."""
+        try:
+            attempt.paint_window.set_focus()
+        except Exception:
+            pass
+        attempt.injection = _inject_text(attempt.text, ("clipboard",))
+        return True
 
-        # WM_CHAR low-level injection as a last resort (when we have overlay or canvas handle)
-        if not inserted:
-            try:
-                target_handle = None
+    def _select_pencil_tool(self, paint_window) -> bool:
+        """Select the Pencil tool used for freehand strokes."""
+        return self._click_tool(paint_window, "PencilTool", lambda: _resolve_control(paint_window, [
+            dict(auto_id="PencilTool", control_type="Button"),
+            dict(title_re="^Pencil$", control_type="Button"),
+        ]))
+
+    def _drag_stroke(self, canvas, r, points, tolerance: float = 1.0, pace_ms: float = 0.0) -> str:
+        """Simplify ``points`` and send them as one press/move.../release
+        sequence (Pencil active). Moves are scheduled ``pace_ms`` apart against
+        a deadline rather than slept individually, so pacing doesn't drift."""
+        import pywinauto.mouse as _mouse
+        t0 = time.perf_counter()
+        pts = _simplify_rdp(points, tolerance)
+        if len(pts) < 2:
+            return f"Stroke needs at least 2 distinct points (got {len(pts)})."
+        pace = max(0.0, pace_ms) / 1000.0
+        with telemetry.stage("drag", shape="stroke"):
+            _mouse.press(coords=(r.left + pts[0][0], r.top + pts[0][1]))
+            due = time.perf_counter()
+            for x, y in pts[1:]:
+                if pace:
+                    due += pace
+                    delay = due - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                _mouse.move(coords=(r.left + x, r.top + y))
+            _mouse.release(coords=(r.left + pts[-1][0], r.top + pts[-1][1]))
+        _paint_state.selection = None  # pencil strokes are committed on release
+        shape = self._commit("stroke", points=pts)
+        return _stroke_status(shape, len(points), pts, time.perf_counter() - t0, tolerance, (r.left, r.top))
+
+    def draw_stroke(self, points, tolerance: float = 1.0, pace_ms: float = 0.0) -> str:
+        try:
+            paint_window = self._focus_window()
+            if not self._select_pencil_tool(paint_window):
+                return "Could not locate Pencil tool."
+            canvas = find_canvas(paint_window)
+            return self._drag_stroke(canvas, canvas.rectangle(), points, tolerance, pace_ms)
+        except Exception as e:
+            _paint_state.forget()
+            return f"Error drawing stroke: {e}"
+
+    def _revert(self, entry, redo: bool) -> str:
+        """Paint's own undo: the pixels can't be restored from outside, so the
+        history only tracks which operation Ctrl+Z / Ctrl+Y is expected to hit."""
+        paint_window = self._focus_window()
+        # commit an open text box first so Ctrl+Z removes it whole, not its last keystroke
+        _clear_selection(paint_window)
+        paint_window.type_keys("^y" if redo else "^z", set_foreground=True)
+        _paint_state.selection = None
+        return "ctrl_y" if redo else "ctrl_z"
+
+    def reset(self):
+        """Select all and delete: Paint fills the canvas with the background colour."""
+        paint_window = self._focus_window()
+        _clear_selection(paint_window)
+        paint_window.type_keys("^a{DELETE}", set_foreground=True)
+        # Ctrl+A switches Paint to the selection tool
+        _paint_state.forget()
+
+    def _batch_begin(self):
+        paint_window = self._focus_window()
+        # Clear any lingering text box
+        try:
+            _clear_selection(paint_window)
+        except Exception:
+            _paint_state.forget()
+        canvas = find_canvas(paint_window)
+        return {"window": paint_window, "canvas": canvas, "rect": canvas.rectangle()}
+
+    def _batch_op(self, ctx, op: dict) -> str:
+        kind = op.get("op")
+        paint_window, canvas, r = ctx["window"], ctx["canvas"], ctx["rect"]
+        # Tool selection is skipped when _paint_state says the tool is already active
+        if kind == "rectangle":
+            if not self._select_rectangle_tool(paint_window):
+                return "Could not locate Rectangle tool."
+            return self._drag_rectangle(canvas, r, op.get("x1"), op.get("y1"), op.get("x2"), op.get("y2"))
+        if kind == "text":
+            # Reselecting the Text tool commits the previous text box (never skipped then)
+            if not self._select_text_tool(paint_window):
+                return "Text tool not found."
+            return self._insert_text(paint_window, canvas, op["text"], box=_op_box(op))
+        if kind == "stroke":
+            if not self._select_pencil_tool(paint_window):
+                return "Could not locate Pencil tool."
+            return self._drag_stroke(canvas, r, op["points"], op.get("tolerance", 1.0), op.get("pace_ms", 0.0))
+        raise ValueError(f"Unknown op '{kind}' (expected rectangle, text or stroke)")
+
+    def describe(self) -> list:
+        details = []
+        try:
+            if paint_app:
+                details.append(f"paint_backend={_app_backend_name(paint_app)}")
                 try:
-                    if overlay_found and overlay is not None:
-                        target_handle = overlay.element_info.handle
+                    proc = paint_app.process
+                    details.append(f"paint_process={proc}")
                 except Exception:
                     pass
-                if target_handle is None and canvas is not None:
-                    try:
-                        target_handle = canvas.element_info.handle
-                    except Exception:
-                        pass
-                if target_handle:
-                    import win32gui, win32con
-                    try:
-                        win32gui.SetForegroundWindow(target_handle)
-                    except Exception:
-                        pass
-                    for ch in text:
-                        try:
-                            win32gui.PostMessage(target_handle, win32con.WM_CHAR, ord(ch), 0)
-                            time.sleep(0.01)
-                        except Exception:
-                            break
-                    inserted = True  # we attempted injection; visual check still required
-                    if mode is None:
-                        mode = "wm_char_injected"
+                details.append(f"window_alive={_window_pool.alive()}")
+            else:
+                details.append("paint_app=None")
+        except Exception as e:
+            details.append(f"paint_state_error={e}")
+        if paint_app and _window_pool.alive():
+            try:
+                env = _text_env_key(_window_pool.get(_app_backend_name(paint_app))[1])
+                order = _strategy_ranker.order(env, TEXT_STRATEGIES, explore=False)
+                details.append(f"text_strategy_env={env} order={','.join(order)}")
             except Exception:
                 pass
+        for name, st in _waiter.stats().items():
+            details.append(f"wait[{name}]=" + " ".join(f"{k}={v}" for k, v in st.items()))
+        details.append("window_pool=" + " ".join(f"{k}={v}" for k, v in _window_pool.stats().items()))
+        details.append("locator_cache=" + " ".join(f"{k}={v}" for k, v in _locator_cache.stats().items()))
+        details.append("paint_state=" + " ".join(f"{k}={v}" for k, v in _paint_state.stats().items()))
+        if _injector is not None:
+            for name, st in _injector.stats().items():
+                details.append(f"text_injection[{name}]=" + " ".join(f"{k}={v}" for k, v in st.items()))
+        return details
+
+class RasterBackend(DrawingBackend):
+    """In-process Pillow canvas. Mirrors the geometry rules of the UIA path
+    (relative coordinates, centered default box, shared ``_scene``) so
+    results can be compared pixel-for-pixel, without any GUI round trips.
+    Pixels live in a ``TiledCanvas`` (tile size MSPAINT_TILE_SIZE, memmapped
+    under MSPAINT_TILE_DIR if set), so each operation, verification, capture
+    and export touches only the tiles involved."""
+    name = "raster"
+    tiled = True
+
+    def __init__(self, width: int = 1920, height: int = 1080, background="white", tile: int | None = None,
+                 tile_dir: str | None = None):
+        from tiled_canvas import TiledCanvas
+        self.width = width
+        self.height = height
+        self.background = background
+        tile = tile or int(os.environ.get("MSPAINT_TILE_SIZE", "512"))
+        tile_dir = tile_dir or os.environ.get("MSPAINT_TILE_DIR")
+        path = os.path.join(tile_dir, f"raster_{os.getpid()}_{id(self):x}.tiles") if tile_dir else None
+        self.canvas = TiledCanvas(width, height, tile=tile, background=background, path=path,
+                                  max_resident=int(os.environ.get("MSPAINT_TILE_RESIDENT", "64")))
+
+    def rect(self) -> _Rect:
+        return _Rect(0, 0, self.width, self.height)
+
+    def open(self) -> str:
+        return f"Raster canvas ready (v={_app_version()}) size={self.width}x{self.height}"
+
+    def reset(self):
+        self.canvas.reset()
+
+    def replay(self, ops: list) -> dict:
+        # live Paint draws over what it shows; the raster canvas starts blank
+        self.reset()
+        return super().replay(ops)
+
+    def _revert(self, entry, redo: bool) -> str:
+        # only the changed pixels are pasted back, tile by tile
+        for (x1, y1, _, _), img in entry.images(after=redo):
+            self.canvas.paste(img, (x1, y1))
+        return "pixels"
+
+    def draw_rectangle(self, x1=None, y1=None, x2=None, y2=None) -> str:
+        start_rel, end_rel, use_custom = _resolve_box(self.rect(), x1, y1, x2, y2)
+        region = _verify_region((start_rel, end_rel), self.width, self.height)
+        before = self.canvas.crop(region) if _VERIFY else None
+        # Paint's rectangle tool draws a 1px outline in the primary colour (black)
+        (bx1, by1), (bx2, by2) = start_rel, end_rel
+        parts = self.canvas.paint(
+            (min(bx1, bx2), min(by1, by2), max(bx1, bx2) + 1, max(by1, by2) + 1),
+            lambda d, dx, dy: d.rectangle([(bx1 + dx, by1 + dy), (bx2 + dx, by2 + dy)], outline=(0, 0, 0), width=1),
+            snapshot=self.recording)
+        change = _pixel_change(before, self.canvas.crop(region), region) if before is not None else None
+        shape = self._commit("rect", (start_rel, end_rel), parts=parts)
+        return " ".join([
+            f"Rectangle drawn success=True shape_id={shape.id if shape else None} rel_start={start_rel} rel_end={end_rel} "
+            f"abs_start={start_rel} abs_end={end_rel} custom={use_custom} v={_app_version()}"]
+            + _verify_parts(change))
+
+    def add_text(self, text: str, box=None) -> str:
+        last_box = _scene.last_box()
+        reuse_last = box is None and last_box is not None
+        if box is not None:
+            start_rel, end_rel, _ = _resolve_box(self.rect(), *box)
+        elif reuse_last:
+            start_rel, end_rel = last_box
+        else:
+            start_rel, end_rel = _auto_text_box(self.rect(), text)
+        # Shrink the font until the wrapped text fits the box
+        inner_w = abs(end_rel[0] - start_rel[0]) - 2 * _TEXT_PAD
+        inner_h = abs(end_rel[1] - start_rel[1]) - 2 * _TEXT_PAD
+        lay = _text_layout().fit(text, max(1, inner_w), max(1, inner_h), _TEXT_SIZE)
+        font = _text_layout().font(lay.size)
+        region = _verify_region((start_rel, end_rel), self.width, self.height)
+        before = self.canvas.crop(region) if _VERIFY else None
+        # Paint places the caret just inside the text box border
+        x0, y0 = min(start_rel[0], end_rel[0]) + _TEXT_PAD, min(start_rel[1], end_rel[1]) + _TEXT_PAD
+
+        def _text(d, dx, dy):
+            for i, line in enumerate(lay.lines):
+                d.text((x0 + dx, y0 + dy + i * lay.line_height), line, fill=(0, 0, 0), font=font)
+        # Text that doesn't fit may run past the box; the glyph margin covers overhangs
+        parts = self.canvas.paint((x0 - _TEXT_PAD, y0 - _TEXT_PAD, x0 + lay.width + 2 * _TEXT_PAD,
+                                   y0 + lay.height + lay.line_height), _text, snapshot=self.recording)
+        change = _pixel_change(before, self.canvas.crop(region), region) if before is not None else None
+        success = change["verified"] if change is not None else True
+        shape = self._commit("text", (start_rel, end_rel), text=text, parts=parts) if success else None
+        return " ".join([
+            f"TextDrag '{text}' success={success}",
+            "mode=raster_draw",
+            "drag_used=False",
+            "overlay_found=False",
+            f"v={_app_version()}",
+        ] + _verify_parts(change) + ([f"shape_id={shape.id}"] if shape is not None else []) + [
+            f"font_px={lay.size} lines={len(lay.lines)} fits={lay.fits}",
+            f"rel_box={(start_rel, end_rel)}",
+            f"reuse_last={reuse_last}",
+        ])
+
+    def draw_stroke(self, points, tolerance: float = 1.0, pace_ms: float = 0.0) -> str:
+        # pace_ms only spaces real mouse events; the raster canvas draws at once
+        t0 = time.perf_counter()
+        pts = _simplify_rdp(points, tolerance)
+        if len(pts) < 2:
+            return f"Stroke needs at least 2 distinct points (got {len(pts)})."
+        # The Pencil tool joins successive mouse positions with 1px segments
+        x1, y1, x2, y2 = _points_bbox(pts)
+        parts = self.canvas.paint((x1 - 1, y1 - 1, x2 + 2, y2 + 2),
+                                  lambda d, dx, dy: d.line([(x + dx, y + dy) for x, y in pts], fill=(0, 0, 0), width=1),
+                                  snapshot=self.recording)
+        shape = self._commit("stroke", points=pts, parts=parts)
+        return _stroke_status(shape, len(points), pts, time.perf_counter() - t0, tolerance)
+
+    def canvas_bounds(self):
+        return (0, 0, self.width, self.height)
+
+    def grab_canvas(self, region=None):
+        from canvas_capture import clamp_region
+        box = clamp_region(self.width, self.height, region)
+        with telemetry.stage("capture.grab"):
+            return self.canvas.crop(box), box
+
+    def render_region(self, region=None, scale: float = 1.0, since=None) -> dict:
+        """Frame of ``region`` at ``scale`` rendered tile by tile. With ``since``
+        (a canvas version from an earlier capture) only the tiles changed after
+        it are rendered: ``image`` is None when nothing changed, else the
+        changed part with ``frame_box`` giving its place in the scaled frame."""
+        import math
+        from canvas_capture import clamp_region
+        box = clamp_region(self.width, self.height, region)
+        size = (max(1, round((box[2] - box[0]) * scale)), max(1, round((box[3] - box[1]) * scale)))
+        frame = {"box": box, "size": size, "version": self.canvas.version, "delta": since is not None,
+                 "image": None, "frame_box": None}
+        with telemetry.stage("capture.grab"):
+            dirty = box if since is None else self.canvas.changed(box, since)
+            if dirty is None:
+                return frame
+            img = self.canvas.render(dirty, scale)
+        fx, fy = math.floor((dirty[0] - box[0]) * scale), math.floor((dirty[1] - box[1]) * scale)
+        frame["image"] = img
+        frame["frame_box"] = (fx, fy, min(size[0], fx + img.width), min(size[1], fy + img.height))
+        return frame
+
+    def export(self, path: str) -> dict:
+        """Save to the image file ``path``, or, if ``path`` is a directory
+        (existing, or ending in a separator), write only the tiles changed
+        since the last export there plus a manifest."""
+        if os.path.isdir(path) or path.endswith(("/", os.sep)):
+            return dict(path=path, tiles=True, **self.canvas.export_tiles(path))
+        self.canvas.save(path)
+        return {"path": path, "size": (self.width, self.height)}
+
+    def describe(self) -> list:
+        return [f"canvas_size={self.width}x{self.height}",
+                "tiles=" + " ".join(f"{k}={v}" for k, v in self.canvas.stats().items())]
+
+_live_sessions = set()  # session keys with a close hook registered
+
+def _session_key() -> str:
+    """Identity of the MCP session behind the current request ('default' outside one).
+    The first request of a session registers ``_session_closed`` for when the
+    session object goes away."""
+    try:
+        session = mcp.get_context().session
+    except Exception:
+        return "default"
+    key = f"s{id(session)}"
+    if key not in _live_sessions:
+        import weakref
+        _live_sessions.add(key)
+        weakref.finalize(session, _session_closed, key)
+    return key
+
+def _session_closed(key: str):
+    """Drop per-session scheduler and routing state of a closed session."""
+    _live_sessions.discard(key)
+    _ui_scheduler.forget(key)
+    _thread_scheduler.forget(key)
+    if _backend is not None:
+        _backend.session_closed(key)
+
+class FarmBackend(DrawingBackend):
+    """Routes each MCP session to one of ``workers`` drawing processes (see
+    worker_farm.py), each owning its own ``backend`` canvas, scene and journal.
+    Calls only wait on IPC, so they bypass the UI worker thread and sessions
+    pinned to different workers draw in parallel."""
+    name = "farm"
+    thread_safe = True
+
+    def __init__(self, workers: int = 2, backend: str = "raster", **backend_kwargs):
+        from worker_farm import WorkerFarm
+        if backend != "raster":
+            # UIA workers would all attach to the same Paint window and share one mouse and keyboard
+            raise ValueError(f"Worker processes need the raster backend, not '{backend}'")
+        journal_path = os.environ.get("MSPAINT_JOURNAL", os.path.join(os.path.expanduser("~"), ".mspaint_mcp", "journal.bin"))
+        self.inner = backend
+        self.farm = WorkerFarm(
+            workers, backend, backend_kwargs,
+            journal_base=None if journal_path.strip().lower() in _JOURNAL_OFF else journal_path,
+            health_interval=float(os.environ.get("MSPAINT_WORKER_HEALTH_INTERVAL", "5")),
+            call_timeout=_UI_CALL_TIMEOUT,
+        ).start()
+
+    def _call(self, method: str, *args):
+        with telemetry.stage("farm.call", method=method):
+            return self.farm.call(_session_key(), method, *args)
+
+    def _status(self, method: str, *args) -> str:
+        """``_call`` for status-line methods: worker failures become the status."""
+        from worker_farm import WorkerError
+        try:
+            return self._call(method, *args)
+        except WorkerError as e:
+            return f"Error: {e}"
+
+    def open(self) -> str:
+        return self._status("open")
+
+    def draw_rectangle(self, x1=None, y1=None, x2=None, y2=None) -> str:
+        return self._status("draw_rectangle", x1, y1, x2, y2)
+
+    def add_text(self, text: str, box=None) -> str:
+        return self._status("add_text", text, box)
+
+    def draw_stroke(self, points, tolerance: float = 1.0, pace_ms: float = 0.0) -> str:
+        return self._status("draw_stroke", points, tolerance, pace_ms)
+
+    def run_batch(self, operations: list, stop_on_error: bool = False) -> dict:
+        from worker_farm import WorkerError
+        try:
+            return self._call("run_batch", operations, stop_on_error)
+        except WorkerError as e:
+            return {"ok": False, "setup_ms": 0.0, "total_ms": 0.0, "results": [], "error": str(e)}
+
+    def ui_snapshot(self, *args) -> str:
+        return self._status("ui_snapshot", *args)
+
+    def undo(self, steps: int = 1, redo: bool = False) -> str:
+        return self._status("undo", steps, redo)
+
+    def history(self, limit: int = 20) -> dict:
+        return self._call("history", limit)
+
+    def reset(self):
+        self._call("reset")
+
+    def session_closed(self, key: str):
+        # the worker's session count only reflects open sessions
+        self.farm.forget(key)
+
+    def journal_action(self, action: str = "stats", target: str = "active", output=None) -> str:
+        # each worker keeps its own journal: act on the one behind this session
+        return self._status("journal_action", action, target, output)
+
+    def query_scene(self, method: str, *args):
+        return self._call("scene." + method, *args)
+
+    def canvas_bounds(self):
+        return self._call("canvas_bounds")
+
+    def grab_canvas(self, region=None):
+        return self._call("grab_canvas", region)
+
+    def describe(self) -> list:
+        lines = [f"farm_backend={self.inner}", f"farm_session={_session_key()}"]
+        lines += [f"worker_{st['id']}=" + " ".join(f"{k}={v}" for k, v in st.items() if k != "id")
+                  for st in self.farm.stats()]
+        return lines
 
-        # 6. Clipboard fallback
-        if not inserted:
+_BACKENDS = {
+    "uia": UIABackend,
+    "raster": RasterBackend,
+    "farm": FarmBackend,
+}
+_backend = None  # Active DrawingBackend, chosen at startup (see main / MSPAINT_BACKEND)
+
+def _parse_size(value: str):
+    """Parse 'WIDTHxHEIGHT' into an (int, int) tuple."""
+    w, h = value.lower().split("x", 1)
+    return int(w), int(h)
+
+def set_backend(name: str, **kwargs) -> DrawingBackend:
+    """Instantiate and activate the named backend ('uia' or 'raster')."""
+    global _backend
+    try:
+        cls = _BACKENDS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown backend '{name}' (choose from {', '.join(_BACKENDS)})")
+    _backend = cls(**kwargs)
+    return _backend
+
+def get_backend() -> DrawingBackend:
+    """Return the active backend, creating it from the environment on first use."""
+    if _backend is None:
+        name = os.environ.get("MSPAINT_BACKEND", "uia")
+        kwargs = {}
+        size = os.environ.get("MSPAINT_CANVAS_SIZE")
+        if size and name.lower() == "raster":
+            kwargs["width"], kwargs["height"] = _parse_size(size)
+        workers = int(os.environ.get("MSPAINT_WORKERS", "0"))
+        if workers > 0:
+            set_backend("farm", workers=workers, backend=name, **kwargs)
+        else:
+            set_backend(name, **kwargs)
+    return _backend
+
+# ---------------------------------------------------------------------------
+# UI automation executor
+# ---------------------------------------------------------------------------
+class UIQueueFull(RuntimeError):
+    """Raised when the UI executor's bounded queue cannot accept more work."""
+
+class _UIExecutor:
+    """Single dedicated worker thread that owns every drawing call, keeping the
+    UI resource serialized while the FastMCP event loop stays free for
+    lightweight tools. Work is queued in a bounded FIFO; each item may carry a
+    deadline after which it is dropped instead of run, and items cancelled
+    while still queued are skipped. A call that is already running cannot be
+    interrupted; its result is simply discarded."""
+    def __init__(self, max_queue: int = 32):
+        import queue, threading
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.max_queue = max_queue
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.expired = 0
+        self.cancelled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._started = 0
+        self._current = None  # (name, start time) of the running item
+
+    def _ensure_thread(self):
+        import threading
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="paint-ui", daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args, deadline=None, **kwargs):
+        """Queue ``fn(*args, **kwargs)``; returns a concurrent.futures.Future.
+        ``deadline`` is an absolute time.monotonic() value."""
+        import concurrent.futures, queue
+        self._ensure_thread()
+        fut = concurrent.futures.Future()
+        try:
+            self._queue.put_nowait((fut, fn, args, kwargs, time.monotonic(), deadline))
+        except queue.Full:
+            self.rejected += 1
+            raise UIQueueFull(f"UI queue full (depth={self._queue.qsize()}/{self.max_queue}); retry later")
+        self.submitted += 1
+        return fut
+
+    def _run(self):
+        # UIA objects are COM objects; the worker needs its own apartment
+        try:
+            import comtypes
+            comtypes.CoInitializeEx()
+        except Exception:
+            pass
+        while True:
+            fut, fn, args, kwargs, enqueued, deadline = self._queue.get()
+            if not fut.set_running_or_notify_cancel():
+                self.cancelled += 1
+                continue
+            now = time.monotonic()
+            waited = now - enqueued
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            telemetry.observe("ui_queue_wait", waited)
+            self._started += 1
+            if deadline is not None and now > deadline:
+                self.expired += 1
+                fut.set_exception(TimeoutError(f"UI request expired after {waited:.2f}s in queue"))
+                continue
+            self._current = (getattr(fn, '__name__', repr(fn)), now)
             try:
-                import pyperclip
-                pyperclip.copy(text)
-                paint_window.type_keys("^v", set_foreground=True)
-                inserted = True
-                mode = "clipboard_paste"
-            except Exception:
-                pass
+                fut.set_result(fn(*args, **kwargs))
+                self.completed += 1
+            except BaseException as e:
+                self.failed += 1
+                fut.set_exception(e)
+            finally:
+                self._current = None
 
-        status_parts = [
-            f"TextDrag '{text}' success={inserted}",
-            f"mode={mode}",
-            f"drag_used={drag_used}",
-            f"overlay_found={overlay_found}",
-            f"v={_APP_VERSION}"
-        ]
-        if rel_box:
-            status_parts.append(f"rel_box={rel_box}")
-            status_parts.append(f"reuse_last={reuse_last}")
-        if abs_points:
-            status_parts.append(f"abs_points={abs_points}")
-        if canvas_err:
-            status_parts.append(f"note={canvas_err}")
-        return {"content": [TextContent(type="text", text=" ".join(status_parts))]}
+    def stats(self) -> dict:
+        current = self._current
+        return {
+            "depth": self._queue.qsize(),
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "cancelled": self.cancelled,
+            "wait_avg_ms": round(self._wait_total / self._started * 1000.0, 1) if self._started else 0.0,
+            "wait_max_ms": round(self._wait_max * 1000.0, 1),
+            "running": f"{current[0]}:{(time.monotonic() - current[1]) * 1000.0:.0f}ms" if current else None,
+        }
+
+_ui_executor = _UIExecutor(max_queue=int(os.environ.get("MSPAINT_UI_QUEUE", "32")))
+_UI_CALL_TIMEOUT = float(os.environ.get("MSPAINT_UI_TIMEOUT", "120"))
+
+# ---------------------------------------------------------------------------
+# Per-session request scheduling
+# ---------------------------------------------------------------------------
+class _SessionScheduler:
+    """Admission control and fair ordering in front of an executor.
+
+    Requests wait in one FIFO per session; sessions with work are served
+    round-robin, and a session never has more than one request in flight, so
+    each client's calls run in the order it sent them while a chatty client
+    cannot starve the others. At most ``max_inflight`` requests are handed to
+    ``dispatch`` at once; the rest wait here, where they can still be
+    cancelled or expire. Admission fails with UIQueueFull once a session has
+    ``max_per_session`` requests pending or all sessions together have
+    ``max_pending``, which tells clients to back off instead of queueing
+    unbounded work behind a single UI."""
+    def __init__(self, dispatch, max_inflight: int = 1, max_per_session: int = 8, max_pending: int = 32):
+        import collections, threading
+        self._dispatch = dispatch  # (fn, args, kwargs, deadline) -> concurrent.futures.Future
+        self.max_inflight = max_inflight
+        self.max_per_session = max_per_session
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._queues = {}  # session -> deque of pending items
+        self._ready = collections.deque()  # sessions with pending work, in service order
+        self._running = set()  # sessions with a request in flight
+        self._inflight = 0
+        self._pending = 0
+        self._served = collections.Counter()
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.cancelled = 0
+        self._wait_max = 0.0
+
+    def submit(self, session: str, fn, args=(), kwargs=None, deadline=None):
+        """Queue ``fn`` for ``session``; returns a concurrent.futures.Future.
+        ``fn`` runs in a copy of the caller's context, so the request context
+        (and with it ``_session_key()``) is visible on the executor thread."""
+        import collections, concurrent.futures, contextvars
+        fut = concurrent.futures.Future()
+        fn = functools.update_wrapper(functools.partial(contextvars.copy_context().run, fn), fn)
+        with self._lock:
+            queue = self._queues.get(session)
+            depth = len(queue) if queue else 0
+            if depth >= self.max_per_session or self._pending >= self.max_pending:
+                self.rejected += 1
+                raise UIQueueFull(f"request queue full (session_pending={depth}/{self.max_per_session} "
+                                  f"total_pending={self._pending}/{self.max_pending}); retry later")
+            if queue is None:
+                queue = self._queues[session] = collections.deque()
+            if not queue and session not in self._running:
+                self._ready.append(session)
+            queue.append((fut, fn, args, kwargs or {}, deadline, time.monotonic()))
+            self._pending += 1
+            self.admitted += 1
+        self._pump()
+        return fut
+
+    def _next(self):
+        """Pop the next runnable item (lock held), skipping cancelled and expired ones."""
+        while self._ready and self._inflight < self.max_inflight:
+            session = self._ready.popleft()
+            queue = self._queues[session]
+            fut, fn, args, kwargs, deadline, enqueued = queue.popleft()
+            self._pending -= 1
+            if not queue:
+                del self._queues[session]
+            if not fut.set_running_or_notify_cancel():
+                self.cancelled += 1
+                continue
+            now = time.monotonic()
+            if deadline is not None and now > deadline:
+                self.expired += 1
+                fut.set_exception(TimeoutError(f"request expired after {now - enqueued:.2f}s in queue"))
+                continue
+            self._wait_max = max(self._wait_max, now - enqueued)
+            telemetry.observe("scheduler_wait", now - enqueued)
+            # the session's next item is re-readied when this one finishes (_finished)
+            self._running.add(session)
+            self._inflight += 1
+            self._served[session] += 1
+            return session, fut, fn, args, kwargs, deadline
+        return None
+
+    def _pump(self):
+        while True:
+            with self._lock:
+                item = self._next()
+            if item is None:
+                return
+            session, fut, fn, args, kwargs, deadline = item
+            try:
+                inner = self._dispatch(fn, args, kwargs, deadline)
+            except BaseException as e:
+                fut.set_exception(e)
+                self._finished(session)
+                continue
+            inner.add_done_callback(functools.partial(self._relay, session, fut))
+
+    def _relay(self, session, fut, inner):
+        if inner.cancelled():
+            fut.set_exception(TimeoutError("request cancelled by the executor"))
+        elif inner.exception() is not None:
+            fut.set_exception(inner.exception())
+        else:
+            fut.set_result(inner.result())
+        self._finished(session)
+        self._pump()
+
+    def _finished(self, session):
+        with self._lock:
+            self._inflight -= 1
+            self._running.discard(session)
+            if self._queues.get(session) and session not in self._ready:
+                self._ready.append(session)
+
+    def forget(self, session: str):
+        """Drop the service counter of a closed session (kept while it has work)."""
+        with self._lock:
+            if session not in self._queues and session not in self._running:
+                self._served.pop(session, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            busiest = self._served.most_common(1)
+            return {
+                "sessions": len(self._served),
+                "pending": self._pending,
+                "inflight": self._inflight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "cancelled": self.cancelled,
+                "wait_max_ms": round(self._wait_max * 1000.0, 1),
+                "busiest_served": busiest[0][1] if busiest else 0,
+            }
+
+def _dispatch_ui(fn, args, kwargs, deadline):
+    return _ui_executor.submit(fn, *args, deadline=deadline, **kwargs)
+
+_thread_pool = None  # for thread-safe backends (worker farm); created on first use
+
+def _dispatch_thread(fn, args, kwargs, deadline):
+    global _thread_pool
+    if _thread_pool is None:
+        import concurrent.futures
+        _thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="paint-call")
+    return _thread_pool.submit(fn, *args, **kwargs)
+
+_SESSION_QUEUE = int(os.environ.get("MSPAINT_SESSION_QUEUE", "8"))
+# The UI thread gets one request at a time so the next pick is always the fair one
+_ui_scheduler = _SessionScheduler(_dispatch_ui, max_inflight=1, max_per_session=_SESSION_QUEUE,
+                                  max_pending=_ui_executor.max_queue)
+# Thread-safe backends run sessions concurrently; each session is still kept in order
+_thread_scheduler = _SessionScheduler(_dispatch_thread, max_inflight=32, max_per_session=_SESSION_QUEUE,
+                                      max_pending=4 * _ui_executor.max_queue)
+
+async def _run_ui(fn, *args, timeout: float | None = None, **kwargs):
+    """Run ``fn`` on the UI worker thread and await its result without blocking
+    the event loop. ``timeout`` (seconds) bounds queueing plus execution; if the
+    awaiting task is cancelled or times out, queued work is withdrawn."""
+    import asyncio
+    timeout = _UI_CALL_TIMEOUT if timeout is None else timeout
+    # e.g. worker farm calls run on plain threads, so sessions don't queue behind each other
+    thread_safe = getattr(getattr(fn, '__self__', None), 'thread_safe', False)
+    scheduler = _thread_scheduler if thread_safe else _ui_scheduler
+    fut = scheduler.submit(_session_key(), fn, args, kwargs, deadline=time.monotonic() + timeout)
+    with telemetry.stage("tool", tool=getattr(fn, '__name__', 'unknown')):
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(fut), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            fut.cancel()
+            raise
+
+async def _ui_text(fn, *args, **kwargs) -> dict:
+    """Run a backend call that returns a status line and wrap it as tool content."""
+    import asyncio
+    try:
+        text = await _run_ui(fn, *args, **kwargs)
+    except UIQueueFull as e:
+        text = f"Busy: {e}"
+    except asyncio.TimeoutError:
+        text = f"Error: UI request timed out after {_UI_CALL_TIMEOUT:.0f}s"
+    return {"content": [TextContent(type="text", text=text)]}
+
+@mcp.tool()
+async def diagnostics() -> dict:
+    """Return diagnostic info about runtime environment and Paint process state."""
+    import hashlib, os, inspect
+    details = []
+    # Python executable
+    details.append(f"python_executable={sys.executable}")
+    # File path & hash
+    try:
+        current_file = inspect.getsourcefile(sys.modules[__name__]) or __file__
+        if os.path.exists(current_file):
+            with open(current_file,'rb') as f:
+                data = f.read()
+            md5 = hashlib.md5(data).hexdigest()
+            details.append(f"app_file={current_file}")
+            details.append(f"app_md5={md5}")
+            details.append(f"app_version={_app_version()}")
+            details.append(f"app_modified_since_import={_app_modified()}")
+        else:
+            details.append(f"app_file_missing={current_file}")
+    except Exception as e:
+        details.append(f"file_hash_error={e}")
+    # Drawing backend / Paint process info
+    try:
+        backend = get_backend()
+        details.append(f"drawing_backend={backend.name}")
+        details.extend(backend.describe())
+    except Exception as e:
+        details.append(f"backend_error={e}")
+    details.append("ui_executor=" + " ".join(f"{k}={v}" for k, v in _ui_executor.stats().items()))
+    details.append("ui_scheduler=" + " ".join(f"{k}={v}" for k, v in _ui_scheduler.stats().items()))
+    if _thread_scheduler.admitted:
+        details.append("thread_scheduler=" + " ".join(f"{k}={v}" for k, v in _thread_scheduler.stats().items()))
+    return {"content":[TextContent(type="text", text="Diagnostics:\n" + "\n".join(details))]}
+
+@mcp.tool()
+async def restart_instructions() -> dict:
+    """Provide explicit steps to fully restart the Paint MCP server ensuring latest code is active."""
+    steps = [
+        "1. Stop any existing server process: close the terminal running app.py or kill python process named mspaint server.",
+        "2. (Optional) Run diagnostics tool before stopping to note current app_md5.",
+        "3. In project root run: `python app.py dev` (or your launcher) to start fresh. If using uv: `uv run python app.py dev`.",
+        "4. After start, call diagnostics again and confirm app_md5 matches the file you just edited.",
+        "5. Call open_paint tool, then add_text_in_paint / draw_rectangle.",
+        "6. If text still not types and message shows canvas_control_missing_fallback_used, ensure the Paint window is not minimized and is fully visible on primary monitor.",
+        "7. If issues persist, try switching Windows theme (light/dark) once or resizing the Paint window; then retry add_text_in_paint.",
+        "8. Provide the diagnostics output plus tool responses for further analysis.",
+        f"Current loaded code hash: {_app_md5()}",
+        f"App version tag: {_app_version()}",
+    ]
+    return {"content": [TextContent(type="text", text="Restart Instructions:\n" + "\n".join(steps))]}
+
+@mcp.tool()
+async def open_paint() -> dict:
+    """Open Microsoft Paint maximized on primary monitor (or initialise the
+    headless raster canvas when the raster backend is active)."""
+    return await _ui_text(get_backend().open)
+
+@mcp.tool()
+async def draw_rectangle(x1: int | None = None, y1: int | None = None, x2: int | None = None, y2: int | None = None) -> dict:
+    """Draw a rectangle. If coordinates are omitted or invalid, a centered 300x140
+    rectangle (same region used by default text insertion) is drawn. Passing
+    all four coordinates within canvas bounds uses the custom region and
+    updates the shared box for subsequent text placement."""
+    return await _ui_text(get_backend().draw_rectangle, x1, y1, x2, y2)
+
+@mcp.tool()
+async def add_text_in_paint(text: str, shape_id: int | None = None) -> dict:
+    """Select the Text tool and type ``text`` into the last rectangle region
+    (or, when no rectangle has been drawn yet, a centered box sized to fit the
+    text, wrapping at 60% of the canvas width).
+    ``shape_id`` (from an earlier status line or ``scene_query``) targets that
+    shape's box instead. Returns concise status line including success, mode,
+    version, geometry and the new text shape's id."""
+    box = None
+    if shape_id is not None:
+        shape = await _scene_call("get", int(shape_id))
+        if shape is None:
+            return {"content": [TextContent(type="text", text=f"Error: Unknown shape_id {shape_id}")]}
+        box = shape.box
+    return await _ui_text(get_backend().add_text, text, box)
+
+@mcp.tool()
+async def draw_stroke(points: list[list[int]], tolerance: float = 1.0, pace_ms: float = 0.0) -> dict:
+    """Draw a freehand polyline with the Pencil tool through canvas-relative
+    ``points`` ([[x, y], ...]). The path is simplified with Ramer-Douglas-Peucker
+    to ``tolerance`` pixels (0 keeps every distinct point) and sent as one
+    continuous press/move/release sequence; ``pace_ms`` spaces the move events
+    for slow machines. Reports points sent and throughput in points/sec."""
+    return await _ui_text(get_backend().draw_stroke, points, tolerance, pace_ms)
+
+@mcp.tool()
+async def draw_batch(operations: list[dict], stop_on_error: bool = False) -> dict:
+    """Run many drawing operations in one call. Window, canvas and geometry are
+    resolved once, then each operation is streamed through in order.
+
+    Each operation is a dict with an ``op`` key:
+      - {"op": "rectangle", "x1": .., "y1": .., "x2": .., "y2": ..} (coords optional)
+      - {"op": "text", "text": "...", "x1": .., "y1": .., "x2": .., "y2": ..} (box optional,
+        or "shape_id": .. to write into an earlier shape)
+      - {"op": "stroke", "points": [[x, y], ...], "tolerance": 1.0, "pace_ms": 0} (last two optional)
+    Returns one summary line followed by a status line per operation with its timing.
+    """
+    import asyncio
+    try:
+        batch = await _run_ui(get_backend().run_batch, operations, stop_on_error=stop_on_error)
+    except UIQueueFull as e:
+        return {"content": [TextContent(type="text", text=f"Busy: {e}")]}
+    except asyncio.TimeoutError:
+        return {"content": [TextContent(type="text", text=f"Error: UI request timed out after {_UI_CALL_TIMEOUT:.0f}s")]}
+    lines = [
+        f"Batch success={batch['ok']} ops={len(operations)} ran={len(batch['results'])} "
+        f"ok={sum(1 for r in batch['results'] if r['ok'])} setup_ms={batch['setup_ms']} "
+        f"total_ms={batch['total_ms']} v={_app_version()}"
+    ]
+    if batch.get("error"):
+        lines.append(f"error={batch['error']}")
+    for r in batch["results"]:
+        lines.append(f"[{r['index']}] op={r['op']} ok={r['ok']} ms={r['ms']} {r['status']}")
+    return {"content": [TextContent(type="text", text="\n".join(lines))]}
+
+_capture_session = None  # canvas_capture.CaptureSession, created on first capture
+
+def _get_capture_session():
+    global _capture_session
+    if _capture_session is None:
+        from canvas_capture import CaptureSession
+        _capture_session = CaptureSession()
+    return _capture_session
+
+@mcp.tool()
+async def capture_canvas(x1: int | None = None, y1: int | None = None, x2: int | None = None,
+                         y2: int | None = None, scale: float = 1.0, format: str = "png",
+                         quality: int = 80, delta: bool = False) -> list:
+    """Capture the Paint canvas (only the canvas rectangle, not the screen) as an image.
+
+    Optional canvas-relative region (x1, y1, x2, y2), downscale factor
+    ``scale`` (0 < scale <= 1), ``format`` png/jpeg/webp and ``quality`` for
+    the lossy formats. With ``delta=True`` only the bounding box that changed
+    since the previous capture of the same region/scale is returned (or no
+    image at all if nothing changed); ``delta_box`` in the status line gives
+    its position in the scaled frame.
+    """
+    import asyncio
+    region = None if None in (x1, y1, x2, y2) else (x1, y1, x2, y2)
+    backend = get_backend()
+    if getattr(backend, "tiled", False):
+        return await _capture_tiled(backend, region, scale, format, quality, delta)
+    try:
+        img, box = await _run_ui(backend.grab_canvas, region)
+    except UIQueueFull as e:
+        return [TextContent(type="text", text=f"Busy: {e}")]
+    except asyncio.TimeoutError:
+        return [TextContent(type="text", text=f"Error: UI request timed out after {_UI_CALL_TIMEOUT:.0f}s")]
+    except Exception as e:
+        return [TextContent(type="text", text=f"Error capturing canvas: {e}")]
+    # Encoding runs off the UI thread so it never delays queued drawing calls
+    try:
+        with telemetry.stage("capture.encode", format=format.lower()):
+            shot = await asyncio.to_thread(_get_capture_session().capture, img, (backend.name, box, scale),
+                                           scale, format, quality, delta)
+    except ValueError as e:
+        return [TextContent(type="text", text=f"Error: {e}")]
+    status = (f"Canvas captured success=True region={box} scale={scale} frame_size={shot['size']} "
+              f"format={format.lower()} delta={shot['delta']} changed={shot['data'] is not None} "
+              f"delta_box={shot['box']} bytes={shot['bytes']} encode_ms={shot['encode_ms']} v={_app_version()}")
+    content = [TextContent(type="text", text=status)]
+    if shot["data"] is not None:
+        content.append(Image(data=shot["data"], format="jpeg" if format.lower() == "jpg" else format.lower()))
+    return content
+
+@mcp.tool()
+async def export_canvas(path: str) -> dict:
+    """Save the canvas to the image file ``path`` (format from its extension).
+    On the raster backend a directory path (existing, or ending in a
+    separator) gets an incremental tile export instead: only tiles changed
+    since the previous export to that directory are written, plus a
+    manifest.json describing the grid."""
+    import asyncio
+    t0 = time.perf_counter()
+    try:
+        info = await _run_ui(get_backend().export, path)
+    except UIQueueFull as e:
+        return {"content": [TextContent(type="text", text=f"Busy: {e}")]}
+    except asyncio.TimeoutError:
+        return {"content": [TextContent(type="text", text=f"Error: UI request timed out after {_UI_CALL_TIMEOUT:.0f}s")]}
+    except Exception as e:
+        return {"content": [TextContent(type="text", text=f"Error exporting canvas: {e}")]}
+    text = "Canvas exported success=True " + " ".join(f"{k}={v}" for k, v in info.items()) + f" ms={_ms_since(t0)}"
+    return {"content": [TextContent(type="text", text=text)]}
+
+async def _capture_tiled(backend, region, scale, format, quality, delta) -> list:
+    """capture_canvas for tiled canvases: the frame is rendered tile by tile
+    on the UI thread and a delta renders only tiles changed since the last
+    capture of the same region/scale (no full-frame comparison)."""
+    import asyncio
+    from canvas_capture import clamp_region
+    if not 0 < scale <= 1:
+        return [TextContent(type="text", text=f"Error: scale must be in (0, 1], got {scale}")]
+    session = _get_capture_session()
+    key = (backend.name, clamp_region(backend.width, backend.height, region), scale)
+    try:
+        frame = await _run_ui(backend.render_region, region, scale, session.version(key) if delta else None)
+    except UIQueueFull as e:
+        return [TextContent(type="text", text=f"Busy: {e}")]
+    except asyncio.TimeoutError:
+        return [TextContent(type="text", text=f"Error: UI request timed out after {_UI_CALL_TIMEOUT:.0f}s")]
+    try:
+        with telemetry.stage("capture.encode", format=format.lower()):
+            shot = await asyncio.to_thread(session.encode_frame, frame, key, format, quality)
+    except ValueError as e:
+        return [TextContent(type="text", text=f"Error: {e}")]
+    status = (f"Canvas captured success=True region={frame['box']} scale={scale} frame_size={shot['size']} "
+              f"format={format.lower()} delta={shot['delta']} changed={shot['data'] is not None} "
+              f"delta_box={shot['box']} bytes={shot['bytes']} encode_ms={shot['encode_ms']} "
+              f"version={frame['version']} v={_app_version()}")
+    content = [TextContent(type="text", text=status)]
+    if shot["data"] is not None:
+        content.append(Image(data=shot["data"], format="jpeg" if format.lower() == "jpg" else format.lower()))
+    return content
+
+async def _scene_call(method: str, *args):
+    """Scene query against the active backend; in-process scenes are read
+    directly, worker scenes over IPC."""
+    backend = get_backend()
+    if backend.thread_safe:
+        return await _run_ui(backend.query_scene, method, *args)
+    return backend.query_scene(method, *args)
+
+@mcp.tool()
+async def scene_query(x: int | None = None, y: int | None = None, x1: int | None = None,
+                      y1: int | None = None, x2: int | None = None, y2: int | None = None,
+                      width: int | None = None, height: int | None = None, kind: str | None = None,
+                      limit: int = 50) -> dict:
+    """Query the shapes drawn this session (canvas-relative boxes, with ids
+    usable as ``shape_id`` in other tools):
+      - x, y: shapes under that point, topmost first
+      - x1, y1, x2, y2: shapes overlapping that box
+      - width, height: a free box of that size that overlaps nothing
+      - otherwise: all shapes (optionally only ``kind`` rect/text/stroke)
+    """
+    import json
+    if width is not None and height is not None:
+        try:
+            bounds = await _run_ui(get_backend().canvas_bounds)
+        except Exception as e:
+            return {"content": [TextContent(type="text", text=f"Error resolving canvas bounds: {e}")]}
+        t0 = time.perf_counter()
+        free = await _scene_call("find_free", width, height, bounds)
+        text = f"Free box found={free is not None} box={free} bounds={bounds} ms={_ms_since(t0)}"
+        return {"content": [TextContent(type="text", text=text)]}
+    t0 = time.perf_counter()
+    if x is not None and y is not None:
+        shapes, query = await _scene_call("hit_test", x, y), f"hit=({x}, {y})"
+    elif None not in (x1, y1, x2, y2):
+        shapes, query = await _scene_call("overlapping", (x1, y1, x2, y2)), f"overlap={(x1, y1, x2, y2)}"
+    else:
+        shapes, query = await _scene_call("shapes"), "all"
+    if kind:
+        shapes = [s for s in shapes if s.kind == kind]
+    ms = _ms_since(t0)
+    lines = [f"Scene query={query} matches={len(shapes)} returned={min(len(shapes), limit)} ms={ms} "
+             f"stats={json.dumps(await _scene_call('stats'))}"]
+    lines += [json.dumps(s.as_dict()) for s in shapes[:limit]]
+    return {"content": [TextContent(type="text", text="\n".join(lines))]}
+
+@mcp.tool()
+async def journal(action: str = "stats", target: str = "active", output: str | None = None) -> dict:
+    """Inspect or use the operation journal of successful drawing calls.
+
+    Actions:
+      - stats: journal path, size, record counts and average append cost
+      - compact: rewrite the journal without superseded records
+      - clear: start a new document (journal marker, scene, history and canvas
+        reset; Paint is cleared with select-all + Delete)
+      - replay: rebuild the canvas from the journal. ``target`` "active" replays
+        into the current backend (raster at full speed, Paint through one
+        batched run); "raster" renders into a scratch headless canvas and saves
+        it as PNG to ``output`` if given.
+
+    With ``--workers`` each worker process keeps its own journal; the action
+    applies to the worker serving this session.
+    """
+    return await _ui_text(get_backend().journal_action, action, target, output)
+
+@mcp.tool()
+async def ui_snapshot(max_depth: int = 3, max_nodes: int = 200, root: str | None = None,
+                      control_types: list[str] | None = None, diff: bool = True,
+                      max_age: float = 0.0, full_dump: bool = False) -> dict:
+    """Structured JSON snapshot of Paint's UI tree (control type, auto_id, name,
+    rect per node), limited by ``max_depth`` / ``max_nodes`` and optionally
+    rooted at the subtree whose auto_id or name equals ``root``.
+    ``control_types`` restricts which node types are reported. With ``diff``
+    only added/removed/changed nodes since the previous snapshot with the same
+    options are returned; ``max_age`` (seconds) reuses a recent snapshot
+    without walking. ``full_dump`` returns the legacy print_control_identifiers text."""
+    return await _ui_text(get_backend().ui_snapshot, max_depth, max_nodes, root, control_types,
+                          diff, max_age, full_dump)
+
+@mcp.tool()
+async def undo(steps: int = 1) -> dict:
+    """Undo the last ``steps`` drawing operations. On the raster canvas only the
+    stored pixel delta of each operation is pasted back; on live Paint the
+    server sends Ctrl+Z and keeps the scene and journal in step."""
+    return await _ui_text(get_backend().undo, steps, False)
+
+@mcp.tool()
+async def redo(steps: int = 1) -> dict:
+    """Re-apply the last ``steps`` undone operations (until a new one is drawn)."""
+    return await _ui_text(get_backend().undo, steps, True)
+
+@mcp.tool()
+async def history(limit: int = 20) -> dict:
+    """List the undo and redo stacks (newest first: label, shape id, changed
+    box, compressed bytes) with the history's memory use against its cap
+    (MSPAINT_UNDO_MB; the oldest entries are evicted beyond it)."""
+    import json
+    try:
+        h = await _run_ui(get_backend().history, limit)
     except Exception as e:
-        import traceback
-        tb = traceback.format_exc()
-        return {"content": [TextContent(type="text", text=f"Error (drag-centered) adding text: {e}\nTraceback:\n{tb}")]}        
+        return {"content": [TextContent(type="text", text=f"Error reading history: {e}")]}
+    st = h["stats"]
+    lines = [f"History undo_steps={st['undo_steps']} redo_steps={st['redo_steps']} bytes={st['bytes']} "
+             f"max_bytes={st['max_bytes']} evicted={st['evicted']}"]
+    lines += ["undo " + json.dumps(e) for e in h["undo"]]
+    lines += ["redo " + json.dumps(e) for e in h["redo"]]
+    return {"content": [TextContent(type="text", text="\n".join(lines))]}
+
+@mcp.tool()
+async def metrics(stage_prefix: str = "", prometheus: bool = True) -> dict:
+    """Per-stage latency histograms (count, errors, p50/p95/p99/max ms) for every
+    tool stage: connect, focus, select_tool, find_canvas, drag, overlay polling,
+    each add_text fallback mode, UI queue wait and whole tool calls. Optionally
+    filtered by stage name prefix; a Prometheus text-format export is appended
+    as a second content item."""
+    lines = telemetry.REGISTRY.summary(prefix=stage_prefix) or ["(no samples yet)"]
+    content = [TextContent(type="text", text="Metrics:\n" + "\n".join(lines))]
+    if prometheus:
+        content.append(TextContent(type="text", text=telemetry.REGISTRY.prometheus()))
+    return {"content": content}
 
 def main():
-    print("STARTING MCP PAINT SERVER")
-    if len(sys.argv) > 1 and sys.argv[1] == "dev":
-        mcp.run()
+    import argparse
+    parser = argparse.ArgumentParser(description="MCP server for MS Paint")
+    parser.add_argument("mode", nargs="?", help="'dev' runs with the default FastMCP transport")
+    parser.add_argument("--transport", choices=["stdio", "sse", "streamable-http"],
+                        default=os.environ.get("MSPAINT_TRANSPORT", "stdio"),
+                        help="stdio serves one client; sse / streamable-http serve many clients from one process")
+    parser.add_argument("--host", default=os.environ.get("MSPAINT_HOST", "127.0.0.1"),
+                        help="Bind address for the HTTP transports")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("MSPAINT_PORT", "8000")),
+                        help="Port for the HTTP transports")
+    parser.add_argument("--backend", choices=sorted(n for n in _BACKENDS if n != "farm"),
+                        default=os.environ.get("MSPAINT_BACKEND", "uia"),
+                        help="Drawing backend: live Paint via UI automation or headless Pillow raster canvas")
+    parser.add_argument("--canvas-size", default=os.environ.get("MSPAINT_CANVAS_SIZE", "1920x1080"),
+                        help="Raster canvas size as WIDTHxHEIGHT (raster backend only)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("MSPAINT_WORKERS", "0")),
+                        help="Run N raster worker processes with per-session routing (0 = in-process)")
+    args = parser.parse_args()
+    if args.workers > 0 and args.backend != "raster":
+        parser.error("--workers needs --backend raster: Paint has one window and one input queue per desktop")
+    kwargs = {}
+    if args.backend == "raster":
+        kwargs["width"], kwargs["height"] = _parse_size(args.canvas_size)
+    if args.workers > 0:
+        set_backend("farm", workers=args.workers, backend=args.backend, **kwargs)
     else:
+        set_backend(args.backend, **kwargs)
+    # stdout carries the stdio transport, so startup notes go to stderr
+    print("Python executable:", sys.executable, file=sys.stderr)
+    print("STARTING MCP PAINT SERVER", file=sys.stderr)
+    if args.workers <= 0:
+        # farm workers resume their own journals
+        print(_begin_journal_session(), file=sys.stderr)
+    if args.mode == "dev":
+        mcp.run()
+    elif args.transport == "stdio":
         mcp.run(transport="stdio")
+    else:
+        mcp.settings.host, mcp.settings.port = args.host, args.port
+        print(f"Serving {args.transport} on http://{args.host}:{args.port}", file=sys.stderr)
+        mcp.run(transport=args.transport)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,74 @@
+"""Startup benchmark for the Paint MCP server.
+
+Measures, in fresh interpreters:
+  * import time of ``app`` (median of --runs)
+  * time from spawning ``app.py`` over stdio until the first ``tools/list``
+    response arrives (median of --runs)
+and exits non-zero when either median exceeds its budget, so it can gate CI
+and autoscaled worker images.
+
+    python bench_startup.py --runs 5 --import-budget-ms 1500 --list-budget-ms 4000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+_IMPORT_SNIPPET = (
+    "import time, sys; t = time.perf_counter(); import app; "
+    "sys.stdout.write(str((time.perf_counter() - t) * 1000.0))"
+)
+
+
+def measure_import_ms() -> float:
+    out = subprocess.run([sys.executable, "-c", _IMPORT_SNIPPET], cwd=HERE, capture_output=True,
+                         text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+async def _first_tools_list_ms(backend: str) -> float:
+    from mcp import ClientSession
+    from mcp.client.stdio import stdio_client, StdioServerParameters
+    params = StdioServerParameters(command=sys.executable, args=[os.path.join(HERE, "app.py"), "--backend", backend],
+                                   cwd=HERE)
+    t0 = time.perf_counter()
+    async with stdio_client(params) as (read, write):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            await session.list_tools()
+            return (time.perf_counter() - t0) * 1000.0
+
+
+def measure_tools_list_ms(backend: str) -> float:
+    return asyncio.run(_first_tools_list_ms(backend))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--backend", default="raster", help="backend passed to the spawned server")
+    parser.add_argument("--import-budget-ms", type=float, default=1500.0)
+    parser.add_argument("--list-budget-ms", type=float, default=4000.0)
+    args = parser.parse_args(argv)
+
+    imports = [measure_import_ms() for _ in range(args.runs)]
+    lists = [measure_tools_list_ms(args.backend) for _ in range(args.runs)]
+
+    ok = True
+    for label, samples, budget in (("import", imports, args.import_budget_ms),
+                                   ("first_tools_list", lists, args.list_budget_ms)):
+        median = statistics.median(samples)
+        within = median <= budget
+        ok &= within
+        print(f"{label}_ms median={median:.1f} min={min(samples):.1f} max={max(samples):.1f} "
+              f"budget={budget:.0f} within_budget={within}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Canvas frame encoding for the ``capture_canvas`` tool.
+
+Backends hand over a Pillow image of the canvas (or a sub-region of it);
+``CaptureSession`` scales and encodes it (PNG / JPEG / WebP) and, in delta
+mode, compares it with the previous frame taken with the same region and
+scale so only the bounding box of changed pixels has to be sent. Tiled
+canvases skip that comparison: they render only the tiles changed since the
+remembered canvas version and hand the result to ``encode_frame``.
+"""
+import io
+import threading
+import time
+
+FORMATS = {"png": "PNG", "jpeg": "JPEG", "jpg": "JPEG", "webp": "WEBP"}
+
+
+def clamp_region(width: int, height: int, region=None):
+    """Clamp an ``(x1, y1, x2, y2)`` canvas-relative region to the canvas;
+    ``None`` means the whole canvas. Raises ValueError for empty regions."""
+    if region is None:
+        return (0, 0, width, height)
+    x1, y1, x2, y2 = (int(v) for v in region)
+    x1, x2 = sorted((x1, x2))
+    y1, y2 = sorted((y1, y2))
+    box = (max(0, x1), max(0, y1), min(width, x2), min(height, y2))
+    if box[2] - box[0] < 1 or box[3] - box[1] < 1:
+        raise ValueError(f"Region {tuple(region)} does not overlap the {width}x{height} canvas")
+    return box
+
+
+def scale_image(img, scale: float):
+    """Downscale by ``scale`` (0 < scale <= 1); integer factors use ``reduce``."""
+    if not 0 < scale <= 1:
+        raise ValueError(f"scale must be in (0, 1], got {scale}")
+    if scale == 1:
+        return img
+    inverse = 1.0 / scale
+    if abs(inverse - round(inverse)) < 1e-6:
+        return img.reduce(int(round(inverse)))
+    from PIL import Image as PILImage
+    size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+    return img.resize(size, PILImage.BILINEAR)
+
+
+def encode(img, fmt: str = "png", quality: int = 80) -> bytes:
+    """Encode ``img`` as PNG (lossless, fast compression) or JPEG/WebP at ``quality``."""
+    pil_format = FORMATS.get(fmt.lower())
+    if pil_format is None:
+        raise ValueError(f"Unsupported format '{fmt}' (choose from png, jpeg, webp)")
+    buf = io.BytesIO()
+    if pil_format == "PNG":
+        img.save(buf, format="PNG", compress_level=1)
+    else:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(buf, format=pil_format, quality=int(quality))
+    return buf.getvalue()
+
+
+def changed_bbox(before, after):
+    """Bounding box ``(x1, y1, x2, y2)`` of pixels that differ, or None."""
+    from PIL import ImageChops
+    if before.size != after.size or before.mode != after.mode:
+        return (0, 0, after.width, after.height)
+    return ImageChops.difference(before, after).getbbox()
+
+
+class CaptureSession:
+    """Remembers the last frame per (backend, region, scale) for delta captures."""
+
+    def __init__(self, max_frames: int = 8):
+        self.max_frames = max_frames
+        self._lock = threading.Lock()
+        self._frames = {}  # key -> scaled PIL image, insertion ordered
+        self._versions = {}  # key -> canvas version of the last tiled capture, insertion ordered
+        self.captures = 0
+        self.unchanged = 0
+
+    def capture(self, img, key, scale: float = 1.0, fmt: str = "png", quality: int = 80,
+                delta: bool = False) -> dict:
+        """Scale/encode ``img``. Returns a dict with ``data`` (bytes or None when
+        a delta capture found no change), ``box`` (the sent box in scaled frame
+        coordinates), ``size``, ``delta``, ``bytes``, ``encode_ms``."""
+        if fmt.lower() not in FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}' (choose from png, jpeg, webp)")
+        t0 = time.perf_counter()
+        frame = scale_image(img, scale)
+        with self._lock:
+            prev = self._frames.pop(key, None)
+            self._frames[key] = frame
+            while len(self._frames) > self.max_frames:
+                self._frames.pop(next(iter(self._frames)))
+            self.captures += 1
+        box = (0, 0, frame.width, frame.height)
+        is_delta = False
+        if delta and prev is not None:
+            box = changed_bbox(prev, frame)
+            is_delta = True
+            if box is None:
+                with self._lock:
+                    self.unchanged += 1
+                return {"data": None, "box": None, "size": frame.size, "delta": True, "bytes": 0,
+                        "encode_ms": round((time.perf_counter() - t0) * 1000.0, 2)}
+        out = frame if box == (0, 0, frame.width, frame.height) else frame.crop(box)
+        data = encode(out, fmt, quality)
+        return {"data": data, "box": box, "size": frame.size, "delta": is_delta, "bytes": len(data),
+                "encode_ms": round((time.perf_counter() - t0) * 1000.0, 2)}
+
+    def version(self, key):
+        """Canvas version of the last tiled capture of ``key`` (None if none)."""
+        with self._lock:
+            return self._versions.get(key)
+
+    def encode_frame(self, frame: dict, key, fmt: str = "png", quality: int = 80) -> dict:
+        """Encode a frame rendered from a tiled canvas (see
+        ``RasterBackend.render_region``) and remember its version for the next
+        delta of ``key``. Returns the same dict as ``capture``."""
+        if fmt.lower() not in FORMATS:
+            raise ValueError(f"Unsupported format '{fmt}' (choose from png, jpeg, webp)")
+        t0 = time.perf_counter()
+        with self._lock:
+            self._versions.pop(key, None)
+            self._versions[key] = frame["version"]
+            while len(self._versions) > self.max_frames:
+                self._versions.pop(next(iter(self._versions)))
+            self.captures += 1
+            if frame["image"] is None:
+                self.unchanged += 1
+        if frame["image"] is None:
+            return {"data": None, "box": None, "size": frame["size"], "delta": True, "bytes": 0,
+                    "encode_ms": round((time.perf_counter() - t0) * 1000.0, 2)}
+        data = encode(frame["image"], fmt, quality)
+        return {"data": data, "box": frame["frame_box"], "size": frame["size"], "delta": frame["delta"],
+                "bytes": len(data), "encode_ms": round((time.perf_counter() - t0) * 1000.0, 2)}
+
+    def forget(self):
+        with self._lock:
+            self._frames.clear()
+            self._versions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"captures": self.captures, "unchanged": self.unchanged, "frames": len(self._frames),
+                    "tiled_keys": len(self._versions)}
+
+
+def pixel_diff(before, after, tolerance: int = 0) -> dict:
+    """NumPy-vectorized comparison of two same-sized images.
+
+    A pixel counts as changed when any channel differs by more than
+    ``tolerance``. Returns ``changed_pixels``, ``changed_ratio`` and the
+    ``bbox`` (x1, y1, x2, y2, exclusive) of the change, or None if unchanged.
+    """
+    import numpy as np
+    if before.size != after.size:
+        raise ValueError(f"Image sizes differ: {before.size} vs {after.size}")
+    a = np.asarray(before.convert("RGB"), dtype=np.int16)
+    b = np.asarray(after.convert("RGB"), dtype=np.int16)
+    mask = (np.abs(a - b) > tolerance).any(axis=2)
+    changed = int(np.count_nonzero(mask))
+    bbox = None
+    if changed:
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        bbox = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    return {"changed_pixels": changed, "changed_ratio": changed / float(mask.size or 1), "bbox": bbox}
@@ -0,0 +1,256 @@
+"""Append-only binary journal of drawing operations.
+
+Every successful drawing call is appended as one small ``struct``-packed
+record (op code, payload length, CRC32, payload) so a session can be rebuilt
+after the server or Paint dies. Records are written with a single ``write``
+plus ``flush`` (``fsync`` optional), which keeps the cost of journaling well
+under a millisecond per operation. A torn or corrupt tail left by a crash is
+detected by its CRC and dropped on the next open.
+
+Replay starts after the last ``CLEAR``, which only an explicit "clear" (a
+new document) writes; a restarted server resumes the session it left, and
+starting over with a fresh file ``rotate``s the old one aside. Compaction
+rewrites the file without superseded records: everything before the last
+``CLEAR`` and operations withdrawn by ``UNDO`` for good (still redoable ones
+are kept, followed by their ``UNDO``). Repeated identical shapes are kept
+everywhere, so every ``UNDO`` withdraws the same record it did live.
+"""
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+from contextlib import contextmanager
+
+MAGIC = b"MSPJ\x01"
+RECT, TEXT, STROKE, CLEAR, UNDO, REDO = 1, 2, 3, 4, 5, 6
+OP_NAMES = {RECT: "rect", TEXT: "text", STROKE: "stroke", CLEAR: "clear", UNDO: "undo", REDO: "redo"}
+_KIND_OPS = {name: op for op, name in OP_NAMES.items()}
+
+_HEADER = struct.Struct("<BII")  # op, payload length, crc32(payload)
+_BOX = struct.Struct("<iiii")
+_COUNT = struct.Struct("<I")  # stroke point count
+
+Record = namedtuple("Record", "op box text points")
+
+
+def _encode(op: int, box=None, text=None, points=None) -> bytes:
+    if op == RECT:
+        payload = _BOX.pack(*box)
+    elif op == TEXT:
+        payload = _BOX.pack(*box) + text.encode("utf-8")
+    elif op == STROKE:
+        flat = [int(v) for p in points for v in p[:2]]
+        payload = struct.pack(f"<I{len(flat)}i", len(points), *flat)
+    elif op in (CLEAR, UNDO, REDO):
+        payload = b""
+    else:
+        raise ValueError(f"Unknown journal op {op}")
+    return _HEADER.pack(op, len(payload), zlib.crc32(payload)) + payload
+
+
+def _decode(op: int, payload: bytes) -> Record:
+    if op == RECT:
+        return Record(op, _BOX.unpack_from(payload), None, None)
+    if op == TEXT:
+        return Record(op, _BOX.unpack_from(payload), payload[_BOX.size:].decode("utf-8"), None)
+    if op == STROKE:
+        (n,) = _COUNT.unpack_from(payload)
+        flat = struct.unpack_from(f"<{2 * n}i", payload, _COUNT.size)
+        return Record(op, None, None, [(flat[i], flat[i + 1]) for i in range(0, len(flat), 2)])
+    if op in (CLEAR, UNDO, REDO):
+        return Record(op, None, None, None)
+    raise ValueError(f"Unknown journal op {op}")
+
+
+def read_records(path: str):
+    """Return ``(records, valid_bytes)``; reading stops at a torn/corrupt tail."""
+    records = []
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return records, 0
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a drawing journal")
+    pos = len(MAGIC)
+    while pos + _HEADER.size <= len(data):
+        op, length, crc = _HEADER.unpack_from(data, pos)
+        start = pos + _HEADER.size
+        payload = data[start:start + length]
+        if len(payload) != length or zlib.crc32(payload) != crc or op not in OP_NAMES:
+            break
+        records.append(_decode(op, payload))
+        pos = start + length
+    return records, pos
+
+
+def _undo_stacks(records) -> tuple:
+    """``(drawn, undone)`` after the last CLEAR with UNDO/REDO applied;
+    ``undone`` is the redo stack (next to redo last)."""
+    last_clear = max((i for i, r in enumerate(records) if r.op == CLEAR), default=-1)
+    drawn, undone = [], []
+    for rec in records[last_clear + 1:]:
+        if rec.op == UNDO:
+            if drawn:
+                undone.append(drawn.pop())
+        elif rec.op == REDO:
+            if undone:
+                drawn.append(undone.pop())
+        else:
+            drawn.append(rec)
+            undone = []  # a new operation drops the redo branch
+    return drawn, undone
+
+
+def live_records(records) -> list:
+    """Drop superseded records: everything up to the last CLEAR and undone
+    operations."""
+    return _undo_stacks(records)[0]
+
+
+def to_batch_ops(records) -> list:
+    """Translate live records into ``draw_batch`` operations for replay."""
+    ops = []
+    for rec in live_records(records):
+        if rec.op == RECT:
+            x1, y1, x2, y2 = rec.box
+            ops.append({"op": "rectangle", "x1": x1, "y1": y1, "x2": x2, "y2": y2})
+        elif rec.op == TEXT:
+            x1, y1, x2, y2 = rec.box
+            ops.append({"op": "text", "text": rec.text, "x1": x1, "y1": y1, "x2": x2, "y2": y2})
+        elif rec.op == STROKE:
+            ops.append({"op": "stroke", "points": [list(p) for p in rec.points]})
+    return ops
+
+
+class Journal:
+    """Thread-safe appender with periodic compaction and write-cost accounting."""
+
+    def __init__(self, path: str, fsync: bool = False, compact_every: int = 1000,
+                 compact_ratio: float = 0.25):
+        self.path = path
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self.compact_ratio = compact_ratio
+        self._lock = threading.Lock()
+        self._file = None
+        self._since_compact = 0
+        self._suspended = 0
+        self.appended = 0
+        self.append_seconds = 0.0
+        self.compactions = 0
+
+    def _open(self):
+        if self._file is not None:
+            return self._file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        _, valid = read_records(self.path)
+        if valid:
+            # Cut off a torn tail so new records follow the last good one
+            with open(self.path, "r+b") as f:
+                f.truncate(valid)
+        self._file = open(self.path, "ab")
+        if not valid:
+            self._file.write(MAGIC)
+            self._file.flush()
+        return self._file
+
+    def append(self, kind: str, box=None, text=None, points=None):
+        """Append one operation (``kind`` rect/text/stroke/clear)."""
+        if self._suspended:
+            return
+        data = _encode(_KIND_OPS[kind], box, text, points)
+        with self._lock:
+            t0 = time.perf_counter()
+            f = self._open()
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+            self.append_seconds += time.perf_counter() - t0
+            self.appended += 1
+            self._since_compact += 1
+            due = self._since_compact >= self.compact_every
+        if due:
+            self.maybe_compact()
+
+    @contextmanager
+    def suspended(self):
+        """Skip journaling inside the block (used while replaying the journal)."""
+        with self._lock:
+            self._suspended += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._suspended -= 1
+
+    def records(self) -> list:
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            return read_records(self.path)[0]
+
+    def maybe_compact(self) -> bool:
+        """Compact when at least ``compact_ratio`` of the records are superseded."""
+        records = self.records()
+        self._since_compact = 0
+        if records and (len(records) - len(_undo_stacks(records)[0])) / len(records) >= self.compact_ratio:
+            self.compact()
+            return True
+        return False
+
+    def compact(self) -> tuple:
+        """Rewrite the journal with live records only; returns (before, after)."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            records = read_records(self.path)[0]
+            drawn, undone = _undo_stacks(records)
+            # keep undone operations redoable: rewrite them followed by their UNDOs
+            kept = drawn + list(reversed(undone)) + [Record(UNDO, None, None, None)] * len(undone)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".journal", dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC)
+                for rec in kept:
+                    f.write(_encode(rec.op, rec.box, rec.text, rec.points))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            self.compactions += 1
+            self._since_compact = 0
+            return len(records), len(kept)
+
+    def rotate(self) -> str:
+        """Move the journal aside to ``<name>.prev<ext>`` (replacing an older
+        one) so appends start a fresh file; returns the new path of the old one."""
+        root, ext = os.path.splitext(self.path)
+        prev = f"{root}.prev{ext}"
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if os.path.exists(self.path):
+                os.replace(self.path, prev)
+            self._since_compact = 0
+        return prev
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            avg_us = self.append_seconds / self.appended * 1e6 if self.appended else 0.0
+            return {"path": self.path, "bytes": size, "appended": self.appended,
+                    "append_avg_us": round(avg_us, 1), "compactions": self.compactions}
@@ -0,0 +1,124 @@
+"""Load test for the Paint MCP server over its HTTP transports.
+
+Runs ``--clients`` simulated MCP clients against one server, each sending
+``--requests`` drawing calls back to back (optionally with think time), and
+reports throughput plus p50/p95/p99/max latency overall and per client,
+along with how many calls were turned away by admission control ("Busy").
+With ``--spawn`` a headless raster server is started on ``--port`` first,
+so the test runs anywhere:
+
+    python loadtest.py --spawn --clients 16 --requests 50
+    python loadtest.py --url http://127.0.0.1:8000/mcp --clients 4 --tool add_text_in_paint
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _percentile(samples, q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _tool_call(tool: str, client: int, i: int, rng: random.Random):
+    x, y = rng.randrange(0, 800), rng.randrange(0, 600)
+    if tool == "draw_rectangle":
+        return {"x1": x, "y1": y, "x2": x + 40, "y2": y + 30}
+    if tool == "add_text_in_paint":
+        return {"text": f"client {client} call {i}"}
+    if tool == "draw_stroke":
+        return {"points": [[x + k * 5, y + (k % 3) * 4] for k in range(20)]}
+    raise ValueError(f"Unsupported tool '{tool}'")
+
+
+async def _client(url: str, client: int, args, results: list):
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+    rng = random.Random(client)
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as session:
+            await session.initialize()
+            for i in range(args.requests):
+                t0 = time.perf_counter()
+                res = await session.call_tool(args.tool, _tool_call(args.tool, client, i, rng))
+                ms = (time.perf_counter() - t0) * 1000.0
+                text = res.content[0].text if res.content else ""
+                results.append((client, ms, text.startswith("Busy"), res.isError or text.startswith("Error")))
+                if args.think_ms:
+                    await asyncio.sleep(rng.uniform(0, 2 * args.think_ms) / 1000.0)
+
+
+async def run(url: str, args) -> int:
+    results = []
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_client(url, c, args, results) for c in range(args.clients)))
+    elapsed = time.perf_counter() - t0
+
+    served = [ms for _, ms, busy, err in results if not busy and not err]
+    busy = sum(1 for r in results if r[2])
+    errors = sum(1 for r in results if r[3])
+    print(f"clients={args.clients} calls={len(results)} served={len(served)} busy={busy} errors={errors} "
+          f"elapsed_s={elapsed:.2f} throughput_per_s={len(served) / elapsed:.1f}")
+    print(f"latency_ms p50={_percentile(served, 0.50):.1f} p95={_percentile(served, 0.95):.1f} "
+          f"p99={_percentile(served, 0.99):.1f} max={max(served, default=0.0):.1f}")
+    per_client = [statistics.median([ms for c, ms, b, e in results if c == client and not b and not e] or [0.0])
+                  for client in range(args.clients)]
+    # fairness: with a fair scheduler every client sees about the same median
+    print(f"per_client_p50_ms min={min(per_client):.1f} max={max(per_client):.1f} "
+          f"spread={max(per_client) - min(per_client):.1f}")
+    return 0 if not errors else 1
+
+
+def _wait_for_port(host: str, port: int, timeout: float):
+    import socket
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"server did not listen on {host}:{port} within {timeout:.0f}s")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="streamable-http endpoint (default http://127.0.0.1:PORT/mcp)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--spawn", action="store_true", help="start a raster server on --port for the run")
+    parser.add_argument("--workers", type=int, default=0, help="--workers for the spawned server")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=25, help="calls per client")
+    parser.add_argument("--tool", default="draw_rectangle",
+                        choices=["draw_rectangle", "add_text_in_paint", "draw_stroke"])
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a client's calls")
+    args = parser.parse_args(argv)
+    url = args.url or f"http://127.0.0.1:{args.port}/mcp"
+
+    server = None
+    if args.spawn:
+        env = dict(os.environ, MSPAINT_JOURNAL=os.environ.get("MSPAINT_JOURNAL", "off"))
+        server = subprocess.Popen([sys.executable, os.path.join(HERE, "app.py"), "--backend", "raster",
+                                   "--transport", "streamable-http", "--port", str(args.port),
+                                   "--workers", str(args.workers)],
+                                  cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _wait_for_port("127.0.0.1", args.port, 30.0)
+    try:
+        return asyncio.run(run(url, args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(10)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""Cache of LLM-generated action plans for ``ai_client``.
+
+Plans are keyed on the normalized command text, the prompt version and the
+model name, so a prompt or model change never serves stale plans. Lookups hit
+an in-memory LRU first, then a JSON file on disk that survives restarts.
+Entries expire after ``ttl`` seconds, and the disk store is trimmed to
+``max_entries`` / ``max_bytes`` by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+_SPACES = re.compile(r"\s+")
+# Literal text the plan will type: quoted spans, and whatever follows a text
+# verb up to the next comma or semicolon
+_LITERAL = re.compile(r"(?P<q>\"[^\"]*\"|'[^']*')"
+                      r"|\b(?:write|type|text|label|caption|saying)\b\s*:?\s+(?P<t>[^\",;]+)", re.IGNORECASE)
+
+
+def normalize_command(command: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation, except
+    inside literal text, so "write Hello" and "write HELLO" stay distinct."""
+    command = command.strip()
+    out = []
+    pos = 0
+    for m in _LITERAL.finditer(command):
+        group = "q" if m.group("q") is not None else "t"
+        start, end = m.span(group)
+        out.append(_SPACES.sub(" ", command[pos:start].lower()))
+        out.append(command[start:end])
+        pos = end
+    out.append(_SPACES.sub(" ", command[pos:].lower()).rstrip(".!?;, "))
+    return "".join(out)
+
+
+def plan_key(command: str, prompt_version: str, model_name: str) -> str:
+    raw = "\0".join((prompt_version, model_name, normalize_command(command)))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class PlanCache:
+    """Two-level (memory LRU + JSON file) plan cache with hit/miss counters."""
+
+    def __init__(self, path=None, memory_entries: int = 256, max_entries: int = 2000,
+                 max_bytes: int = 2_000_000, ttl: float = 7 * 24 * 3600.0, clock=time.time):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> entry, least recently used first
+        self._disk = None  # key -> entry, loaded lazily
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    # -- persistence ------------------------------------------------------
+    def _load_disk(self) -> dict:
+        if self._disk is None:
+            self._disk = {}
+            if self.path:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if isinstance(data, dict):
+                        self._disk = data
+                except (OSError, ValueError):
+                    pass
+        return self._disk
+
+    def _save_disk(self):
+        if not self.path:
+            return
+        entries = sorted(self._disk.items(), key=lambda kv: kv[1]["used"], reverse=True)
+        entries = entries[:self.max_entries]
+        payload = json.dumps(dict(entries), separators=(",", ":"))
+        while len(payload) > self.max_bytes and entries:
+            # drop the least recently used quarter until the file fits
+            entries = entries[:len(entries) * 3 // 4]
+            payload = json.dumps(dict(entries), separators=(",", ":"))
+        self._disk = dict(entries)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".plan_cache", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    # -- lookups ----------------------------------------------------------
+    def _fresh(self, entry, now) -> bool:
+        return now - entry["created"] <= self.ttl
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """Cached actions for ``key`` or None."""
+        now = self._clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and self._fresh(entry, now):
+                self._memory.move_to_end(key)
+                entry["used"] = now
+                self.hits += 1
+                return entry["actions"]
+            disk = self._load_disk()
+            entry = disk.get(key)
+            if entry is not None:
+                if self._fresh(entry, now):
+                    entry["used"] = now
+                    self._remember(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return entry["actions"]
+                self.expired += 1
+                disk.pop(key, None)
+                self._memory.pop(key, None)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, actions: list, command: str = ""):
+        now = self._clock()
+        entry = {"actions": actions, "created": now, "used": now, "command": normalize_command(command)}
+        with self._lock:
+            self._remember(key, entry)
+            self._load_disk()[key] = entry
+            self._save_disk()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses,
+                    "expired": self.expired, "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                    "memory_entries": len(self._memory), "disk_entries": len(self._disk or {})}
@@ -0,0 +1,197 @@
+"""Retained model of what has been drawn on the canvas.
+
+Every rectangle, text box and stroke the server draws is kept as a compact
+``Shape`` record (``__slots__``, canvas-relative bounding box) in a ``Scene``.
+A uniform grid index maps cells to shape ids, so hit tests, overlap queries
+and free-space search only look at shapes near the query box instead of the
+whole scene, which keeps them fast with tens of thousands of shapes.
+"""
+import threading
+
+
+class Shape:
+    """One drawn element. ``box`` is (x1, y1, x2, y2), canvas-relative, inclusive."""
+    __slots__ = ("id", "kind", "x1", "y1", "x2", "y2", "text")
+
+    def __init__(self, id: int, kind: str, x1: int, y1: int, x2: int, y2: int, text=None):
+        self.id = id
+        self.kind = kind
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+        self.text = text
+
+    @property
+    def box(self):
+        return (self.x1, self.y1, self.x2, self.y2)
+
+    def contains(self, x: int, y: int) -> bool:
+        return self.x1 <= x <= self.x2 and self.y1 <= y <= self.y2
+
+    def intersects(self, x1: int, y1: int, x2: int, y2: int) -> bool:
+        return self.x1 <= x2 and x1 <= self.x2 and self.y1 <= y2 and y1 <= self.y2
+
+    def as_dict(self) -> dict:
+        d = {"id": self.id, "kind": self.kind, "box": self.box}
+        if self.text is not None:
+            d["text"] = self.text
+        return d
+
+    def __repr__(self):
+        return f"Shape(id={self.id}, kind={self.kind}, box={self.box})"
+
+
+def normalize_box(box):
+    """Accept (x1, y1, x2, y2) or ((x1, y1), (x2, y2)); return ordered ints."""
+    if len(box) == 2:
+        (x1, y1), (x2, y2) = box
+    else:
+        x1, y1, x2, y2 = box
+    x1, x2 = sorted((int(x1), int(x2)))
+    y1, y2 = sorted((int(y1), int(y2)))
+    return x1, y1, x2, y2
+
+
+class GridIndex:
+    """Uniform grid: cell (cx, cy) -> set of shape ids whose box touches it."""
+
+    def __init__(self, cell: int = 64):
+        self.cell = cell
+        self._cells = {}
+
+    def _span(self, x1, y1, x2, y2):
+        c = self.cell
+        for cx in range(x1 // c, x2 // c + 1):
+            for cy in range(y1 // c, y2 // c + 1):
+                yield cx, cy
+
+    def insert(self, shape: Shape):
+        for key in self._span(shape.x1, shape.y1, shape.x2, shape.y2):
+            self._cells.setdefault(key, set()).add(shape.id)
+
+    def remove(self, shape: Shape):
+        for key in self._span(shape.x1, shape.y1, shape.x2, shape.y2):
+            ids = self._cells.get(key)
+            if ids is not None:
+                ids.discard(shape.id)
+                if not ids:
+                    del self._cells[key]
+
+    def candidates(self, x1, y1, x2, y2) -> set:
+        found = set()
+        for key in self._span(x1, y1, x2, y2):
+            ids = self._cells.get(key)
+            if ids:
+                found |= ids
+        return found
+
+    def clear(self):
+        self._cells = {}
+
+    def __len__(self):
+        return len(self._cells)
+
+
+class Scene:
+    """Thread-safe store of drawn shapes with spatial queries."""
+
+    def __init__(self, cell: int = 64):
+        self._lock = threading.RLock()
+        self._shapes = {}  # id -> Shape, in drawing order
+        self._index = GridIndex(cell)
+        self._next_id = 1
+        self._last_box_id = None  # last rect/text shape, reused as the default text box
+
+    def add(self, kind: str, box, text=None) -> Shape:
+        x1, y1, x2, y2 = normalize_box(box)
+        with self._lock:
+            shape = Shape(self._next_id, kind, x1, y1, x2, y2, text)
+            self._next_id += 1
+            self._shapes[shape.id] = shape
+            self._index.insert(shape)
+            if kind in ("rect", "text"):
+                self._last_box_id = shape.id
+            return shape
+
+    def restore(self, shape: Shape):
+        """Put back a removed shape under its original id (redo)."""
+        with self._lock:
+            self._shapes[shape.id] = shape
+            self._index.insert(shape)
+            if shape.kind in ("rect", "text"):
+                self._last_box_id = shape.id
+
+    def remove(self, shape_id: int) -> bool:
+        with self._lock:
+            shape = self._shapes.pop(shape_id, None)
+            if shape is None:
+                return False
+            self._index.remove(shape)
+            if self._last_box_id == shape_id:
+                self._last_box_id = next((s.id for s in reversed(self._shapes.values())
+                                          if s.kind in ("rect", "text")), None)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._shapes = {}
+            self._index.clear()
+            self._last_box_id = None
+
+    def get(self, shape_id: int):
+        with self._lock:
+            return self._shapes.get(shape_id)
+
+    def last_box(self):
+        """((x1, y1), (x2, y2)) of the most recent rectangle or text box, or None."""
+        with self._lock:
+            shape = self._shapes.get(self._last_box_id)
+            return None if shape is None else ((shape.x1, shape.y1), (shape.x2, shape.y2))
+
+    def shapes(self, kind=None) -> list:
+        with self._lock:
+            return [s for s in self._shapes.values() if kind is None or s.kind == kind]
+
+    def hit_test(self, x: int, y: int) -> list:
+        """Shapes containing (x, y), topmost (most recently drawn) first."""
+        with self._lock:
+            ids = self._index.candidates(x, y, x, y)
+            hits = [self._shapes[i] for i in ids if self._shapes[i].contains(x, y)]
+        return sorted(hits, key=lambda s: s.id, reverse=True)
+
+    def overlapping(self, box, exclude=None) -> list:
+        """Shapes whose box intersects ``box``, in drawing order."""
+        x1, y1, x2, y2 = normalize_box(box)
+        with self._lock:
+            ids = self._index.candidates(x1, y1, x2, y2)
+            found = [self._shapes[i] for i in ids
+                     if i != exclude and self._shapes[i].intersects(x1, y1, x2, y2)]
+        return sorted(found, key=lambda s: s.id)
+
+    def find_free(self, width: int, height: int, bounds, margin: int = 4, step=None):
+        """First (x1, y1, x2, y2) of the given size inside ``bounds`` (x1, y1, x2, y2)
+        that keeps ``margin`` pixels clear of every shape, scanning row-major.
+        Candidates that collide jump past the blocking shape. Returns None if full."""
+        bx1, by1, bx2, by2 = normalize_box(bounds)
+        step = step or max(1, self._index.cell // 4)
+        with self._lock:
+            y = by1
+            while y + height <= by2:
+                x = bx1
+                next_y = None
+                while x + width <= bx2:
+                    box = (x - margin, y - margin, x + width + margin, y + height + margin)
+                    ids = self._index.candidates(*box)
+                    blockers = [self._shapes[i] for i in ids if self._shapes[i].intersects(*box)]
+                    if not blockers:
+                        return (x, y, x + width, y + height)
+                    x = max(x + step, max(s.x2 for s in blockers) + margin + 1)
+                    lowest = min(s.y2 for s in blockers) + margin + 1
+                    next_y = lowest if next_y is None else min(next_y, lowest)
+                y = max(y + step, next_y) if next_y is not None else y + step
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            kinds = {}
+            for s in self._shapes.values():
+                kinds[s.kind] = kinds.get(s.kind, 0) + 1
+            return {"shapes": len(self._shapes), "grid_cells": len(self._index), "kinds": kinds}
@@ -0,0 +1,98 @@
+"""Success/latency bookkeeping for interchangeable fallback strategies.
+
+``StrategyRanker`` records, per environment key (backend, Paint build, DPI),
+how often each strategy of a fallback chain succeeds and how long it takes,
+and orders the chain so the strategy with the lowest expected time to a
+success is tried first. A small exploration rate keeps promoting other
+strategies now and then so the ranking follows environment changes. Stats
+are persisted as JSON so the ranking survives restarts.
+"""
+import json
+import os
+import random
+import tempfile
+import threading
+
+
+class StrategyRanker:
+    """Order strategies by expected cost ``latency / P(success)``.
+
+    Success probability uses a Laplace prior ((successes + 1) / (attempts + 2))
+    and latency an EWMA seeded with ``prior_latency``, so unseen strategies
+    tie and keep their default order until data arrives.
+    """
+
+    def __init__(self, path=None, explore: float = 0.05, alpha: float = 0.3,
+                 prior_latency: float = 0.5, rng=None):
+        self.path = path
+        self.explore = explore
+        self.alpha = alpha
+        self.prior_latency = prior_latency
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+        self._stats = {}  # env key -> {strategy -> {"attempts", "successes", "latency"}}
+        self.explorations = 0
+        if path:
+            self.load()
+
+    # -- persistence ------------------------------------------------------
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._stats = data
+        except (OSError, ValueError):
+            self._stats = {}
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            payload = json.dumps(self._stats, indent=1, sort_keys=True)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".strategy_stats", dir=directory)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    # -- ranking ----------------------------------------------------------
+    def _entry(self, env: str, name: str) -> dict:
+        return self._stats.setdefault(env, {}).setdefault(
+            name, {"attempts": 0, "successes": 0, "latency": None})
+
+    def expected_cost(self, env: str, name: str) -> float:
+        st = self._stats.get(env, {}).get(name)
+        if not st:
+            return self.prior_latency / 0.5
+        p = (st["successes"] + 1.0) / (st["attempts"] + 2.0)
+        latency = st["latency"] if st["latency"] is not None else self.prior_latency
+        return latency / p
+
+    def order(self, env: str, strategies, explore: bool = True) -> list:
+        """Return ``strategies`` sorted by expected cost (stable for ties), with
+        occasional exploration that moves one other strategy to the front."""
+        with self._lock:
+            ranked = sorted(strategies, key=lambda name: self.expected_cost(env, name))
+            if explore and len(ranked) > 1 and self._rng.random() < self.explore:
+                pick = ranked.pop(self._rng.randrange(1, len(ranked)))
+                ranked.insert(0, pick)
+                self.explorations += 1
+        return ranked
+
+    def record(self, env: str, name: str, success: bool, seconds: float):
+        with self._lock:
+            st = self._entry(env, name)
+            st["attempts"] += 1
+            if success:
+                st["successes"] += 1
+            prev = st["latency"]
+            st["latency"] = seconds if prev is None else (1 - self.alpha) * prev + self.alpha * seconds
+
+    def snapshot(self, env: str) -> dict:
+        with self._lock:
+            return {name: dict(st) for name, st in self._stats.get(env, {}).items()}
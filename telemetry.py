@@ -0,0 +1,154 @@
+"""In-memory latency histograms for the Paint MCP server.
+
+Every named stage of a tool (connect, tool selection, find_canvas, drag,
+overlay polling, each add_text fallback ``mode`` ...) is timed into a
+``Histogram`` held by the process-wide ``REGISTRY``. Histograms keep
+Prometheus-style cumulative buckets for export plus a bounded reservoir of
+recent samples for p50/p95/p99.
+"""
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the cumulative buckets; +Inf is implicit.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Latency distribution of one (stage, labels) series."""
+    __slots__ = ("buckets", "bucket_counts", "count", "errors", "total", "max", "_recent")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, reservoir: int = 2048):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=reservoir)
+
+    def observe(self, seconds: float, error: bool = False):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self._recent.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """Nearest-rank percentile (0..100) over the recent-sample reservoir."""
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        idx = min(len(ordered) - 1, max(0, math.ceil(q / 100.0 * len(ordered)) - 1))
+        return ordered[idx]
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": round(self.percentile(50) * 1000.0, 2),
+            "p95_ms": round(self.percentile(95) * 1000.0, 2),
+            "p99_ms": round(self.percentile(99) * 1000.0, 2),
+            "max_ms": round(self.max * 1000.0, 2),
+            "avg_ms": round(self.total / self.count * 1000.0, 2) if self.count else 0.0,
+        }
+
+
+class Span:
+    """Handle yielded by ``Registry.stage``; set ``error`` (or ``labels``) before exit."""
+    __slots__ = ("error", "labels")
+
+    def __init__(self, labels: dict):
+        self.error = False
+        self.labels = labels
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """Thread-safe collection of histograms keyed by stage name and labels."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}  # (stage, ((label, value), ...)) -> Histogram
+
+    def observe(self, stage: str, seconds: float, error: bool = False, **labels):
+        key = (stage, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            hist = self._series.get(key)
+            if hist is None:
+                hist = self._series[key] = Histogram(self.buckets)
+            hist.observe(seconds, error)
+
+    @contextmanager
+    def stage(self, name: str, **labels):
+        """Time the enclosed block as stage ``name``. Exceptions count as errors
+        and propagate; callers can also flag a soft failure via ``span.error``."""
+        span = Span(labels)
+        t0 = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t0, span.error, **span.labels)
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+    def summary(self, prefix: str = "") -> list:
+        """One ``stage{labels} count=.. errors=.. p50_ms=..`` line per series."""
+        lines = []
+        for (stage, labels), hist in self._items():
+            if prefix and not stage.startswith(prefix):
+                continue
+            label_txt = "{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""
+            lines.append(f"{stage}{label_txt} " + " ".join(f"{k}={v}" for k, v in hist.snapshot().items()))
+        return lines
+
+    def prometheus(self, namespace: str = "mspaint") -> str:
+        """Render all series in the Prometheus text exposition format."""
+        metric = f"{namespace}_stage_seconds"
+        errors = f"{namespace}_stage_errors_total"
+        out = [
+            f"# HELP {metric} Latency of named server stages.",
+            f"# TYPE {metric} histogram",
+        ]
+        err_lines = [
+            f"# HELP {errors} Failed executions of named server stages.",
+            f"# TYPE {errors} counter",
+        ]
+        for (stage, labels), hist in self._items():
+            base = [("stage", stage)] + list(labels)
+            lbl = ",".join(f'{k}="{_escape(v)}"' for k, v in base)
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.bucket_counts):
+                cumulative += n
+                out.append(f'{metric}_bucket{{{lbl},le="{bound:g}"}} {cumulative}')
+            out.append(f'{metric}_bucket{{{lbl},le="+Inf"}} {hist.count}')
+            out.append(f"{metric}_sum{{{lbl}}} {hist.total:.6f}")
+            out.append(f"{metric}_count{{{lbl}}} {hist.count}")
+            err_lines.append(f"{errors}{{{lbl}}} {hist.errors}")
+        return "\n".join(out + err_lines) + "\n"
+
+
+REGISTRY = Registry()
+stage = REGISTRY.stage
+observe = REGISTRY.observe
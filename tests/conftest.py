@@ -0,0 +1,17 @@
+import pytest
+
+
+@pytest.fixture
+def raster(monkeypatch, tmp_path):
+    """The app on a headless 320x240 raster canvas with a journal in
+    ``tmp_path`` and an empty scene and undo history."""
+    import app
+    monkeypatch.setenv("MSPAINT_JOURNAL", str(tmp_path / "journal.bin"))
+    monkeypatch.setattr(app, "_journal", None)
+    monkeypatch.setattr(app, "_history", app.UndoHistory())
+    app._scene.clear()
+    backend = app.set_backend("raster", width=320, height=240)
+    yield backend
+    if app._journal is not None:
+        app._journal.close()
+    app._scene.clear()
@@ -0,0 +1,89 @@
+import asyncio
+import json
+
+import pytest
+
+import ai_client
+from ai_client import ActionStreamParser, parse_plan, stream_actions
+from plan_cache import PlanCache
+
+PLAN = {"actions": [
+    {"tool_name": "open_paint", "args": {}},
+    {"tool_name": "add_text_in_paint", "args": {"text": "braces {} [and] \"quotes\" \\ too"}},
+    {"tool_name": "draw_rectangle", "args": {"x1": 1, "y1": 2, "x2": 3, "y2": 4}},
+]}
+OUTPUT = "```json\n" + json.dumps(PLAN, indent=2) + "\n```"
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """Streams ``output`` in ``size``-character chunks, like generate_content(stream=True)."""
+
+    def __init__(self, output=OUTPUT, size=7):
+        self.output = output
+        self.size = size
+        self.calls = 0
+
+    def generate_content(self, prompt, stream=False):
+        assert stream
+        self.calls += 1
+        return [_Chunk(self.output[i:i + self.size]) for i in range(0, len(self.output), self.size)]
+
+
+@pytest.mark.parametrize("size", [1, 5, 64, len(OUTPUT)])
+def test_parser_yields_each_action_once_complete(size):
+    parser = ActionStreamParser()
+    got = []
+    for i in range(0, len(OUTPUT), size):
+        got += parser.feed(OUTPUT[i:i + size])
+    assert got == PLAN["actions"]
+    assert parser.done
+
+
+def test_parser_emits_actions_before_the_plan_ends():
+    parser = ActionStreamParser()
+    cut = OUTPUT.index('"add_text_in_paint"')
+    assert parser.feed(OUTPUT[:cut]) == [PLAN["actions"][0]]
+    assert not parser.done
+
+
+def test_parse_plan_strips_the_fence():
+    assert parse_plan(OUTPUT) == PLAN["actions"]
+    with pytest.raises(ValueError):
+        parse_plan('{"actions": {}}')
+
+
+def _collect(model, command, cache):
+    async def run():
+        info = {}
+        actions = [a async for a in stream_actions(model, command, cache, model_name="stub", info=info)]
+        return actions, info["source"]
+    return asyncio.run(run())
+
+
+def test_llm_plan_is_streamed_then_served_from_cache(capsys):
+    model, cache = StubModel(), PlanCache()
+    assert _collect(model, "paint a tiny house", cache) == (PLAN["actions"], "llm")
+    assert _collect(model, "Paint a tiny house.", cache) == (PLAN["actions"], "cache")
+    assert model.calls == 1
+
+
+def test_local_commands_skip_the_model():
+    model = StubModel()
+    actions, source = _collect(model, "Open Paint and Write Hello", PlanCache())
+    assert source == "local"
+    assert actions == [{"tool_name": "open_paint", "args": {}},
+                       {"tool_name": "add_text_in_paint", "args": {"text": "Hello"}}]
+    assert model.calls == 0
+
+
+def test_invalid_output_is_not_cached(capsys):
+    model, cache = StubModel(output="not json"), PlanCache()
+    with pytest.raises(json.JSONDecodeError):
+        _collect(model, "paint a tiny house", cache)
+    assert cache.stats()["memory_entries"] == 0
+    assert ai_client.LOCAL_STATS["fallback"] >= 1
@@ -0,0 +1,49 @@
+from app import AdaptiveWaiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def _waiter(clock):
+    return AdaptiveWaiter(clock=clock, sleep=clock.sleep)
+
+
+def test_returns_the_condition_result_once_ready():
+    clock = FakeClock()
+    result = _waiter(clock).until("ready", lambda: clock.now >= 0.1 and "done", timeout=1.0)
+    assert result == "done"
+    assert 0.1 <= clock.now < 0.2
+    assert clock.sleeps[-1] > clock.sleeps[0]  # backs off
+
+
+def test_timeout_and_exceptions_count_as_not_ready():
+    clock = FakeClock()
+    waiter = _waiter(clock)
+
+    def boom():
+        raise RuntimeError("not yet")
+    assert waiter.until("never", boom, timeout=0.5) is None
+    assert clock.now == 0.5
+    assert waiter.stats()["never"]["timeouts"] == 1
+
+
+def test_learned_latency_shortens_later_waits():
+    clock = FakeClock()
+    waiter = _waiter(clock)
+    start = clock.now
+    waiter.until("dialog", lambda: clock.now - start >= 0.3, timeout=2.0)
+    first_polls = waiter.stats()["dialog"]["polls"]
+    start = clock.now
+    waiter.until("dialog", lambda: clock.now - start >= 0.3, timeout=2.0)
+    assert waiter.stats()["dialog"]["polls"] - first_polls < first_polls
+    assert waiter.learned("dialog") >= 0.3
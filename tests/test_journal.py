@@ -0,0 +1,106 @@
+import asyncio
+
+import numpy as np
+from PIL import Image
+
+import app
+from journal import (CLEAR, RECT, REDO, STROKE, TEXT, UNDO, Journal, Record, live_records, read_records,
+                     to_batch_ops)
+
+
+def _fill(j):
+    j.append("rect", box=(1, 2, 30, 40))
+    j.append("text", box=(5, 5, 90, 60), text="héllo {wörld}")
+    j.append("stroke", points=[(0, 0), (10, -3), (20, 7)])
+
+
+def test_round_trip(tmp_path):
+    j = Journal(str(tmp_path / "j.bin"))
+    _fill(j)
+    assert j.records() == [Record(RECT, (1, 2, 30, 40), None, None),
+                           Record(TEXT, (5, 5, 90, 60), "héllo {wörld}", None),
+                           Record(STROKE, None, None, [(0, 0), (10, -3), (20, 7)])]
+    assert to_batch_ops(j.records())[2] == {"op": "stroke", "points": [[0, 0], [10, -3], [20, 7]]}
+
+
+def test_torn_tail_is_dropped_and_appends_continue(tmp_path):
+    path = str(tmp_path / "j.bin")
+    j = Journal(path)
+    _fill(j)
+    j.close()
+    with open(path, "ab") as f:
+        f.write(b"\x01\x10\x00\x00\x00garbage")
+    assert len(read_records(path)[0]) == 3
+    j = Journal(path)
+    j.append("rect", box=(0, 0, 5, 5))
+    assert [r.op for r in j.records()] == [RECT, TEXT, STROKE, RECT]
+
+
+def test_clear_undo_and_redo():
+    rect = lambda n: Record(RECT, (n, n, n + 10, n + 10), None, None)  # noqa: E731
+    undo, redo = Record(UNDO, None, None, None), Record(REDO, None, None, None)
+    clear = Record(CLEAR, None, None, None)
+    assert live_records([rect(1), clear, rect(2), rect(3), undo]) == [rect(2)]
+    assert live_records([rect(1), rect(2), undo, redo]) == [rect(1), rect(2)]
+    # a new operation drops the redo branch
+    assert live_records([rect(1), rect(2), undo, rect(3), redo]) == [rect(1), rect(3)]
+    # repeats are kept, so each UNDO withdraws the record it withdrew live
+    assert live_records([rect(1), rect(1), rect(2), undo, undo]) == [rect(1)]
+
+
+def test_compaction_keeps_redo(tmp_path):
+    j = Journal(str(tmp_path / "j.bin"))
+    j.append("rect", box=(0, 0, 99, 99))
+    j.append("clear")
+    for n in range(4):
+        j.append("rect", box=(n, n, 10, 10))
+    j.append("undo")
+    j.append("undo")
+    before = live_records(j.records())
+    assert j.compact() == (8, 6)  # undone records stay, followed by their UNDOs
+    assert live_records(j.records()) == before
+    j.append("redo")
+    assert live_records(j.records()) == before + [Record(RECT, (2, 2, 10, 10), None, None)]
+
+
+def _pixels(backend):
+    return np.asarray(backend.canvas.crop((0, 0, backend.width, backend.height)))
+
+
+def test_startup_resumes_the_previous_session(raster, monkeypatch):
+    raster.draw_rectangle(10, 10, 100, 80)
+    raster.add_text("still here")
+    before = _pixels(raster)
+    # a server restart: fresh journal handle and a blank canvas
+    app._get_journal().close()
+    monkeypatch.setattr(app, "_journal", None)
+    app.set_backend("raster", width=320, height=240)
+    note = app._begin_journal_session()
+    assert "journal=resumed ops=2 replayed=True" in note
+    assert len(app._get_journal().records()) == 2
+    assert np.array_equal(_pixels(app.get_backend()), before)
+
+
+def test_startup_new_keeps_the_previous_journal(raster, monkeypatch, tmp_path):
+    raster.draw_rectangle(10, 10, 100, 80)
+    monkeypatch.setenv("MSPAINT_JOURNAL_START", "new")
+    note = app._begin_journal_session()
+    assert f"previous={tmp_path / 'journal.prev.bin'}" in note
+    assert app._get_journal().records() == []
+    assert len(Journal(str(tmp_path / "journal.prev.bin")).records()) == 1
+    raster.draw_rectangle(20, 20, 60, 60)
+    assert len(app._get_journal().records()) == 1
+
+
+def test_replay_matches_the_live_canvas(raster, tmp_path):
+    raster.draw_rectangle(10, 10, 100, 80)
+    raster.draw_rectangle(10, 10, 100, 80)
+    raster.add_text("replay me")
+    raster.draw_stroke([[0, 0], [300, 200], [50, 220]], tolerance=0)
+    raster.undo(2)
+    raster.undo(1, redo=True)
+    out = tmp_path / "replay.png"
+    status = asyncio.run(app.journal("replay", target="raster", output=str(out)))["content"][0].text
+    assert "success=True" in status
+    live = np.asarray(raster.canvas.crop((0, 0, raster.width, raster.height)))
+    assert np.array_equal(np.asarray(Image.open(out).convert("RGB")), live)
@@ -0,0 +1,39 @@
+import pytest
+
+from ai_client import parse_local
+
+
+@pytest.mark.parametrize("command", ["open paint", "Open Paint", "please launch MS Paint", "START PAINT"])
+def test_open_paint(command):
+    assert parse_local(command) == [{"tool_name": "open_paint", "args": {}}]
+
+
+def test_rectangle_defaults_and_coordinates():
+    assert parse_local("draw a rectangle") == [
+        {"tool_name": "draw_rectangle", "args": {"x1": 650, "y1": 398, "x2": 1109, "y2": 690}}]
+    assert parse_local("Draw a Rectangle from (10, 20) to (300, 400)") == [
+        {"tool_name": "draw_rectangle", "args": {"x1": 10, "y1": 20, "x2": 300, "y2": 400}}]
+
+
+@pytest.mark.parametrize("command,text", [
+    ("write hello", "hello"),
+    ("Write Hello", "Hello"),
+    ("WRITE HELLO", "HELLO"),
+    ("Type: Mixed Case", "Mixed Case"),
+    ("Add Text 'Hi, There' inside the box", "Hi, There"),
+    ('write "and then"', "and then"),
+])
+def test_text_keeps_its_case(command, text):
+    assert parse_local(command) == [{"tool_name": "add_text_in_paint", "args": {"text": text}}]
+
+
+def test_multi_clause_command():
+    actions = parse_local("Open Paint, Draw a box at 10,20,30,40 AND THEN write Done.")
+    assert [a["tool_name"] for a in actions] == ["open_paint", "draw_rectangle", "add_text_in_paint"]
+    assert actions[1]["args"] == {"x1": 10, "y1": 20, "x2": 30, "y2": 40}
+    assert actions[2]["args"] == {"text": "Done"}
+
+
+@pytest.mark.parametrize("command", ["", "paint a sunset", "draw a circle and write hi"])
+def test_unknown_commands_go_to_the_llm(command):
+    assert parse_local(command) is None
@@ -0,0 +1,61 @@
+import pytest
+
+from plan_cache import PlanCache, normalize_command, plan_key
+
+
+@pytest.mark.parametrize("a,b", [
+    ("Draw a BOX.", "draw a box"),
+    ("  open   paint  ", "open paint"),
+    ('Write "Hi" and DRAW a box!', 'write "Hi" and draw a box'),
+])
+def test_commands_that_share_a_key(a, b):
+    assert normalize_command(a) == normalize_command(b)
+    assert plan_key(a, "1", "m") == plan_key(b, "1", "m")
+
+
+@pytest.mark.parametrize("a,b", [
+    ("write Hello", "write HELLO"),
+    ('write "Hello"', 'write "hello"'),
+    ("add text: Mixed Case, then draw a box", "add text: mixed case, then draw a box"),
+    ("write Hello!", "write Hello"),
+])
+def test_literal_text_keeps_its_case(a, b):
+    assert plan_key(a, "1", "m") != plan_key(b, "1", "m")
+
+
+def test_key_covers_prompt_version_and_model():
+    assert plan_key("draw a box", "1", "m") != plan_key("draw a box", "2", "m")
+    assert plan_key("draw a box", "1", "m") != plan_key("draw a box", "1", "other")
+
+
+def test_hit_miss_and_expiry():
+    now = [1000.0]
+    cache = PlanCache(ttl=60, clock=lambda: now[0])
+    key = plan_key("draw a box", "1", "m")
+    assert cache.get(key) is None
+    cache.put(key, [{"tool_name": "draw_rectangle", "args": {}}], "draw a box")
+    assert cache.get(key) == [{"tool_name": "draw_rectangle", "args": {}}]
+    now[0] += 61
+    assert cache.get(key) is None
+    st = cache.stats()
+    assert (st["hits"], st["misses"], st["expired"]) == (1, 2, 1)
+
+
+def test_disk_store_survives_restart(tmp_path):
+    path = tmp_path / "plans.json"
+    key = plan_key("write Hi", "1", "m")
+    PlanCache(path=str(path)).put(key, [{"tool_name": "add_text_in_paint", "args": {"text": "Hi"}}])
+    fresh = PlanCache(path=str(path))
+    assert fresh.get(key) == [{"tool_name": "add_text_in_paint", "args": {"text": "Hi"}}]
+    assert fresh.stats()["disk_hits"] == 1
+
+
+def test_disk_store_is_trimmed_to_the_most_recent(tmp_path):
+    now = [0.0]
+    cache = PlanCache(path=str(tmp_path / "plans.json"), max_entries=3, clock=lambda: now[0])
+    keys = [plan_key(f"draw box {i}", "1", "m") for i in range(5)]
+    for key in keys:
+        now[0] += 1
+        cache.put(key, [])
+    fresh = PlanCache(path=str(tmp_path / "plans.json"), clock=lambda: now[0])
+    assert [fresh.get(k) is not None for k in keys] == [False, False, True, True, True]
@@ -0,0 +1,92 @@
+import concurrent.futures
+import contextvars
+import time
+
+import pytest
+
+from app import UIQueueFull, _SessionScheduler
+
+
+class ManualDispatch:
+    """Executor stand-in: records what was dispatched and completes it on demand."""
+
+    def __init__(self):
+        self.started = []  # (label, inner future)
+        self.finished = []
+
+    def __call__(self, fn, args, kwargs, deadline):
+        inner = concurrent.futures.Future()
+        self.started.append((fn(*args, **kwargs), inner))
+        return inner
+
+    def finish_next(self):
+        label, inner = self.started[len(self.finished)]
+        self.finished.append(label)
+        inner.set_result(label)
+
+
+def test_sessions_are_served_round_robin_in_order():
+    dispatch = ManualDispatch()
+    sched = _SessionScheduler(dispatch, max_inflight=1)
+    futures = [sched.submit("a", lambda i=i: f"a{i}") for i in range(3)]
+    futures += [sched.submit("b", lambda i=i: f"b{i}") for i in range(2)]
+    futures += [sched.submit("c", lambda: "c0")]
+    while len(dispatch.finished) < len(futures):
+        dispatch.finish_next()
+    assert dispatch.finished == ["a0", "b0", "c0", "a1", "b1", "a2"]
+    assert [f.result(1) for f in futures] == ["a0", "a1", "a2", "b0", "b1", "c0"]
+
+
+def test_one_request_in_flight_per_session():
+    dispatch = ManualDispatch()
+    sched = _SessionScheduler(dispatch, max_inflight=8)
+    sched.submit("a", lambda: "a0")
+    sched.submit("a", lambda: "a1")
+    sched.submit("b", lambda: "b0")
+    assert [label for label, _ in dispatch.started] == ["a0", "b0"]
+    dispatch.finish_next()
+    assert [label for label, _ in dispatch.started] == ["a0", "b0", "a1"]
+
+
+def test_admission_limits():
+    sched = _SessionScheduler(ManualDispatch(), max_inflight=1, max_per_session=2, max_pending=3)
+    sched.submit("a", lambda: "running")
+    sched.submit("a", lambda: "a1")
+    sched.submit("a", lambda: "a2")
+    with pytest.raises(UIQueueFull):
+        sched.submit("a", lambda: "a3")
+    sched.submit("b", lambda: "b0")
+    with pytest.raises(UIQueueFull):
+        sched.submit("c", lambda: "c0")
+    assert sched.stats()["rejected"] == 2
+
+
+def test_expired_requests_are_not_dispatched():
+    dispatch = ManualDispatch()
+    sched = _SessionScheduler(dispatch, max_inflight=1)
+    sched.submit("a", lambda: "a0")
+    late = sched.submit("b", lambda: "b0", deadline=time.monotonic() - 1)
+    dispatch.finish_next()
+    with pytest.raises(TimeoutError):
+        late.result(1)
+    assert [label for label, _ in dispatch.started] == ["a0"]
+
+
+def test_calls_see_the_submitters_context():
+    var = contextvars.ContextVar("session", default="none")
+    dispatch = ManualDispatch()
+    sched = _SessionScheduler(dispatch, max_inflight=1)
+    var.set("client-7")
+    sched.submit("a", var.get)
+    assert dispatch.started[0][0] == "client-7"
+
+
+def test_forget_drops_closed_sessions():
+    dispatch = ManualDispatch()
+    sched = _SessionScheduler(dispatch, max_inflight=1)
+    sched.submit("a", lambda: "a0")
+    sched.forget("a")  # still running: kept
+    assert sched.stats()["sessions"] == 1
+    dispatch.finish_next()
+    sched.forget("a")
+    assert sched.stats()["sessions"] == 0
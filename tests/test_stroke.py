@@ -0,0 +1,60 @@
+import math
+import random
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import app
+
+
+def _wobbly(n, seed=7):
+    rng = random.Random(seed)
+    return [(i // 3, 120 + round(40 * math.sin(i / 25) + rng.uniform(-2, 2))) for i in range(n)]
+
+
+def _distance(p, a, b):
+    """Distance from ``p`` to segment ``a``-``b``."""
+    (px, py), (ax, ay), (bx, by) = p, a, b
+    dx, dy = bx - ax, by - ay
+    seg2 = dx * dx + dy * dy
+    t = 0.0 if seg2 == 0 else max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / seg2))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def test_rdp_keeps_end_points_and_stays_within_tolerance():
+    points = _wobbly(900)
+    for tolerance in (0.5, 1.0, 3.0):
+        kept = app._simplify_rdp(points, tolerance)
+        assert kept[0] == points[0] and kept[-1] == points[-1]
+        assert 2 <= len(kept) < len(points)
+        # every dropped point lies within tolerance of the span replacing it
+        span = 0
+        for p in points:
+            while span < len(kept) - 2 and p == kept[span + 1]:
+                span += 1
+            assert _distance(p, kept[span], kept[span + 1]) <= tolerance + 1e-9
+            if p == kept[span + 1]:
+                span += 1
+
+
+def test_rdp_collapses_duplicates():
+    points = [(0, 0), (0, 0), (5, 1), (5, 1), (5, 1), (10, 0), (10, 0)]
+    assert app._simplify_rdp(points, 0) == [(0, 0), (5, 1), (10, 0)]
+    assert app._simplify_rdp(points, 2.0) == [(0, 0), (10, 0)]
+    assert app._simplify_rdp([(3, 3), (3, 3)], 1.0) == [(3, 3)]
+
+
+def test_rdp_handles_very_long_strokes():
+    # a zig-zag keeps every corner: recursive RDP would go 5000 frames deep
+    points = [(i, (i % 2) * 50) for i in range(5000)]
+    assert app._simplify_rdp(points, 1.0) == points
+
+
+def test_raster_stroke_matches_a_reference_line(raster):
+    points = [(x * 0.8, y) for x, y in _wobbly(400)] + [(319, 0), (0, 239)]
+    status = raster.draw_stroke(points, tolerance=1.5)
+    assert "success=True" in status
+    reference = Image.new("RGB", (raster.width, raster.height), (255, 255, 255))
+    ImageDraw.Draw(reference).line(app._simplify_rdp(points, 1.5), fill=(0, 0, 0), width=1)
+    live = raster.canvas.crop((0, 0, raster.width, raster.height))
+    assert np.array_equal(np.asarray(live), np.asarray(reference))
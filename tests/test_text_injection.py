@@ -0,0 +1,82 @@
+import pytest
+
+from text_injection import (KEYEVENTF_KEYUP, KEYEVENTF_UNICODE, VK_RETURN, FakeSink, InjectionEngine,
+                            PartialInjection, choose, escape_keys, key_events)
+
+ALL = ("events", "clipboard", "keys")
+
+
+def test_choose_by_length_content_and_caps():
+    assert choose("short", ALL) == ["unicode", "clipboard", "typed"]
+    assert choose("x" * 400, ALL) == ["clipboard", "unicode", "typed"]
+    assert choose("emoji \U0001F600", ALL)[0] == "clipboard"
+    assert choose("short", ("keys",)) == ["typed"]
+
+
+def test_key_events():
+    assert key_events("a\r\n") == [(0, ord("a"), KEYEVENTF_UNICODE),
+                                   (0, ord("a"), KEYEVENTF_UNICODE | KEYEVENTF_KEYUP),
+                                   (VK_RETURN, 0, 0), (VK_RETURN, 0, KEYEVENTF_KEYUP)]
+    assert len(key_events("\U0001F600")) == 4  # surrogate pair
+
+
+def test_escape_keys():
+    assert escape_keys("{a}+b\n") == "{{}a{}}{+}b{ENTER}"
+
+
+@pytest.mark.parametrize("strategy", ["unicode", "clipboard", "typed"])
+def test_every_strategy_delivers_the_text(strategy):
+    text = "Label {x} +1 é中\nnext\tline \U0001F600"
+    sink = FakeSink()
+    res = InjectionEngine().inject(sink, text, [strategy])
+    assert res["strategy"] == strategy
+    assert sink.text == text
+
+
+def test_long_text_is_pasted_and_faster():
+    text = "0123456789" * 200
+    engine = InjectionEngine()
+    pasted = engine.inject(FakeSink(), text)
+    typed = engine.inject(FakeSink(), text, ["unicode"])
+    assert pasted["strategy"] == "clipboard"
+    assert pasted["chars_per_sec"] > typed["chars_per_sec"]
+
+
+def test_falls_back_when_nothing_was_sent():
+    sink = FakeSink(fail={"send_events"})
+    res = InjectionEngine().inject(sink, "hi")
+    assert res["strategy"] == "clipboard"
+    assert res["failures"] == ["unicode:send_events failed"]
+    assert sink.text == "hi"
+
+
+def test_clipboard_is_restored_when_paste_fails():
+    sink = FakeSink(clipboard="user data", fail={"paste"}, caps=("clipboard",))
+    with pytest.raises(OSError):
+        InjectionEngine().inject(sink, "hi")
+    assert sink.clipboard == "user data"
+
+
+class _Flaky(FakeSink):
+    """Accepts the first ``ok`` send_events batches, then fails."""
+
+    def __init__(self, ok, **kwargs):
+        super().__init__(**kwargs)
+        self.ok = ok
+
+    def send_events(self, events):
+        if self.ok == 0:
+            raise OSError("input blocked")
+        self.ok -= 1
+        return super().send_events(events)
+
+
+def test_partial_input_is_reported_not_retyped():
+    sink = _Flaky(1)
+    engine = InjectionEngine(batch_chars=10)
+    with pytest.raises(PartialInjection) as info:
+        engine.inject(sink, "x" * 25)
+    assert (info.value.delivered, info.value.total) == (10, 25)
+    assert sink.text == "x" * 10
+    assert "paste" not in sink.calls
+    assert engine.stats()["unicode"]["failures"] == 1
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import app
+from app import UIQueueFull, _UIExecutor
+
+
+def test_calls_run_in_order_on_one_thread():
+    ex = _UIExecutor()
+    futures = [ex.submit(lambda i=i: (i, threading.current_thread().name)) for i in range(5)]
+    results = [f.result(5) for f in futures]
+    assert [i for i, _ in results] == list(range(5))
+    assert {name for _, name in results} == {"paint-ui"}
+
+
+def test_full_queue_expiry_and_cancellation():
+    ex = _UIExecutor(max_queue=2)
+    release = threading.Event()
+    running = ex.submit(release.wait, 5)
+    while ex.stats()["running"] is None:
+        time.sleep(0.005)
+    expired = ex.submit(lambda: "late", deadline=time.monotonic() - 1)
+    cancelled = ex.submit(lambda: "never")
+    with pytest.raises(UIQueueFull):
+        ex.submit(lambda: "no room")
+    assert cancelled.cancel()
+    release.set()
+    assert running.result(5) is True
+    with pytest.raises(TimeoutError):
+        expired.result(5)
+    st = ex.stats()
+    assert (st["rejected"], st["expired"]) == (1, 1)
+
+
+def test_event_loop_stays_free_during_ui_work():
+    async def run():
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(app._run_ui(time.sleep, 0.2), ticker())
+        return ticks
+    ticks = asyncio.run(run())
+    assert ticks[-1] - ticks[0] < 0.15  # the ticker never waited for the blocking call
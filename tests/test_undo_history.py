@@ -0,0 +1,91 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+import app
+from undo_history import UndoHistory, tight_delta
+
+
+def _part(box=(100, 50, 140, 90), dot=(10, 20)):
+    before = Image.new("RGB", (box[2] - box[0], box[3] - box[1]), "white")
+    after = before.copy()
+    ImageDraw.Draw(after).point(dot, fill="black")
+    return box, before, after
+
+
+def test_tight_delta_keeps_only_changed_pixels():
+    box, before, after = _part()
+    tight, b, a = tight_delta(box, before, after)
+    assert tight == (110, 70, 111, 71)
+    assert b.size == a.size == (1, 1)
+    assert tight_delta(box, before, before.copy()) is None
+
+
+def test_undo_redo_order_and_fork():
+    h = UndoHistory()
+    first, second = h.record("rect", parts=[_part()]), h.record("text", parts=[_part(dot=(1, 1))])
+    assert h.undo() is second and h.undo() is first and h.undo() is None
+    assert h.redo() is first
+    third = h.record("stroke")  # drops the redo branch
+    assert h.redo() is None
+    assert [e["seq"] for e in h.entries()[0]] == [third.seq, first.seq]
+
+
+def test_byte_cap_evicts_oldest_but_keeps_newest():
+    h = UndoHistory(max_bytes=1)
+    h.record("rect", parts=[_part()])
+    newest = h.record("rect", parts=[_part(dot=(3, 3))])
+    st = h.stats()
+    assert (st["undo_steps"], st["evicted"]) == (1, 1)
+    assert h.undo() is newest
+
+
+def test_step_cap():
+    h = UndoHistory(max_steps=3)
+    for _ in range(5):
+        h.record("rect")
+    assert h.stats()["undo_steps"] == 3
+
+
+def test_put_back_restores_the_popped_entry():
+    h = UndoHistory()
+    first, second = h.record("rect"), h.record("text")
+    assert h.undo() is second
+    assert h.undo() is first
+    h.put_back(first)
+    assert [e["seq"] for e in h.entries()[0]] == [first.seq]
+    assert [e["seq"] for e in h.entries()[1]] == [second.seq]
+    assert h.redo() is second
+    h.put_back(second, redo=True)
+    assert h.redo() is second
+
+
+def test_failed_undo_keeps_the_entry(raster, monkeypatch):
+    raster.draw_rectangle(10, 10, 100, 80)
+    raster.add_text("keep me")
+
+    def broken(entry, redo):
+        raise RuntimeError("paste failed")
+
+    monkeypatch.setattr(raster, "_revert", broken)
+    assert "success=False label=text error=paste failed" in raster.undo()
+    assert [e["label"] for e in app._history.entries()[0]] == ["text", "rect"]
+    assert app._history.entries()[1] == []
+
+
+def test_raster_undo_redo_is_pixel_exact(raster):
+    snap = lambda: np.asarray(raster.canvas.crop((0, 0, raster.width, raster.height))).copy()  # noqa: E731
+    blank = snap()
+    raster.draw_rectangle(10, 10, 200, 120)
+    one = snap()
+    raster.add_text("undo me")
+    raster.draw_stroke([[0, 0], [319, 239]], tolerance=0)
+    three = snap()
+    assert "success=True" in raster.undo(2)
+    assert np.array_equal(snap(), one)
+    assert [s.kind for s in app._scene.shapes()] == ["rect"]
+    raster.undo(2, redo=True)
+    assert np.array_equal(snap(), three)
+    assert len(app._scene.shapes()) == 3
+    raster.undo(5)
+    assert np.array_equal(snap(), blank)
+    assert "nothing_to_undo" in raster.undo()
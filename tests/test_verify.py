@@ -0,0 +1,97 @@
+from PIL import Image, ImageDraw
+
+import app
+from canvas_capture import pixel_diff
+
+
+def test_pixel_diff():
+    before = Image.new("RGB", (50, 40), "white")
+    after = before.copy()
+    ImageDraw.Draw(after).rectangle([10, 5, 19, 14], fill=(250, 250, 250))
+    change = pixel_diff(before, after)
+    assert change["changed_pixels"] == 100
+    assert change["bbox"] == (10, 5, 20, 15)
+    assert change["changed_ratio"] == 100 / 2000
+    assert pixel_diff(before, after, tolerance=5)["bbox"] is None
+
+
+def test_change_bbox_is_canvas_relative(raster):
+    status = raster.draw_rectangle(10, 10, 200, 100)
+    assert "verified=True" in status
+    assert "change_bbox=(10, 10, 201, 101)" in status
+
+
+class FakeCanvas:
+    def rectangle(self):
+        return app._Rect(0, 0, 400, 300)
+
+    def drag_mouse_input(self, **kwargs):
+        pass
+
+
+class SlowPaint(app.UIABackend):
+    """Paint whose canvas shows typed text only ``lag`` screen grabs later
+    (None: never). Every fallback strategy "types" successfully."""
+
+    def __init__(self, lag):
+        self.lag = lag
+        self.screen = Image.new("RGB", (400, 300), "white")
+        self.typed = []
+        self._countdown = None
+
+    def _grab_rel(self, r, box):
+        if self._countdown is not None:
+            self._countdown -= 1
+            if self._countdown <= 0:
+                ImageDraw.Draw(self.screen).rectangle([box[0] + 8, box[1] + 8, box[0] + 30, box[1] + 16], fill="black")
+        return self.screen.crop(box)
+
+    def _type(self, attempt):
+        self.typed.append(attempt.text)
+        if self.lag is not None:
+            self._countdown = self.lag
+        return True
+
+
+for _name in app.TEXT_STRATEGIES:
+    setattr(SlowPaint, f"_text_{_name}", SlowPaint._type)
+
+
+class _InOrder:
+    def order(self, env, names):
+        return list(names)
+
+    def record(self, *args):
+        pass
+
+    def save(self):
+        pass
+
+
+def _insert(monkeypatch, backend):
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+    monkeypatch.setattr(app, "_waiter", app.AdaptiveWaiter(clock=lambda: now[0], sleep=sleep))
+    monkeypatch.setattr(app, "_strategy_ranker", _InOrder())
+    monkeypatch.setattr(app, "_text_env_key", lambda window: "fake")
+    monkeypatch.setattr(app, "_paint_state", app._PaintState())
+    return backend._insert_text(object(), FakeCanvas(), "hello")
+
+
+def test_slow_repaint_is_awaited_not_retyped(raster, monkeypatch):
+    backend = SlowPaint(lag=4)
+    status = _insert(monkeypatch, backend)
+    assert backend.typed == ["hello"]
+    assert "success=True" in status and "verified=True" in status
+    assert app._paint_state.selection == "text"
+
+
+def test_unverified_text_walks_the_chain_and_forgets_state(raster, monkeypatch):
+    backend = SlowPaint(lag=None)
+    status = _insert(monkeypatch, backend)
+    assert len(backend.typed) == len(app.TEXT_STRATEGIES)
+    assert "success=False" in status and "overlay_type_unverified" in status
+    assert app._paint_state.selection is None
+    assert app._scene.shapes() == []
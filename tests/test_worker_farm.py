@@ -0,0 +1,41 @@
+import os
+import signal
+import time
+
+import pytest
+
+from worker_farm import WorkerFarm
+
+
+def test_routing_is_sticky_and_balances_open_sessions():
+    farm = WorkerFarm(2)  # never started: routing needs no processes
+    assert (farm.route("a"), farm.route("b"), farm.route("a")) == (0, 1, 0)
+    farm.forget("a")
+    farm.forget("b")
+    assert [len(w.sessions) for w in farm._workers] == [0, 0]
+    farm.route("c")
+    farm.forget("c")
+    # closed sessions no longer count, so "d" and "e" still spread out
+    assert {farm.route("d"), farm.route("e")} == {0, 1}
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs SIGKILL")
+def test_killed_worker_recovers_its_canvas(tmp_path):
+    farm = WorkerFarm(1, "raster", {"width": 200, "height": 150}, journal_base=str(tmp_path / "j.bin"),
+                      health_interval=0).start()
+    try:
+        assert "success=True" in farm.call("s", "draw_rectangle", 10, 10, 100, 80)
+        before = farm.call("s", "grab_canvas")[0].tobytes()
+        os.kill(farm.stats()[0]["pid"], signal.SIGKILL)
+        time.sleep(0.5)
+        assert farm.call("s", "grab_canvas")[0].tobytes() == before
+        assert farm.call("s", "scene.stats")["shapes"] == 1
+        assert farm.stats()[0]["restarts"] == 1
+    finally:
+        farm.close()
+
+
+def test_live_paint_is_not_farmed_out():
+    import app
+    with pytest.raises(ValueError, match="raster"):
+        app.FarmBackend(workers=2, backend="uia")
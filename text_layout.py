@@ -0,0 +1,140 @@
+"""Text measurement and box fitting for ``add_text_in_paint``.
+
+Pillow's ``ImageFont`` is only asked for per-glyph advances, once per
+(font, size, character); the results are kept in per-size metric tables held
+in an LRU, so measuring or wrapping a paragraph is a handful of dict lookups
+instead of a render. Advances are summed without kerning, which is close
+enough for picking box sizes and line breaks.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+# Tried in order when no font is configured: Paint's default face on Windows,
+# then a common FreeType face, then Pillow's bundled default.
+DEFAULT_FONTS = ("calibri.ttf", "DejaVuSans.ttf")
+
+Layout = namedtuple("Layout", "size lines width height line_height fits")
+
+
+class FontMetrics:
+    """Glyph advances and line height of one font at one pixel size."""
+    __slots__ = ("font", "line_height", "_advances")
+
+    def __init__(self, font):
+        self.font = font
+        ascent, descent = font.getmetrics()
+        self.line_height = ascent + descent
+        self._advances = {}
+
+    def advance(self, ch: str) -> float:
+        adv = self._advances.get(ch)
+        if adv is None:
+            adv = self._advances[ch] = self.font.getlength(ch)
+        return adv
+
+    def measure(self, text: str) -> float:
+        """Width of a single line in pixels."""
+        advances = self._advances
+        total = 0.0
+        for ch in text:
+            adv = advances.get(ch)
+            total += adv if adv is not None else self.advance(ch)
+        return total
+
+    def wrap(self, text: str, width: float) -> list:
+        """Greedy word wrap to ``width`` pixels; explicit newlines are kept and
+        words longer than a line are broken between characters."""
+        space = self.advance(" ")
+        lines = []
+        for paragraph in text.split("\n"):
+            line, line_w = [], 0.0
+            for word in paragraph.split(" "):
+                word_w = self.measure(word)
+                if line and line_w + space + word_w <= width:
+                    line.append(word)
+                    line_w += space + word_w
+                    continue
+                if line:
+                    lines.append(" ".join(line))
+                    line, line_w = [], 0.0
+                while word_w > width and len(word) > 1:
+                    # split an over-long word at the last character that fits
+                    cut, acc = 1, self.advance(word[0])
+                    while cut < len(word) and acc + self.advance(word[cut]) <= width:
+                        acc += self.advance(word[cut])
+                        cut += 1
+                    lines.append(word[:cut])
+                    word = word[cut:]
+                    word_w = self.measure(word)
+                line, line_w = [word], word_w
+            lines.append(" ".join(line))
+        return lines
+
+
+class TextLayout:
+    """Measures and fits text for one font face at any pixel size."""
+
+    def __init__(self, font_path=None, max_sizes: int = 32):
+        self.font_path = font_path
+        self.max_sizes = max_sizes
+        self._lock = threading.Lock()
+        self._metrics = OrderedDict()  # size -> FontMetrics, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self, size: int):
+        from PIL import ImageFont
+        for candidate in ([self.font_path] if self.font_path else list(DEFAULT_FONTS)):
+            try:
+                return ImageFont.truetype(candidate, size)
+            except OSError:
+                continue
+        return ImageFont.load_default(size)
+
+    def metrics(self, size: int) -> FontMetrics:
+        size = int(size)
+        with self._lock:
+            m = self._metrics.get(size)
+            if m is not None:
+                self._metrics.move_to_end(size)
+                self.hits += 1
+                return m
+            self.misses += 1
+        m = FontMetrics(self._load(size))
+        with self._lock:
+            self._metrics[size] = m
+            while len(self._metrics) > self.max_sizes:
+                self._metrics.popitem(last=False)
+        return m
+
+    def font(self, size: int):
+        return self.metrics(size).font
+
+    def layout(self, text: str, size: int, max_width: float) -> Layout:
+        """Wrap ``text`` at ``size`` to ``max_width``; width/height are the block's extent."""
+        m = self.metrics(size)
+        lines = m.wrap(text, max_width)
+        width = max((m.measure(line) for line in lines), default=0.0)
+        return Layout(size, lines, int(width + 0.999), m.line_height * len(lines), m.line_height,
+                      width <= max_width)
+
+    def fit(self, text: str, width: float, height: float, max_size: int, min_size: int = 6) -> Layout:
+        """Largest size in [min_size, max_size] whose wrapped block fits
+        ``width`` x ``height`` (binary search); ``fits`` is False when even
+        ``min_size`` overflows, in which case the ``min_size`` layout is returned."""
+        lo, hi, best = min_size, max_size, None
+        while lo <= hi:
+            mid = (lo + hi) // 2
+            lay = self.layout(text, mid, width)
+            if lay.fits and lay.height <= height:
+                best, lo = lay, mid + 1
+            else:
+                hi = mid - 1
+        if best is not None:
+            return best
+        return self.layout(text, min_size, width)._replace(fits=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sizes_cached": len(self._metrics), "hits": self.hits, "misses": self.misses,
+                    "glyphs_cached": sum(len(m._advances) for m in self._metrics.values())}
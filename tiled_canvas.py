@@ -0,0 +1,245 @@
+"""Tiled RGB canvas for the headless raster backend.
+
+The canvas is split into fixed ``tile`` x ``tile`` squares that only exist
+once something is drawn on them; untouched tiles read as the background, so
+memory follows the drawn area rather than the canvas size. With a ``path``
+the tiles live in a NumPy memmap on disk and at most ``max_resident`` of them
+are held as Pillow images (least recently used are written back and
+dropped), which bounds memory by the working set even for 20k x 20k posters.
+
+Every drawing call goes through ``paint(box, fn)``, which runs ``fn`` on the
+tiles under ``box`` only and stamps them with a new version. Readers keep the
+version they last saw and ask ``changed(box, since)`` for the tile-aligned
+box that moved since then, so delta captures and incremental exports touch
+dirty tiles only.
+"""
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+
+class TiledCanvas:
+    def __init__(self, width: int, height: int, tile: int = 512, background="white", path=None,
+                 max_resident: int = 64):
+        from PIL import ImageColor
+        self.width = int(width)
+        self.height = int(height)
+        self.tile = int(tile)
+        self.background = ImageColor.getrgb(background) if isinstance(background, str) else tuple(background)
+        self.cols = math.ceil(self.width / self.tile)
+        self.rows = math.ceil(self.height / self.tile)
+        self.path = path
+        self.max_resident = max_resident
+        self._lock = threading.RLock()
+        self._tiles = OrderedDict()  # (row, col) -> PIL image, least recently used first
+        self._modified = set()  # resident tiles not yet written back to the memmap
+        self._stored = set()  # tiles that exist in the memmap
+        self._versions = {}  # (row, col) -> version of the last change
+        self._exported = {}  # export directory -> version it was last brought up to
+        self.version = 0
+        self.evictions = 0
+        self._mm = None
+        if path:
+            import numpy as np
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._mm = np.memmap(path, dtype=np.uint8, mode="w+",
+                                 shape=(self.rows, self.cols, self.tile, self.tile, 3))
+
+    # -- tile storage -----------------------------------------------------
+    def _blank(self):
+        from PIL import Image
+        return Image.new("RGB", (self.tile, self.tile), self.background)
+
+    def _get(self, key, create: bool):
+        """Tile image for ``key``; None for a never-drawn tile unless ``create``."""
+        img = self._tiles.get(key)
+        if img is not None:
+            self._tiles.move_to_end(key)
+            return img
+        if key in self._stored:
+            from PIL import Image
+            img = Image.fromarray(self._mm[key])
+        elif create:
+            img = self._blank()
+        else:
+            return None
+        self._tiles[key] = img
+        if self._mm is not None:
+            self._evict()
+        return img
+
+    def _evict(self):
+        while len(self._tiles) > self.max_resident:
+            key, img = self._tiles.popitem(last=False)
+            self._write_back(key, img)
+            self.evictions += 1
+
+    def _write_back(self, key, img):
+        import numpy as np
+        if key in self._modified:
+            self._mm[key] = np.asarray(img)
+            self._stored.add(key)
+            self._modified.discard(key)
+
+    def flush(self):
+        """Write modified resident tiles to the memmap (no-op in memory mode)."""
+        if self._mm is None:
+            return
+        with self._lock:
+            for key, img in self._tiles.items():
+                self._write_back(key, img)
+            self._mm.flush()
+
+    # -- geometry ---------------------------------------------------------
+    def clip(self, box):
+        x1, y1, x2, y2 = box
+        return (max(0, min(x1, x2)), max(0, min(y1, y2)),
+                min(self.width, max(x1, x2)), min(self.height, max(y1, y2)))
+
+    def tiles_in(self, box):
+        """(row, col) of every tile overlapping ``box`` (x1, y1, x2, y2, exclusive)."""
+        x1, y1, x2, y2 = self.clip(box)
+        if x1 >= x2 or y1 >= y2:
+            return []
+        t = self.tile
+        return [(r, c) for r in range(y1 // t, (y2 - 1) // t + 1) for c in range(x1 // t, (x2 - 1) // t + 1)]
+
+    # -- drawing ----------------------------------------------------------
+    def _apply(self, box, fn, snapshot: bool):
+        """Run ``fn(tile_image, dx, dy)`` on each tile under ``box`` and stamp
+        them with a new version. With ``snapshot`` returns ``(box, before,
+        after)`` crops of ``box`` per tile, for undo history."""
+        parts = []
+        with self._lock:
+            x1, y1, x2, y2 = self.clip(box)
+            keys = self.tiles_in(box)
+            if keys:
+                self.version += 1
+            t = self.tile
+            for key in keys:
+                img = self._get(key, create=True)
+                tx, ty = key[1] * t, key[0] * t
+                local = (max(x1, tx) - tx, max(y1, ty) - ty, min(x2, tx + t) - tx, min(y2, ty + t) - ty)
+                before = img.crop(local) if snapshot else None
+                fn(img, -tx, -ty)
+                if snapshot:
+                    parts.append(((local[0] + tx, local[1] + ty, local[2] + tx, local[3] + ty),
+                                  before, img.crop(local)))
+                self._versions[key] = self.version
+                if self._mm is not None:
+                    self._modified.add(key)
+        return parts
+
+    def paint(self, box, fn, snapshot: bool = False):
+        """Run ``fn(draw, dx, dy)`` on each tile under ``box``, where ``draw`` is
+        an ImageDraw for the tile and (dx, dy) translates canvas coordinates
+        into it. ``box`` must cover everything ``fn`` draws. With ``snapshot``
+        returns per-tile ``(box, before, after)`` crops (see ``_apply``)."""
+        from PIL import ImageDraw
+        return self._apply(box, lambda img, dx, dy: fn(ImageDraw.Draw(img), dx, dy), snapshot)
+
+    def paste(self, image, xy):
+        """Put ``image`` onto the canvas with its top-left corner at ``xy``."""
+        x, y = xy
+        self._apply((x, y, x + image.width, y + image.height),
+                    lambda img, dx, dy: img.paste(image, (x + dx, y + dy)), False)
+
+    def reset(self):
+        """Back to a blank canvas; previously drawn tiles count as changed."""
+        with self._lock:
+            self.version += 1
+            for key in set(self._tiles) | self._stored:
+                self._versions[key] = self.version
+            self._tiles.clear()
+            self._modified.clear()
+            self._stored.clear()
+
+    # -- reading ----------------------------------------------------------
+    def crop(self, box):
+        """Pixels of ``box`` as one image, assembled from the tiles under it."""
+        return self.render(box, 1.0)
+
+    def render(self, box, scale: float = 1.0):
+        """``box`` downscaled by ``scale``, resized tile by tile so only the
+        output and one tile are in memory at a time. Tile edges map to
+        floor(offset * scale), so neighbouring pieces meet without gaps."""
+        from PIL import Image
+        x1, y1, x2, y2 = self.clip(box)
+        out_w = max(1, round((x2 - x1) * scale))
+        out_h = max(1, round((y2 - y1) * scale))
+        out = Image.new("RGB", (out_w, out_h), self.background)
+        t = self.tile
+        with self._lock:
+            for key in self.tiles_in((x1, y1, x2, y2)):
+                img = self._get(key, create=False)
+                if img is None:
+                    continue  # never drawn: already background
+                tx, ty = key[1] * t, key[0] * t
+                ix1, iy1, ix2, iy2 = max(x1, tx), max(y1, ty), min(x2, tx + t), min(y2, ty + t)
+                part = img.crop((ix1 - tx, iy1 - ty, ix2 - tx, iy2 - ty))
+                if scale != 1.0:
+                    dx1, dy1 = math.floor((ix1 - x1) * scale), math.floor((iy1 - y1) * scale)
+                    dx2 = min(out_w, math.floor((ix2 - x1) * scale)) if ix2 < x2 else out_w
+                    dy2 = min(out_h, math.floor((iy2 - y1) * scale)) if iy2 < y2 else out_h
+                    if dx2 <= dx1 or dy2 <= dy1:
+                        continue
+                    out.paste(part.resize((dx2 - dx1, dy2 - dy1), Image.BOX), (dx1, dy1))
+                else:
+                    out.paste(part, (ix1 - x1, iy1 - y1))
+        return out
+
+    def changed(self, box, since: int):
+        """Tile-aligned part of ``box`` changed after version ``since``, or None."""
+        with self._lock:
+            keys = [k for k in self.tiles_in(box) if self._versions.get(k, 0) > since]
+        if not keys:
+            return None
+        t = self.tile
+        rows = [k[0] for k in keys]
+        cols = [k[1] for k in keys]
+        x1, y1, x2, y2 = self.clip(box)
+        return (max(x1, min(cols) * t), max(y1, min(rows) * t),
+                min(x2, (max(cols) + 1) * t), min(y2, (max(rows) + 1) * t))
+
+    # -- export -----------------------------------------------------------
+    def save(self, path: str):
+        """Whole canvas as one image file (assembles the full bitmap)."""
+        self.crop((0, 0, self.width, self.height)).save(path)
+
+    def export_tiles(self, directory: str) -> dict:
+        """Incremental export: write ``r{row}_c{col}.png`` for tiles changed
+        since the last export to ``directory`` plus a ``manifest.json`` listing
+        every drawn tile. Returns counts of written and skipped tiles."""
+        os.makedirs(directory, exist_ok=True)
+        key = os.path.abspath(directory)
+        with self._lock:
+            since = self._exported.get(key, 0)
+            written = 0
+            for tile_key, version in sorted(self._versions.items()):
+                if version <= since:
+                    continue
+                img = self._get(tile_key, create=False)
+                name = os.path.join(directory, f"r{tile_key[0]}_c{tile_key[1]}.png")
+                if img is None:
+                    # drawn once, cleared since: blank (edge tiles keep their real size)
+                    img = self._blank()
+                r, c = tile_key
+                img.crop((0, 0, min(self.tile, self.width - c * self.tile),
+                          min(self.tile, self.height - r * self.tile))).save(name)
+                written += 1
+            self._exported[key] = self.version
+            manifest = {"width": self.width, "height": self.height, "tile": self.tile,
+                        "background": list(self.background), "version": self.version,
+                        "tiles": [f"r{r}_c{c}.png" for r, c in sorted(self._versions)]}
+        with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        return {"written": written, "skipped": len(self._versions) - written, "version": self.version}
+
+    def stats(self) -> dict:
+        with self._lock:
+            drawn = len(set(self._tiles) | self._stored)
+            return {"tile": self.tile, "grid": f"{self.cols}x{self.rows}", "drawn_tiles": drawn,
+                    "resident_tiles": len(self._tiles), "resident_mb": round(len(self._tiles) * self.tile ** 2 * 3 / 1e6, 1),
+                    "version": self.version, "evictions": self.evictions, "memmap": self._mm is not None}
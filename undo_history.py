@@ -0,0 +1,150 @@
+"""Server-side undo/redo history of drawing operations.
+
+Each entry keeps only the pixels an operation changed, before and after, as
+zlib-compressed raw RGB (level 1: a mostly-white 300x140 text box shrinks to
+well under a kilobyte). Changes arrive as parts (one per canvas tile the
+operation touched) and every part is tightened to the pixels that actually
+differ, so a long diagonal stroke stores thin strips rather than its whole
+bounding box, and undo/redo cost time proportional to the changed area.
+Entries without parts (backends that can only replay the application's own
+undo) just carry the label and shape.
+
+The undo stack is capped by ``max_bytes`` of compressed data and
+``max_steps`` entries; the oldest history is evicted first, but the newest
+entry is always kept so the last operation stays undoable. Recording a new
+operation clears the redo stack.
+"""
+import threading
+import time
+import zlib
+
+
+class Entry:
+    """One undoable operation."""
+    __slots__ = ("seq", "label", "shape", "parts", "created")
+
+    def __init__(self, seq: int, label: str, shape=None, parts=()):
+        self.seq = seq
+        self.label = label
+        self.shape = shape  # scene Shape the operation added, if any
+        # (box, size, compressed before, compressed after) per changed region
+        self.parts = [(box, before.size, zlib.compress(before.tobytes(), 1), zlib.compress(after.tobytes(), 1))
+                      for box, before, after in parts]
+        self.created = time.time()
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(b) + len(a) for _, _, b, a in self.parts) + 128
+
+    @property
+    def has_pixels(self) -> bool:
+        return bool(self.parts)
+
+    @property
+    def box(self):
+        """Bounding box of all parts, or None."""
+        if not self.parts:
+            return None
+        boxes = [p[0] for p in self.parts]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def images(self, after: bool = False):
+        """``(box, image)`` per part: the pixels before (or after) the operation."""
+        from PIL import Image
+        for box, size, before_data, after_data in self.parts:
+            yield box, Image.frombytes("RGB", size, zlib.decompress(after_data if after else before_data))
+
+    def as_dict(self) -> dict:
+        return {"seq": self.seq, "label": self.label, "shape_id": self.shape.id if self.shape else None,
+                "box": self.box, "parts": len(self.parts), "bytes": self.nbytes if self.parts else 0}
+
+
+def tight_delta(box, before, after):
+    """Shrink ``box`` and its before/after crops to the pixels that differ.
+    Returns ``(box, before, after)`` or None if nothing changed."""
+    import numpy as np
+    a = np.asarray(before.convert("RGB"))
+    b = np.asarray(after.convert("RGB"))
+    mask = (a != b).any(axis=2)
+    if not mask.any():
+        return None
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    sub = (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+    x1, y1 = box[0], box[1]
+    return ((x1 + sub[0], y1 + sub[1], x1 + sub[2], y1 + sub[3]), before.crop(sub), after.crop(sub))
+
+
+class UndoHistory:
+    """Bounded undo stack plus redo stack of ``Entry`` objects."""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_steps: int = 1000):
+        self.max_bytes = max_bytes
+        self.max_steps = max_steps
+        self._lock = threading.Lock()
+        self._undo = []  # oldest first
+        self._redo = []  # next to redo last
+        self._bytes = 0
+        self._seq = 0
+        self.evicted = 0
+
+    def record(self, label: str, shape=None, parts=()) -> Entry:
+        """Push an operation. ``parts`` are ``(box, before, after)`` same-sized
+        crops (tightened to the changed pixels here); none for label-only entries."""
+        parts = [t for t in (tight_delta(*p) for p in parts) if t is not None]
+        with self._lock:
+            self._seq += 1
+            entry = Entry(self._seq, label, shape, parts)
+            self._undo.append(entry)
+            # a new operation forks history: the redo branch is dropped
+            self._bytes += entry.nbytes - sum(e.nbytes for e in self._redo)
+            self._redo = []
+            while len(self._undo) > 1 and (self._bytes > self.max_bytes or len(self._undo) > self.max_steps):
+                self._bytes -= self._undo.pop(0).nbytes
+                self.evicted += 1
+            return entry
+
+    def undo(self):
+        """Pop the newest entry onto the redo stack; None if there is none."""
+        with self._lock:
+            if not self._undo:
+                return None
+            entry = self._undo.pop()
+            self._redo.append(entry)
+            return entry
+
+    def redo(self):
+        with self._lock:
+            if not self._redo:
+                return None
+            entry = self._redo.pop()
+            self._undo.append(entry)
+            return entry
+
+    def put_back(self, entry: Entry, redo: bool = False):
+        """Undo a failed ``undo()``/``redo()`` of ``entry``: move that exact
+        entry back to the stack it was popped from, wherever it now sits."""
+        with self._lock:
+            moved, origin = (self._undo, self._redo) if redo else (self._redo, self._undo)
+            for i in range(len(moved) - 1, -1, -1):
+                if moved[i] is entry:
+                    del moved[i]
+                    break
+            origin.append(entry)
+
+    def clear(self):
+        with self._lock:
+            self._undo, self._redo, self._bytes = [], [], 0
+
+    def entries(self, limit: int = 20) -> tuple:
+        """``(undo, redo)`` lists of entry dicts, most recent first."""
+        with self._lock:
+            return ([e.as_dict() for e in reversed(self._undo[-limit:])],
+                    [e.as_dict() for e in reversed(self._redo[-limit:])])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"undo_steps": len(self._undo), "redo_steps": len(self._redo),
+                    "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "evicted": self.evicted}
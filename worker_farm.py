@@ -0,0 +1,274 @@
+"""Pool of drawing worker processes with sticky session routing.
+
+Each worker is a separate process that imports ``app`` and owns its own
+headless raster canvas, scene and journal, so sessions draw in parallel
+instead of queueing behind one GUI. Live Paint is not farmed out: every
+worker would attach to the same window and share one mouse and keyboard. Requests travel
+over a ``multiprocessing`` pipe as ``(request id, method, args, kwargs)``.
+A session is pinned to the worker it was first routed to (least-loaded at
+the time); a background thread pings idle workers and restarts any that
+died or stopped answering. Every started or restarted worker is sent a
+``recover`` call that replays its journal, so canvases survive both a
+worker crash and a server restart; the call holds the worker's lock, so
+health pings wait for the replay instead of timing out and restarting the
+worker again.
+"""
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+
+def _worker_main(conn, worker_id: int, backend: str, backend_kwargs: dict, env: dict, cold: bool):
+    """Entry point of a worker process: serve backend calls until told to stop.
+    A ``cold`` start (not a restart) picks up the journal like a server start;
+    the replay itself waits for the parent's ``recover`` call."""
+    os.environ.update(env)
+    import app
+    app.set_backend(backend, **backend_kwargs)
+    drawing = app.get_backend()
+    if cold:
+        app._begin_journal_session(replay=False)
+    while True:
+        try:
+            req_id, method, args, kwargs = conn.recv()
+        except (EOFError, OSError):
+            break
+        if method == "__stop__":
+            break
+        try:
+            if method == "ping":
+                result = os.getpid()
+            elif method == "recover":
+                result = _recover(app, drawing)
+            elif method.startswith("scene."):
+                result = drawing.query_scene(method[len("scene."):], *args, **kwargs)
+            else:
+                result = getattr(drawing, method)(*args, **kwargs)
+            conn.send((req_id, True, result))
+        except Exception as e:
+            conn.send((req_id, False, f"{type(e).__name__}: {e}"))
+
+
+def _recover(app, drawing) -> int:
+    """Replay the worker's journal into its fresh canvas; returns the op count."""
+    journal = app._get_journal()
+    if journal is None:
+        return 0
+    from journal import to_batch_ops
+    ops = to_batch_ops(journal.records())
+    if ops:
+        drawing.replay(ops)
+    return len(ops)
+
+
+class WorkerError(RuntimeError):
+    """A backend call raised inside a worker."""
+
+
+class WorkerLost(WorkerError):
+    """The worker died, hung past its timeout or broke the protocol; it gets restarted."""
+
+
+class _Worker:
+    def __init__(self, worker_id: int):
+        self.id = worker_id
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()  # one request in flight per pipe
+        self.sessions = set()
+        self.calls = 0
+        self.errors = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+        self.last_ok = 0.0
+
+
+class WorkerFarm:
+    """``size`` worker processes running ``backend``, with sticky routing."""
+
+    def __init__(self, size: int, backend: str = "raster", backend_kwargs=None, journal_base=None,
+                 health_interval: float = 5.0, ping_timeout: float = 5.0, call_timeout: float = 120.0,
+                 start_method: str = "spawn"):
+        self.size = max(1, int(size))
+        self.backend = backend
+        self.backend_kwargs = dict(backend_kwargs or {})
+        self.journal_base = journal_base
+        self.health_interval = health_interval
+        self.ping_timeout = ping_timeout
+        self.call_timeout = call_timeout
+        self._ctx = multiprocessing.get_context(start_method)
+        self._workers = [_Worker(i) for i in range(self.size)]
+        self._routes = {}  # session key -> worker id
+        self._route_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._stop = threading.Event()
+        self._monitor = None
+
+    # -- lifecycle --------------------------------------------------------
+    def _env(self, worker: _Worker) -> dict:
+        env = {"MSPAINT_WORKER_ID": str(worker.id)}
+        env["MSPAINT_JOURNAL"] = f"{self.journal_base}.w{worker.id}" if self.journal_base else "off"
+        return env
+
+    def _spawn(self, worker: _Worker, cold: bool = False):
+        parent, child = self._ctx.Pipe()
+        proc = self._ctx.Process(target=_worker_main, name=f"paint-worker-{worker.id}", daemon=True,
+                                 args=(child, worker.id, self.backend, self.backend_kwargs, self._env(worker),
+                                       cold))
+        proc.start()
+        child.close()
+        worker.process, worker.conn = proc, parent
+        worker.last_ok = time.monotonic()
+
+    def _kill(self, worker: _Worker):
+        if worker.conn is not None:
+            try:
+                worker.conn.close()
+            except OSError:
+                pass
+        if worker.process is not None and worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(2.0)
+            if worker.process.is_alive():
+                worker.process.kill()
+        worker.process = worker.conn = None
+
+    def _replay(self, worker: _Worker):
+        """Replay the worker's journal (caller holds ``worker.lock``)."""
+        try:
+            self._request(worker, "recover", (), {}, self.call_timeout)
+        except WorkerError:
+            worker.errors += 1  # the worker still serves, on a blank canvas
+
+    def restart(self, worker_id: int):
+        """Replace a worker and replay its journal (caller holds ``worker.lock``)."""
+        worker = self._workers[worker_id]
+        self._kill(worker)
+        self._spawn(worker)
+        worker.restarts += 1
+        self._replay(worker)
+
+    def start(self):
+        for worker in self._workers:
+            self._spawn(worker, cold=True)
+        for worker in self._workers:
+            with worker.lock:
+                self._replay(worker)
+        if self.health_interval and self._monitor is None:
+            self._monitor = threading.Thread(target=self._monitor_loop, name="paint-farm-health", daemon=True)
+            self._monitor.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        for worker in self._workers:
+            with worker.lock:
+                try:
+                    if worker.conn is not None:
+                        worker.conn.send((0, "__stop__", (), {}))
+                except OSError:
+                    pass
+                if worker.process is not None:
+                    worker.process.join(2.0)
+                self._kill(worker)
+
+    # -- routing ----------------------------------------------------------
+    def route(self, session_key: str) -> int:
+        """Worker id for ``session_key``; new sessions go to the worker with the
+        fewest open sessions (``forget`` drops closed ones)."""
+        with self._route_lock:
+            worker_id = self._routes.get(session_key)
+            if worker_id is None:
+                worker = min(self._workers, key=lambda w: (len(w.sessions), w.calls))
+                worker_id = self._routes[session_key] = worker.id
+                worker.sessions.add(session_key)
+            return worker_id
+
+    def forget(self, session_key: str):
+        with self._route_lock:
+            worker_id = self._routes.pop(session_key, None)
+            if worker_id is not None:
+                self._workers[worker_id].sessions.discard(session_key)
+
+    # -- calls ------------------------------------------------------------
+    def _request(self, worker: _Worker, method: str, args, kwargs, timeout: float):
+        req_id = next(self._ids)
+        conn = worker.conn
+        if conn is None or worker.process is None or not worker.process.is_alive():
+            raise WorkerLost(f"worker {worker.id} is not running")
+        try:
+            conn.send((req_id, method, args, kwargs))
+            if not conn.poll(timeout):
+                raise WorkerLost(f"worker {worker.id} timed out after {timeout:.0f}s in {method}")
+            got_id, ok, result = conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerLost(f"worker {worker.id} died during {method}: {e}")
+        if got_id != req_id:
+            raise WorkerLost(f"worker {worker.id} answered request {got_id}, expected {req_id}")
+        worker.last_ok = time.monotonic()
+        if not ok:
+            raise WorkerError(result)
+        return result
+
+    def call_worker(self, worker_id: int, method: str, *args, timeout=None, **kwargs):
+        worker = self._workers[worker_id]
+        with worker.lock:
+            if worker.process is not None and not worker.process.is_alive():
+                # died since the last health check: recover before serving
+                self.restart(worker_id)
+            t0 = time.perf_counter()
+            try:
+                return self._request(worker, method, args, kwargs, timeout or self.call_timeout)
+            except WorkerLost:
+                worker.errors += 1
+                # replace it; a hung worker's pipe could still deliver a late reply
+                self.restart(worker_id)
+                raise
+            except WorkerError:
+                worker.errors += 1
+                raise
+            finally:
+                worker.calls += 1
+                worker.busy_seconds += time.perf_counter() - t0
+
+    def call(self, session_key: str, method: str, *args, **kwargs):
+        """Run ``method`` on the session's backend in its worker process."""
+        return self.call_worker(self.route(session_key), method, *args, **kwargs)
+
+    # -- health -----------------------------------------------------------
+    def check_health(self) -> list:
+        """Ping idle workers; restart dead or unresponsive ones. Returns restarted ids."""
+        restarted = []
+        for worker in self._workers:
+            if worker.process is not None and not worker.process.is_alive():
+                with worker.lock:
+                    self.restart(worker.id)
+                restarted.append(worker.id)
+                continue
+            if not worker.lock.acquire(blocking=False):
+                continue  # busy with a request, which is its own liveness signal
+            try:
+                self._request(worker, "ping", (), {}, self.ping_timeout)
+            except WorkerLost:
+                self.restart(worker.id)
+                restarted.append(worker.id)
+            finally:
+                worker.lock.release()
+        return restarted
+
+    def _monitor_loop(self):
+        while not self._stop.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception:
+                pass
+
+    def stats(self) -> list:
+        now = time.monotonic()
+        return [{"id": w.id, "pid": w.process.pid if w.process else None,
+                 "alive": bool(w.process and w.process.is_alive()), "sessions": len(w.sessions),
+                 "calls": w.calls, "errors": w.errors, "restarts": w.restarts,
+                 "busy_s": round(w.busy_seconds, 3), "last_ok_s_ago": round(now - w.last_ok, 1)}
+                for w in self._workers]